@@ -0,0 +1,276 @@
+'''Reprocesses an archive with pypros_run, running the time steps in a pool
+of worker processes.
+
+The outcome of each time step is appended to a checkpoint manifest (a
+JSON lines file) as soon as it's known, so a failing file only fails its
+time step, and an interrupted batch resumes where it left off: the time
+steps already in the manifest are skipped. If a worker is killed by a
+crash (i.e. a segmentation fault in a driver), the pool is restarted and
+the time steps it was running are run again one at a time, so only the
+one causing the crash fails.
+
+The time steps are given as file name templates formatted with each
+time, or as an explicit list. Batch file example:
+
+.. code:: json
+
+    {
+     "config": "/etc/pypros/config.json",
+     "manifest": "/out/manifest.jsonl",
+     "workers": 8,
+     "start": "2016-01-01T00:00",
+     "end": "2020-12-31T23:30",
+     "step": 30,
+     "tair": "/archive/{time:%Y/%m/%d}/tair_{time:%Y%m%d%H%M}.tif",
+     "tdew": "/archive/{time:%Y/%m/%d}/tdew_{time:%Y%m%d%H%M}.tif",
+     "dem": "/data/dem.tif",
+     "refl": "/archive/{time:%Y/%m/%d}/refl_{time:%Y%m%d%H%M}.tif",
+     "out_file": "/out/{time:%Y/%m}/pros_{time:%Y%m%d%H%M}"
+    }
+
+The step is in minutes. Instead of the time range, an "items" list can
+give the name, tair, tdew, out_file and optionally dem and refl of each
+time step.
+'''
+import datetime
+import json
+import os
+import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                wait)
+from concurrent.futures.process import BrokenProcessPool
+
+from pypros.jobs import load_job_file
+
+ITEM_FILES = ['tair', 'tdew', 'dem', 'refl', 'out_file']
+
+
+def get_items(config):
+    """Returns the time steps of a batch file.
+
+    Args:
+        config (dict): The batch file content
+
+    Raises:
+        ValueError: Raised when the time steps are not properly defined
+
+    Returns:
+        list: A dict for each time step, with its name, tair, tdew, dem,
+              refl and out_file (dem and refl can be None)
+    """
+    if 'items' in config:
+        items = []
+        for position, entry in enumerate(config['items']):
+            for key in ('tair', 'tdew', 'out_file'):
+                if key not in entry:
+                    raise ValueError('The item {} has some missing key: '
+                                     '{}'.format(position, key))
+            item = {key: entry.get(key) for key in ITEM_FILES}
+            item['name'] = entry.get('name', entry['out_file'])
+            items.append(item)
+        return items
+
+    try:
+        start = datetime.datetime.fromisoformat(config['start'])
+        end = datetime.datetime.fromisoformat(config['end'])
+        step = datetime.timedelta(minutes=config['step'])
+        templates = {key: config.get(key) for key in ITEM_FILES}
+    except KeyError as err:
+        raise ValueError("The batch file has some missing key: {}".format(
+            err))
+    for key in ('tair', 'tdew', 'out_file'):
+        if templates[key] is None:
+            raise ValueError("The batch file has some missing key: "
+                             "'{}'".format(key))
+    if step <= datetime.timedelta(0):
+        raise ValueError('The batch step must be positive')
+
+    items = []
+    current = start
+    while current <= end:
+        item = {key: None if template is None else template.format(
+            time=current) for key, template in templates.items()}
+        item['name'] = current.isoformat()
+        items.append(item)
+        current += step
+    return items
+
+
+def read_manifest(manifest):
+    """Reads the outcome of the time steps already processed.
+
+    Args:
+        manifest (str): The manifest file path
+
+    Returns:
+        dict: The last record of each time step, by name. Lines
+              truncated by a crash are skipped.
+    """
+    records = {}
+    if not os.path.exists(manifest):
+        return records
+    with open(manifest) as f_p:
+        for line in f_p:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            records[record['name']] = record
+    return records
+
+
+def _ends_with_newline(file_name):
+    with open(file_name, 'rb') as f_p:
+        f_p.seek(-1, os.SEEK_END)
+        return f_p.read(1) == b'\n'
+
+
+def _run_item(item, config_file):
+    # Runs in a worker process, so the errors are returned as text
+    from pypros.cli import pypros_run
+
+    start = time.perf_counter()
+    error = None
+    try:
+        # The templates can spread the outputs in time directories
+        if os.path.dirname(item['out_file']):
+            os.makedirs(os.path.dirname(item['out_file']), exist_ok=True)
+        pypros_run(item['tair'], item['tdew'], config_file,
+                   item['out_file'], item['dem'], item['refl'])
+    except Exception as err:
+        error = '{}: {}'.format(type(err).__name__, err)
+    return error, time.perf_counter() - start
+
+
+def run_batch(config, workers=None, manifest=None, retry_failed=False,
+              callback=None):
+    """Runs the time steps of a batch file not processed yet.
+
+    Args:
+        config (str, dict): The batch file path or its content
+        workers (int, optional): Defaults to None. The number of worker
+                                 processes. If None, the batch file
+                                 'workers' value or the number of CPUs.
+        manifest (str, optional): Defaults to None. The manifest path. If
+                                  None, the batch file 'manifest' value.
+        retry_failed (bool, optional): Defaults to False. If True, the
+                                       time steps failed in previous runs
+                                       are processed again
+        callback (function, optional): Defaults to None. Called with each
+                                       record once appended to the
+                                       manifest, i.e. to show the progress
+
+    Raises:
+        ValueError: Raised when the batch file is not valid
+        FileNotFoundError: Raised when the pypros_run configuration file
+                           doesn't exist
+
+    Returns:
+        dict: The batch report: the number of time steps 'processed',
+              'failed' and 'skipped', the 'seconds' elapsed, the
+              'throughput' in time steps per second and the 'failures'
+              records
+    """
+    if isinstance(config, str):
+        config = load_job_file(config)
+    try:
+        config_file = config['config']
+        manifest = manifest or config['manifest']
+    except KeyError as err:
+        raise ValueError("The batch file has some missing key: {}".format(
+            err))
+    if not os.path.exists(config_file):
+        raise FileNotFoundError("[Errno 2] No such file or " +
+                                "directory: '{}'".format(config_file))
+    if workers is None:
+        workers = config.get('workers', os.cpu_count())
+    if workers < 1:
+        raise ValueError('The number of workers must be a positive integer')
+
+    items = get_items(config)
+    done = read_manifest(manifest)
+    pending = [item for item in items
+               if item['name'] not in done or
+               (retry_failed and done[item['name']]['status'] != 'ok')]
+
+    if os.path.dirname(manifest):
+        os.makedirs(os.path.dirname(manifest), exist_ok=True)
+    report = {'processed': 0, 'failed': 0,
+              'skipped': len(items) - len(pending), 'failures': []}
+    start = time.perf_counter()
+    with open(manifest, 'a') as f_p:
+        if f_p.tell() > 0 and not _ends_with_newline(manifest):
+            # Ends the line truncated by a crash, so it's skipped alone
+            f_p.write('\n')
+
+        def record(item, error, seconds):
+            entry = {'name': item['name'], 'out_file': item['out_file'],
+                     'status': 'ok' if error is None else 'failed',
+                     'error': error, 'seconds': round(seconds, 3)}
+            # Flushed to disk, so the checkpoint survives a crash
+            f_p.write(json.dumps(entry) + '\n')
+            f_p.flush()
+            os.fsync(f_p.fileno())
+            report['processed'] += 1
+            if error is not None:
+                report['failed'] += 1
+                report['failures'].append(entry)
+            if callback is not None:
+                callback(entry)
+
+        queue = list(reversed(pending))
+        while queue:
+            suspects = _run_pool(queue, config_file, workers, 2 * workers,
+                                 record)
+            # Run alone, so a crash only fails the time step causing it
+            suspects = [item for item, _ in reversed(suspects)]
+            while suspects:
+                for item, seconds in _run_pool(suspects, config_file, 1, 1,
+                                               record):
+                    record(item, 'The worker process died', seconds)
+
+    report['seconds'] = time.perf_counter() - start
+    report['throughput'] = report['processed'] / report['seconds'] \
+        if report['seconds'] > 0 else 0.0
+    return report
+
+
+def _run_pool(queue, config_file, workers, in_flight, record):
+    # Runs the queue (popped from the end) with a bounded number of time
+    # steps in flight. If a worker dies, the pool breaks and the time steps
+    # in flight are returned, with their elapsed seconds, unrecorded.
+    with ProcessPoolExecutor(workers) as executor:
+        running = {}
+        while queue or running:
+            while queue and len(running) < in_flight:
+                item = queue.pop()
+                running[executor.submit(_run_item, item, config_file)] = (
+                    item, time.perf_counter())
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                try:
+                    error, seconds = future.result()
+                except BrokenProcessPool:
+                    return [(item, time.perf_counter() - submitted)
+                            for item, submitted in running.values()]
+                record(running.pop(future)[0], error, seconds)
+    return []
+
+
+def format_report(report):
+    """Formats the report returned by run_batch.
+
+    Args:
+        report (dict): The batch report
+
+    Returns:
+        str: The report text
+    """
+    lines = ['{:<30} {}'.format(failure['name'], failure['error'])
+             for failure in report['failures']]
+    lines.append('Processed: {} ({} failed), skipped: {}'.format(
+        report['processed'], report['failed'], report['skipped']))
+    lines.append('Elapsed: {:.3f} s, throughput: {:.3f} time steps/s'.format(
+        report['seconds'], report['throughput']))
+
+    return '\n'.join(lines)
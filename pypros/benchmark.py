@@ -0,0 +1,288 @@
+'''Accuracy and speed comparison of the wet bulb temperature
+implementations, and I/O benchmark of the GDAL backend settings.
+
+The implementations are evaluated on a dense synthetic grid of air
+temperature, dew point depression and altitude, and compared with the
+iterative reference (trhp2tw, which solves the psychrometric equation).
+For each one, the maximum, RMS and mean errors, the error cube over the
+grid and the throughput are reported.
+
+The I/O benchmark reads DEFLATE compressed tiled GeoTIFF inputs (either
+given or synthetic ones) and runs PyPros on them with several
+GDALBackend settings: the default single threaded decoding, several
+decoding threads and the read-ahead of the next files.
+
+It can be run as a script:
+
+.. code:: console
+
+   > python -m pypros.benchmark --size 60
+   > python -m pypros.benchmark --io --io-size 4096
+   > python -m pypros.benchmark --io --files tair.tif tdew.tif dem.tif
+'''
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from pypros.psychrometrics import get_tw_sadeghi
+from pypros.psychrometrics import td2hr
+from pypros.psychrometrics import trhp2tw
+from pypros.psychrometrics import ttd2tw
+
+
+def _ttd2tw(tair, tdew, z):
+    return ttd2tw(tair, tdew)
+
+
+# Implementations called as function(tair, tdew, z)
+WET_BULB_FUNCTIONS = {'ttd2tw': _ttd2tw,
+                      'get_tw_sadeghi': get_tw_sadeghi}
+
+
+def get_test_grid(size=30, tair_range=(-20, 40), depression_range=(0, 30),
+                  z_range=(0, 3000)):
+    """Returns a dense synthetic grid of air temperature, dew point and
+    altitude.
+
+    Args:
+        size (int, optional): Defaults to 30. The number of values along
+                              the temperature and depression axes. Half of
+                              them are used along the altitude axis.
+        tair_range (tuple, optional): Defaults to (-20, 40). The air
+                                      temperature range in Celsius
+        depression_range (tuple, optional): Defaults to (0, 30). The dew
+                                            point depression range in
+                                            Celsius
+        z_range (tuple, optional): Defaults to (0, 3000). The altitude
+                                   range in metres
+
+    Returns:
+        tuple: The air temperature, dew point and altitude cubes, shaped
+               (tair, depression, z)
+    """
+    tair, depression, z = np.meshgrid(
+        np.linspace(tair_range[0], tair_range[1], size),
+        np.linspace(depression_range[0], depression_range[1], size),
+        np.linspace(z_range[0], z_range[1], max(size // 2, 2)),
+        indexing='ij')
+
+    return tair, tair - depression, z
+
+
+def _throughput(function, args, repeats):
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return args[0].size / best
+
+
+def compare_wet_bulb(functions=None, size=30, repeats=3, **grid_ranges):
+    """Compares wet bulb temperature implementations with the iterative
+    reference.
+
+    Args:
+        functions (dict, optional): Defaults to None. The implementations
+                                    to compare, by name, called as
+                                    function(tair, tdew, z). If None,
+                                    WET_BULB_FUNCTIONS is used.
+        size (int, optional): Defaults to 30. The grid size, see
+                              get_test_grid
+        repeats (int, optional): Defaults to 3. The number of timed calls,
+                                 the fastest one is used
+        **grid_ranges: The tair_range, depression_range and z_range of the
+                       grid, see get_test_grid
+
+    Returns:
+        dict: For each implementation (and the 'reference'), a dict with
+              the 'max_error', 'rms_error' and 'bias' in Celsius, the
+              'error' cube and the 'throughput' in pixels per second
+    """
+    if functions is None:
+        functions = WET_BULB_FUNCTIONS
+    tair, tdew, z = get_test_grid(size, **grid_ranges)
+    r_h = td2hr(tair, tdew)
+
+    reference = trhp2tw(tair, r_h, z)
+    results = {'reference': {
+        'max_error': 0.0, 'rms_error': 0.0, 'bias': 0.0,
+        'error': np.zeros(tair.shape),
+        'throughput': _throughput(trhp2tw, (tair, r_h, z), repeats)}}
+
+    for name, function in functions.items():
+        error = function(tair, tdew, z) - reference
+        results[name] = {
+            'max_error': float(np.nanmax(np.abs(error))),
+            'rms_error': float(np.sqrt(np.nanmean(error ** 2))),
+            'bias': float(np.nanmean(error)),
+            'error': error,
+            'throughput': _throughput(function, (tair, tdew, z), repeats)}
+
+    return results
+
+
+def _write_compressed(file_name, field):
+    from osgeo import gdal, osr
+    driver = gdal.GetDriverByName('GTiff')
+    d_s = driver.Create(file_name, field.shape[1], field.shape[0], 1,
+                        gdal.GDT_Float32,
+                        ['COMPRESS=DEFLATE', 'TILED=YES', 'PREDICTOR=3'])
+    d_s.SetGeoTransform((250000, 1000, 0, 4750000, 0, -1000))
+    proj = osr.SpatialReference()
+    proj.ImportFromEPSG(25831)
+    d_s.SetProjection(proj.ExportToWkt())
+    d_s.GetRasterBand(1).WriteArray(field)
+    d_s = None
+
+
+def get_test_files(directory, size=2048):
+    """Writes synthetic air temperature, dew point and DEM fields as
+    DEFLATE compressed tiled GeoTIFF files. The fields are smooth with
+    some noise, so they compress like NWP fields.
+
+    Args:
+        directory (str): The output directory
+        size (int, optional): Defaults to 2048. The fields size in pixels
+                              along each axis
+
+    Returns:
+        list: The tair, tdew and dem file paths
+    """
+    rows, cols = np.mgrid[0:size, 0:size] / size
+    random = np.random.default_rng(0)
+    dem = 1500 * (1 + np.sin(6 * rows) * np.cos(4 * cols))
+    tair = 15 - dem * 0.0065 + random.normal(0, 0.2, dem.shape)
+    tdew = tair - 2 - 3 * rows + random.normal(0, 0.2, dem.shape)
+
+    files = []
+    for name, field in (('tair', tair), ('tdew', tdew), ('dem', dem)):
+        files.append(os.path.join(directory, name + '.tif'))
+        _write_compressed(files[-1], field.astype(np.float32))
+
+    return files
+
+
+# GDALBackend options of each compared setting
+IO_SETTINGS = {'default': {'read_ahead': 0},
+               'threads': {'num_threads': 'ALL_CPUS', 'read_ahead': 0},
+               'threads_read_ahead': {'num_threads': 'ALL_CPUS',
+                                      'read_ahead': 2}}
+
+
+def compare_io(files=None, settings=None, size=2048, repeats=3,
+               method='single_tw'):
+    """Compares the read and the whole PyPros run times with several
+    GDALBackend settings.
+
+    Args:
+        files (list, optional): Defaults to None. The tair, tdew and dem
+                                file paths. If None, synthetic compressed
+                                files are written in a temporary directory.
+        settings (dict, optional): Defaults to None. The GDALBackend
+                                   options of each setting, by name. If
+                                   None, IO_SETTINGS is used.
+        size (int, optional): Defaults to 2048. The synthetic fields size
+        repeats (int, optional): Defaults to 3. The number of timed runs,
+                                 the fastest one is used
+        method (str, optional): Defaults to single_tw. The PyPros method
+
+    Returns:
+        dict: For each setting, a dict with the 'read' and the 'pros'
+              (read, compute and write) times in seconds
+    """
+    from pypros.io_backends import GDALBackend
+    from pypros.pros import PyPros
+
+    if settings is None:
+        settings = IO_SETTINGS
+    with tempfile.TemporaryDirectory() as directory:
+        if files is None:
+            files = get_test_files(directory, size)
+        out_file = os.path.join(directory, 'out.tif')
+
+        results = {}
+        for name, options in settings.items():
+            backend = GDALBackend(**options)
+            read, pros = np.inf, np.inf
+            for _ in range(repeats):
+                start = time.perf_counter()
+                for file_name in files:
+                    backend.read(file_name)
+                read = min(read, time.perf_counter() - start)
+
+                start = time.perf_counter()
+                inst = PyPros(files, method, backend=backend)
+                inst.save_file(inst.result, out_file)
+                pros = min(pros, time.perf_counter() - start)
+            results[name] = {'read': read, 'pros': pros}
+
+    return results
+
+
+def format_io_report(results):
+    """Formats the results of compare_io as a table.
+
+    Args:
+        results (dict): The comparison results
+
+    Returns:
+        str: The report table
+    """
+    lines = ['{:<20} {:>9} {:>9}'.format('setting', 'read (s)', 'pros (s)')]
+    for name, result in results.items():
+        lines.append('{:<20} {:>9.3f} {:>9.3f}'.format(
+            name, result['read'], result['pros']))
+
+    return '\n'.join(lines)
+
+
+def format_report(results):
+    """Formats the results of compare_wet_bulb as a table.
+
+    Args:
+        results (dict): The comparison results
+
+    Returns:
+        str: The report table
+    """
+    lines = ['{:<16} {:>9} {:>9} {:>9} {:>12}'.format(
+        'function', 'max (C)', 'rms (C)', 'bias (C)', 'Mpixels/s')]
+    for name, result in results.items():
+        lines.append('{:<16} {:>9.3f} {:>9.3f} {:>9.3f} {:>12.2f}'.format(
+            name, result['max_error'], result['rms_error'], result['bias'],
+            result['throughput'] / 1e6))
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    PARSER = argparse.ArgumentParser(description='Compares the wet bulb ' +
+                                     'temperature implementations.')
+    PARSER.add_argument('--size', type=int, default=30,
+                        help='The number of values along each grid axis')
+    PARSER.add_argument('--repeats', type=int, default=3,
+                        help='The number of timed calls')
+    PARSER.add_argument('--errors', type=str, default=None,
+                        help='A .npz file to save the error cubes')
+    PARSER.add_argument('--io', action='store_true',
+                        help='Run the GDAL I/O benchmark instead')
+    PARSER.add_argument('--io-size', type=int, default=2048,
+                        help='The synthetic compressed fields size')
+    PARSER.add_argument('--files', type=str, nargs=3, default=None,
+                        metavar=('TAIR', 'TDEW', 'DEM'),
+                        help='Compressed input files for the I/O benchmark')
+    ARGS = PARSER.parse_args()
+
+    if ARGS.io:
+        print(format_io_report(compare_io(ARGS.files, size=ARGS.io_size,
+                                          repeats=ARGS.repeats)))
+    else:
+        RESULTS = compare_wet_bulb(size=ARGS.size, repeats=ARGS.repeats)
+        print(format_report(RESULTS))
+        if ARGS.errors is not None:
+            np.savez_compressed(ARGS.errors, **{
+                name: result['error'] for name, result in RESULTS.items()})
@@ -0,0 +1,242 @@
+'''Content addressed cache of the PyPros output files, so retried or
+duplicated runs don't compute and write identical outputs again.
+
+The cache key is a hash of the content of the input files and of the run
+configuration (method, thresholds and options). Each entry is a
+directory, named after the key, holding the output files of a run. The
+entries are evicted in least recently used order when the cache exceeds
+its maximum size.
+'''
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+BLOCK_SIZE = 1 << 20
+
+
+def _copy(src, dst, link=False):
+    if os.path.isdir(dst) and not os.path.islink(dst):
+        shutil.rmtree(dst)
+    elif os.path.lexists(dst):
+        os.remove(dst)
+
+    if os.path.isdir(src):
+        shutil.copytree(src, dst,
+                        copy_function=lambda file_src, file_dst: _copy(
+                            file_src, file_dst, link))
+        return
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+
+def _size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+class ResultCache:
+    """A size bounded cache of output files in a local directory.
+    """
+    def __init__(self, path, max_size=1 << 30):
+        """
+        Args:
+            path (str): The cache directory, created if it doesn't exist
+            max_size (int, optional): Defaults to 1 GiB. The maximum size
+                                      of the cached files in bytes
+
+        Raises:
+            ValueError: Raised if the maximum size is not positive
+        """
+        if max_size <= 0:
+            raise ValueError('The cache maximum size must be positive')
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_size = max_size
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def hash_file(self, file_name):
+        """Returns the hash of a file content, or of all the files of a
+        directory (i.e. a Zarr store). The hashes are kept in memory while
+        the files don't change. GDAL virtual files (/vsi paths) are hashed
+        from their bands checksums.
+
+        Args:
+            file_name (str): The file or directory path
+
+        Raises:
+            FileNotFoundError: Raised if the file doesn't exist
+
+        Returns:
+            str: The hexadecimal hash
+        """
+        if file_name.startswith('/vsi'):
+            return self._hash_gdal(file_name)
+        if os.path.isdir(file_name):
+            digest = hashlib.sha256()
+            for root, dirs, names in os.walk(file_name):
+                dirs.sort()
+                for name in sorted(names):
+                    path = os.path.join(root, name)
+                    digest.update(os.path.relpath(path, file_name).encode())
+                    digest.update(self.hash_file(path).encode())
+            return digest.hexdigest()
+
+        stat = os.stat(file_name)
+        memo = (file_name, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if memo in self._hashes:
+                return self._hashes[memo]
+
+        digest = hashlib.sha256()
+        with open(file_name, 'rb') as f_p:
+            for block in iter(lambda: f_p.read(BLOCK_SIZE), b''):
+                digest.update(block)
+        with self._lock:
+            self._hashes[memo] = digest.hexdigest()
+        return self._hashes[memo]
+
+    @staticmethod
+    def _hash_gdal(file_name):
+        from osgeo import gdal
+        d_s = gdal.Open(file_name)
+        if d_s is None:
+            raise FileNotFoundError("[Errno 2] No such file or " +
+                                    "directory: '{}'".format(file_name))
+        digest = hashlib.sha256(json.dumps(
+            [d_s.GetGeoTransform(), d_s.GetProjection(),
+             [d_s.GetRasterBand(i + 1).Checksum()
+              for i in range(d_s.RasterCount)]]).encode())
+        return digest.hexdigest()
+
+    def key(self, files, config):
+        """Returns the cache key of a run.
+
+        Args:
+            files (list): The input file paths. None values are skipped.
+            config (dict): The run configuration (method, thresholds and any
+                           option changing the outputs), JSON serializable
+
+        Returns:
+            str: The hexadecimal key
+        """
+        digest = hashlib.sha256(json.dumps(config, sort_keys=True,
+                                           default=str).encode())
+        for file_name in files:
+            if file_name is not None:
+                digest.update(self.hash_file(file_name).encode())
+        return digest.hexdigest()
+
+    def outputs(self, key):
+        """Returns the names of the outputs cached for a key.
+
+        Args:
+            key (str): The cache key
+
+        Returns:
+            list: The outputs names, None if the key is not cached
+        """
+        try:
+            return sorted(os.listdir(os.path.join(self.path, key)))
+        except FileNotFoundError:
+            return None
+
+    def get(self, key, outputs, link=False):
+        """Copies the cached output files of a key to their destinations.
+
+        Args:
+            key (str): The cache key
+            outputs (dict): The destination path of each cached output,
+                            by output name
+            link (bool, optional): Defaults to False. If True, the files
+                                   are hard linked instead of copied when
+                                   possible. The outputs must not be
+                                   modified in place then.
+
+        Returns:
+            bool: True if all the outputs were cached
+        """
+        entry = os.path.join(self.path, key)
+        if not all(os.path.lexists(os.path.join(entry, name))
+                   for name in outputs):
+            return False
+
+        for name, file_name in outputs.items():
+            _copy(os.path.join(entry, name), file_name, link)
+        try:
+            # Recently used entries are evicted last
+            os.utime(entry)
+        except FileNotFoundError:
+            pass
+        return True
+
+    def put(self, key, outputs):
+        """Stores the output files of a run and evicts the least recently
+        used entries if the cache is too big.
+
+        Args:
+            key (str): The cache key
+            outputs (dict): The path of each output file, by output name
+        """
+        entry = os.path.join(self.path, key)
+        # Written aside and renamed, so readers never see partial entries
+        tmp_entry = tempfile.mkdtemp(prefix='.tmp_', dir=self.path)
+        try:
+            for name, file_name in outputs.items():
+                _copy(file_name, os.path.join(tmp_entry, name))
+        except OSError:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            raise
+        if os.path.exists(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # Stored at the same time by another run
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """Returns the cache entries, the least recently used first.
+
+        Returns:
+            list: The (key, last use time, size in bytes) of each entry
+        """
+        entries = []
+        for key in os.listdir(self.path):
+            entry = os.path.join(self.path, key)
+            if key.startswith('.tmp_') or not os.path.isdir(entry):
+                continue
+            try:
+                entries.append((key, os.stat(entry).st_mtime, _size(entry)))
+            except FileNotFoundError:
+                pass
+        return sorted(entries, key=lambda entry: entry[1])
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits its
+        maximum size.
+
+        Returns:
+            list: The removed keys
+        """
+        entries = self.entries()
+        total = sum(size for _, _, size in entries)
+        removed = []
+        for key, _, size in entries:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(os.path.join(self.path, key), ignore_errors=True)
+            total -= size
+            removed.append(key)
+        return removed
@@ -0,0 +1,106 @@
+'''Categorical representation of the precipitation type classes returned
+by PyPros.refl_mask: names, colors and a compact 4-bit packed archive
+format.
+'''
+import numpy as np
+
+# Class value of the pixels without valid data
+NODATA_CLASS = 255
+
+CATEGORY_NAMES = ['dry',
+                  'rain 1 dBZ', 'rain 5 dBZ', 'rain 10 dBZ', 'rain 15 dBZ',
+                  'rain 25 dBZ',
+                  'sleet 1 dBZ', 'sleet 5 dBZ', 'sleet 10 dBZ',
+                  'sleet 15 dBZ', 'sleet 25 dBZ',
+                  'snow 1 dBZ', 'snow 5 dBZ', 'snow 10 dBZ', 'snow 15 dBZ',
+                  'snow 25 dBZ']
+
+# RGBA colors of the classes, the dry class is transparent
+CLASS_COLORS = [(0, 0, 0, 0),
+                (170, 230, 255, 255), (110, 190, 250, 255),
+                (50, 140, 240, 255), (20, 90, 210, 255),
+                (10, 40, 160, 255),
+                (255, 235, 150, 255), (255, 205, 90, 255),
+                (255, 170, 40, 255), (240, 125, 20, 255),
+                (200, 80, 0, 255),
+                (250, 200, 250, 255), (240, 150, 240, 255),
+                (220, 100, 220, 255), (180, 50, 190, 255),
+                (130, 10, 150, 255)]
+
+
+def pack_classes(classes):
+    """Packs a classes field into 4 bits per pixel, two pixels per byte.
+    NoData pixels are packed as dry, use get_nodata_mask to keep them.
+
+    Args:
+        classes (numpy array): The classes field, values from 0 to 15
+
+    Returns:
+        numpy array: The packed uint8 1D array
+    """
+    flat = np.where(classes == NODATA_CLASS, 0, classes).astype(np.uint8)
+    flat = flat.reshape(-1)
+    if flat.size % 2:
+        flat = np.append(flat, np.uint8(0))
+
+    return (flat[0::2] << 4) | flat[1::2]
+
+
+def unpack_classes(packed, shape):
+    """Unpacks a classes field packed with pack_classes.
+
+    Args:
+        packed (numpy array): The packed uint8 1D array
+        shape (tuple): The classes field shape
+
+    Returns:
+        numpy array: The uint8 classes field
+    """
+    flat = np.empty(packed.size * 2, dtype=np.uint8)
+    flat[0::2] = packed >> 4
+    flat[1::2] = packed & 15
+
+    return flat[:int(np.prod(shape))].reshape(shape)
+
+
+def save_archive(file_name, classes, geotransform, projection):
+    """Saves a classes field into a compressed archive (.npz) with 4 bits
+    per pixel, plus a 1 bit mask of the NoData pixels if there are any.
+
+    Args:
+        file_name (str): The output file path
+        classes (numpy array): The classes field
+        geotransform (tuple): The field geotransform
+        projection (str): The field projection, as WKT
+    """
+    nodata = classes == NODATA_CLASS
+    arrays = {'packed': pack_classes(classes),
+              'shape': np.array(classes.shape),
+              'geotransform': np.array(geotransform, dtype=float),
+              'projection': np.array(projection)}
+    if nodata.any():
+        arrays['nodata'] = np.packbits(nodata)
+
+    with open(file_name, 'wb') as f_p:
+        np.savez_compressed(f_p, **arrays)
+
+
+def load_archive(file_name):
+    """Loads a classes field saved with save_archive.
+
+    Args:
+        file_name (str): The archive file path
+
+    Returns:
+        tuple: The uint8 classes field, its geotransform and its projection
+    """
+    with np.load(file_name) as archive:
+        shape = tuple(archive['shape'])
+        classes = unpack_classes(archive['packed'], shape)
+        if 'nodata' in archive:
+            nodata = np.unpackbits(archive['nodata'],
+                                   count=classes.size).reshape(shape)
+            classes[nodata.astype(bool)] = NODATA_CLASS
+
+        return (classes, tuple(archive['geotransform']),
+                str(archive['projection']))
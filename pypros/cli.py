@@ -0,0 +1,463 @@
+'''Command line entry points: pypros_run, pypros_jobs, pypros_batch and
+pypros_server.
+
+Only the standard library and the methods registry are imported until
+the arguments and the configuration are validated, so a wrong invocation
+fails in milliseconds. NumPy, GDAL and the PyPros modules are imported
+just before they are used. With --timings, the time spent in each step
+(validation, imports, calculation and output) is printed to the standard
+error.
+'''
+import argparse
+import json
+import os
+import sys
+import time
+
+from pypros.methods import get_method
+
+
+class Timer:
+    """Records the time spent in each step of a command.
+    """
+    def __init__(self):
+        self.last = time.perf_counter()
+        self.steps = []
+
+    def step(self, name):
+        """Records the time elapsed since the previous step.
+
+        Args:
+            name (str): The step name
+        """
+        now = time.perf_counter()
+        self.steps.append((name, now - self.last))
+        self.last = now
+
+    def report(self):
+        """Returns the steps times as text.
+        """
+        lines = ['{:<12} {:>9.3f} s'.format(name, seconds)
+                 for name, seconds in self.steps]
+        lines.append('{:<12} {:>9.3f} s'.format(
+            'total', sum(seconds for _, seconds in self.steps)))
+        return '\n'.join(lines)
+
+
+def check_config(config, tair, tdew, dem=None, refl=None):
+    '''Validates the pypros_run configuration and the input files, without
+    reading them.
+
+    Args:
+        config (dict): The configuration
+        tair (str): The air temperature field file path
+        tdew (str): The dew point temperature field file path
+        dem (str): The Digital Elevation Model file path. Default to None
+        refl (str): The radar reflectivity field file path. Default to None
+
+    Raises:
+        ValueError: Raised when the configuration is not valid
+        FileNotFoundError: Raised when an input file doesn't exist
+
+    Returns:
+        list: The variables files
+    '''
+    try:
+        method = config['method']
+        threshold = config['threshold']
+        data_format = config['data_format']
+        refl_masked = config['refl_masked']
+    except KeyError as err:
+        raise ValueError("The configuration file has some " +
+                         "missing key: {}".format(err))
+
+    variables_file = [tair, tdew]
+    if dem is not None:
+        variables_file.append(dem)
+    if len(variables_file) != len(data_format['vars_files']):
+        raise ValueError("The 'vars_file' key from data_format " +
+                         "argument is not properly set.")
+
+    ros_method = get_method(method)
+    config['threshold'] = ros_method.check_threshold(threshold)
+    ros_method.check_variables(data_format['vars_files'])
+
+    preview = config.get('preview')
+    if preview is not None and (not isinstance(preview, int) or
+                                isinstance(preview, bool) or preview < 1):
+        raise ValueError("The preview resolution factor must be a " +
+                         "positive integer")
+
+    if refl_masked == "True" and refl is None:
+        raise ValueError("The refl_masked parameter was set to " +
+                         "True, but no reflectivity field is " +
+                         "supplied")
+
+    for file_name in (variables_file + [refl] +
+                      _threshold_files(config['threshold'])):
+        # GDAL virtual file systems can't be checked
+        if (file_name is not None and not file_name.startswith('/vsi')
+                and not os.path.exists(file_name)):
+            raise FileNotFoundError("[Errno 2] No such file or " +
+                                    "directory: '{}'".format(file_name))
+
+    return variables_file
+
+
+def _threshold_files(threshold):
+    # The rasters of the thresholds varying by pixel
+    if not isinstance(threshold, dict):
+        return []
+    return [threshold.get('file', threshold.get('regions'))]
+
+
+def pypros_run(tair, tdew, config_file, out_file, dem=None, refl=None,
+               timer=None, bbox=None, bbox_proj=None):
+    '''Runs the pypros program, by selecting and checking the configuration
+
+    Args:
+        tair (str): The air temperature field file path
+        tdew (str): The dew point temperature field file path
+        config_file (str): The configuration file path
+        out_file (str): The resultant file path, without extension
+        dem (str): The Digital Elevation Model file path. Default to None
+        refl (str): The radar reflectivity field file path. Default to None
+        timer (Timer): The timer recording each step. Default to None
+        bbox (list): The bounding box (x_min, y_min, x_max, y_max) to
+                     compute. Default to None, the whole fields
+        bbox_proj (str): The bounding box CRS, i.e. EPSG:4326. Default to
+                         None, the fields CRS
+    '''
+    if timer is None:
+        timer = Timer()
+
+    with open(config_file) as f_p:
+        config = json.load(f_p)
+
+    variables_file = check_config(config, tair, tdew, dem, refl)
+    method = config['method']
+    threshold = config['threshold']
+    data_format = config['data_format']
+    refl_masked = config['refl_masked']
+    timer.step('validation')
+
+    # Published or tiled outputs are not files that can be cached
+    cache = None
+    if ('cache' in config and 'publish' not in config
+            and 'tiles' not in config):
+        from pypros.cache import ResultCache
+        cache = ResultCache(config['cache']['path'],
+                            config['cache'].get('max_size', 1 << 30))
+        key = cache.key(variables_file + [refl] +
+                        _threshold_files(threshold),
+                        dict(config, cache=None, bbox=bbox,
+                             bbox_proj=bbox_proj))
+        names = cache.outputs(key)
+        if names and cache.get(key, {name: out_file + name
+                                     for name in names},
+                               config['cache'].get('link') == "True"):
+            timer.step('cache')
+            return
+        timer.step('hash')
+
+    import numpy as np
+    from pypros.pros import PyPros
+    from pypros.io_backends import get_backend, XarrayBackend
+    timer.step('imports')
+
+    if config.get('backend', 'gdal') == 'xarray':
+        # All the variables may come from the same NetCDF/Zarr cube
+        variables_file = list(dict.fromkeys(variables_file))
+        backend = XarrayBackend(
+            variables=config.get('variables'),
+            out_format=config.get('out_format', 'netcdf'),
+            chunks=config.get('chunks'),
+            lazy=config.get('lazy') == "True")
+    else:
+        # GDAL I/O tuning, see GDALBackend
+        backend = get_backend(dict(config.get('gdal', {}),
+                                   name=config.get('backend', 'gdal')))
+
+    # Only the precipitating pixels are computed
+    precip_only = (config.get('precip_only') in (True, "True") and
+                   refl is not None)
+
+    options = {'backend': backend, 'time': config.get('time'),
+               'refl': refl if precip_only else None,
+               'bbox': bbox, 'bbox_proj': bbox_proj}
+
+    if config.get('preview') is not None:
+        # A coarse result is written first, available while the full
+        # resolution one is computed
+        preview = PyPros(variables_file, method, threshold, data_format,
+                         resolution=config['preview'], **options)
+        preview.save_file(preview.result,
+                          out_file + '_preview' + backend.extension)
+        if refl_masked == "True":
+            preview.save_file(preview.refl_mask(None if precip_only
+                                                else refl),
+                              out_file + '_preview_masked' +
+                              backend.extension)
+        timer.step('preview')
+
+    inst = PyPros(variables_file, method, threshold, data_format,
+                  **options)
+    timer.step('calculation')
+
+    publishers = []
+    if 'publish' in config:
+        from pypros.publish import ResultPublisher
+        publishers.append(ResultPublisher(config['publish']['name'] +
+                                          '_result', inst.size,
+                                          np.result_type(inst.result)))
+        # The files are written in the background once published
+        inst.publish(publishers[0], inst.result,
+                     out_file + backend.extension)
+    else:
+        inst.save_file(inst.result, out_file + backend.extension)
+
+    if refl_masked == "True":
+        pros_masked = inst.refl_mask(None if precip_only else refl)
+        if publishers:
+            publishers.append(ResultPublisher(config['publish']['name'] +
+                                              '_masked', inst.size,
+                                              np.uint8))
+            inst.publish(publishers[1], pros_masked,
+                         out_file + '_masked' + backend.extension)
+        else:
+            inst.save_file(pros_masked,
+                           out_file + '_masked' + backend.extension)
+        pros_masked = np.asarray(pros_masked)
+
+        if config.get('archive') == "True":
+            from pypros.categories import save_archive
+            save_archive(out_file + '_masked.npz', pros_masked,
+                         inst.geotransform, inst.out_proj.ExportToWkt())
+
+        if 'tiles' in config:
+            from pypros.tiles import TileWriter
+            writer = TileWriter(config['tiles']['path'],
+                                config['tiles']['zooms'],
+                                config['tiles'].get('format', 'xyz'))
+            writer.write(pros_masked, inst.geotransform,
+                         inst.out_proj.ExportToWkt())
+
+    for publisher in publishers:
+        publisher.close()
+    timer.step('output')
+
+    if cache is not None:
+        names = [backend.extension]
+        if refl_masked == "True":
+            names.append('_masked' + backend.extension)
+            if config.get('archive') == "True":
+                names.append('_masked.npz')
+        if config.get('preview') is not None:
+            names.append('_preview' + backend.extension)
+            if refl_masked == "True":
+                names.append('_preview_masked' + backend.extension)
+        cache.put(key, {name: out_file + name for name in names})
+        timer.step('cache')
+
+
+def main(argv=None):
+    '''The pypros_run entry point.
+
+    Args:
+        argv (list): The command line arguments. Default to None, the
+                     process arguments
+
+    Returns:
+        int: The exit status, 0 if the run succeeded
+    '''
+    timer = Timer()
+    parser = argparse.ArgumentParser(description='Creates a GeoTIFF file ' +
+                                     'with the surface precipitation type ' +
+                                     'using the methodology chosen by the ' +
+                                     'user.')
+    parser.add_argument('tair', type=str,
+                        help='The air temperature field')
+    parser.add_argument('tdew', type=str,
+                        help='The dew point temperature field')
+    parser.add_argument('--dem', type=str, default=None,
+                        help='The Digital Elevation Model')
+    parser.add_argument('--refl', type=str, default=None,
+                        help='The radar reflectivity field')
+    parser.add_argument('--bbox', type=float, nargs=4, default=None,
+                        metavar=('X_MIN', 'Y_MIN', 'X_MAX', 'Y_MAX'),
+                        help='Compute only the bounding box')
+    parser.add_argument('--bbox-proj', type=str, default=None,
+                        help='The bounding box CRS, i.e. EPSG:4326. ' +
+                        'Defaults to the fields CRS')
+    parser.add_argument('--timings', action='store_true',
+                        help='Print the time spent in each step')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='Save the profile of the run as a Chrome ' +
+                        'trace, or as folded stacks if the file name ' +
+                        'ends with .folded')
+    parser.add_argument('config_file', type=str,
+                        help='The configuration file')
+    parser.add_argument('out_file', type=str,
+                        help='The output file path')
+    args = parser.parse_args(argv)
+
+    profiler = None
+    started = False
+    try:
+        if args.profile is not None:
+            from pypros.profiling import Profiler, get_active
+            # The profiler started by PYPROS_PROFILE records the run too
+            profiler = get_active()
+            if profiler is None:
+                profiler = Profiler()
+                profiler.start()
+                started = True
+        pypros_run(args.tair, args.tdew, args.config_file, args.out_file,
+                   args.dem, args.refl, timer, args.bbox, args.bbox_proj)
+    except Exception as err:
+        print(err, file=sys.stderr)
+        return 1
+    finally:
+        if args.timings:
+            print(timer.report(), file=sys.stderr)
+        if profiler is not None:
+            if started:
+                profiler.stop()
+            profiler.save(args.profile)
+
+    return 0
+
+
+def jobs_main(argv=None):
+    '''The pypros_jobs entry point, see pypros.jobs.
+
+    Args:
+        argv (list): The command line arguments. Default to None, the
+                     process arguments
+
+    Returns:
+        int: The exit status, 0 if all the jobs succeeded
+    '''
+    parser = argparse.ArgumentParser(description='Runs the PyPros jobs ' +
+                                     'listed in a JSON or YAML job file.')
+    parser.add_argument('job_file', type=str,
+                        help='The job file')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='The number of worker threads')
+    args = parser.parse_args(argv)
+
+    try:
+        if not os.path.exists(args.job_file):
+            raise FileNotFoundError("[Errno 2] No such file or " +
+                                    "directory: '{}'".format(args.job_file))
+        from pypros.jobs import run_jobs, format_report
+        reports = run_jobs(args.job_file, args.workers)
+    except Exception as err:
+        print(err, file=sys.stderr)
+        return 1
+
+    print(format_report(reports))
+    if any(report['error'] is not None for report in reports):
+        return 1
+    return 0
+
+
+def batch_main(argv=None):
+    '''The pypros_batch entry point, see pypros.batch.
+
+    Args:
+        argv (list): The command line arguments. Default to None, the
+                     process arguments
+
+    Returns:
+        int: The exit status, 0 if all the time steps succeeded
+    '''
+    parser = argparse.ArgumentParser(description='Reprocesses the time ' +
+                                     'steps of a JSON or YAML batch file ' +
+                                     'with pypros_run, resuming from its ' +
+                                     'manifest.')
+    parser.add_argument('batch_file', type=str,
+                        help='The batch file')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='The number of worker processes')
+    parser.add_argument('--manifest', type=str, default=None,
+                        help='The manifest file, overriding the batch file')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='Process again the failed time steps')
+    parser.add_argument('--progress', action='store_true',
+                        help='Print each time step outcome')
+    args = parser.parse_args(argv)
+
+    def progress(record):
+        print('{:<30} {:>9.3f}  {}'.format(
+            record['name'], record['seconds'],
+            'ok' if record['error'] is None else record['error']),
+            file=sys.stderr)
+
+    try:
+        if not os.path.exists(args.batch_file):
+            raise FileNotFoundError("[Errno 2] No such file or " +
+                                    "directory: '{}'".format(
+                                        args.batch_file))
+        from pypros.batch import run_batch, format_report
+        report = run_batch(args.batch_file, args.workers, args.manifest,
+                           args.retry_failed,
+                           progress if args.progress else None)
+    except Exception as err:
+        print(err, file=sys.stderr)
+        return 1
+
+    print(format_report(report))
+    if report['failed'] > 0:
+        return 1
+    return 0
+
+
+def server_main(argv=None):
+    '''The pypros_server entry point, see pypros.server.
+
+    Args:
+        argv (list): The command line arguments. Default to None, the
+                     process arguments
+
+    Returns:
+        int: The exit status, 0 if the server stopped normally
+    '''
+    parser = argparse.ArgumentParser(description='Serves PyPros requests ' +
+                                     'over HTTP on a UNIX socket.')
+    parser.add_argument('config_file', type=str,
+                        help='The JSON or YAML domains file')
+    parser.add_argument('--socket', type=str, default='/tmp/pypros.sock',
+                        help='The UNIX socket path')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='The number of worker threads')
+    parser.add_argument('--queue', type=int, default=16,
+                        help='The number of requests waiting for a worker')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Log each request')
+    args = parser.parse_args(argv)
+
+    try:
+        if not os.path.exists(args.config_file):
+            raise FileNotFoundError("[Errno 2] No such file or " +
+                                    "directory: '{}'".format(
+                                        args.config_file))
+        from pypros.server import PyProsServer
+        server = PyProsServer(args.config_file, args.socket, args.workers,
+                              args.queue, args.verbose)
+    except Exception as err:
+        print(err, file=sys.stderr)
+        return 1
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
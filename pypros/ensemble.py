@@ -0,0 +1,254 @@
+'''Probabilistic precipitation type from a multi-member NWP ensemble.
+
+The members are read in batches stacked along a leading member axis, so
+the methods are computed vectorized over (member, y, x), with the
+pressure derived from the DEM computed once and broadcast over the
+members. The phase of each member is added to running per-pixel
+counters, so only one batch of members is in memory at a time.
+
+Example:
+
+.. code:: python
+
+    ens = EnsemblePros([['/data/m00/tair.tif', '/data/m00/tdew.tif'],
+                        ['/data/m01/tair.tif', '/data/m01/tdew.tif']],
+                       'single_tw', 1.5, dem='/data/dem.tif')
+    ens.save_file(ens.probabilities[PHASE_NAMES.index('snow')],
+                  '/out/p_snow.tif')
+'''
+import threading
+
+import numpy as np
+from osgeo import osr
+from pypros.io_backends import get_backend, read_ahead
+from pypros.methods import get_method
+from pypros.pros import calculate_method, read_threshold
+from pypros.psychrometrics import _get_p_from_z
+from pypros.statistics import PHASE_NAMES as _STATISTICS_PHASES
+
+# The precipitating phases, in the probabilities order
+PHASE_NAMES = _STATISTICS_PHASES[1:]
+
+
+class EnsemblePros:
+    """
+    Calculates the probability of each precipitation phase (rain, sleet
+    and snow) from the members of an NWP ensemble.
+
+    Pixels flagged as NoData (or not finite) in a member are not counted
+    for that member, and those flagged in the DEM are not computed for any
+    member. The probabilities are NaN where no member is valid, and are
+    saved as the nodata value.
+    """
+    nodata = -9999.0
+
+    def __init__(self, members, method='ks', threshold=None,
+                 data_format=None, dem=None, backend='gdal', time=None,
+                 batch_size=4):
+        """
+        Args:
+            members (list): The variables files of each member, in the
+                            data_format order. Each member can be a list of
+                            file paths or a single file path.
+
+            method (str): Defaults to ks. The precipitation type
+                          discrimination method, see PyPros
+
+            threshold (float, list, dict): Defaults to None. Threshold
+                                           value(s) of the method, which
+                                           can vary by pixel, see PyPros
+
+            data_format (dict, optional): Defaults to None. The order of the
+                                          variables in the members files.
+                                          Defaults to:
+                                          {'vars_files': ['tair', 'tdew']}
+
+            dem (str, optional): Defaults to None. The Digital Elevation
+                                 Model file path, shared by all the members
+                                 and read only once. Its NoData pixels
+                                 (i.e. the sea) are not computed.
+
+            backend (str, object, optional): Defaults to gdal. The backend
+                                             used to read the files and to
+                                             save the results, see PyPros
+
+            time (int, datetime, optional): Defaults to None. The time step
+                                            to read from the members files
+
+            batch_size (int, optional): Defaults to 4. The number of members
+                                        read and computed together. Bounds
+                                        the memory use.
+
+        Raises:
+            ValueError: Raised when the members, the method, the threshold
+                        or the data_format are not valid
+            IndexError: Raised when the fields shapes don't match
+        """
+        if data_format is None:
+            self.data_format = {'vars_files': ['tair', 'tdew']}
+        else:
+            self.data_format = data_format
+        if len(members) == 0:
+            raise ValueError('The ensemble has no members.')
+        if batch_size < 1:
+            raise ValueError('The batch size must be a positive integer')
+
+        self.ros_method = get_method(method)
+        self.threshold = self.ros_method.check_threshold(threshold)
+        self.ros_method.check_variables(self.data_format['vars_files'])
+
+        self.backend = get_backend(backend)
+        self.method = method
+        self.time = time
+        self.size = None
+        self.members = 0
+        self.counts = None
+        self.valid = None
+        self.threshold_mask = None
+        self._threshold_read = False
+        self._lock = threading.Lock()
+
+        self.pressure = None
+        self.dem_mask = None
+        if dem is not None:
+            fields, info = self.backend.read(dem)
+            self.__set_grid__(info)
+            dem_mask = np.isfinite(fields[0])
+            if info.get('mask') is not None:
+                dem_mask &= info['mask']
+            if not dem_mask.all():
+                self.dem_mask = dem_mask
+            if 'twet' in self.ros_method.inputs:
+                # Only for the computed pixels, as a 1D vector if masked
+                self.pressure = _get_p_from_z(
+                    fields[0] if self.dem_mask is None
+                    else fields[0][self.dem_mask])
+
+        # The next batch is read while the current one is computed
+        batches = [members[start:start + batch_size]
+                   for start in range(0, len(members), batch_size)]
+        for batch in read_ahead(self.__read_batch__, batches,
+                                getattr(self.backend, 'read_ahead', 0)):
+            self.__update__(*batch)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.probabilities = (self.counts /
+                                  self.valid.astype(np.float32)).astype(
+                                      np.float32)
+
+    def __set_grid__(self, info):
+        with self._lock:
+            self.__check_grid__(info)
+
+    def __check_grid__(self, info):
+        if self.size is None:
+            self.size = tuple(info['size'])
+            self.geotransform = info['geotransform']
+            self.out_proj = osr.SpatialReference()
+            self.out_proj.ImportFromWkt(info['projection'])
+            self.counts = np.zeros((len(PHASE_NAMES),) + self.size,
+                                   dtype=np.uint16)
+            self.valid = np.zeros(self.size, dtype=np.uint16)
+        elif tuple(info['size']) != self.size:
+            raise IndexError('Variables fields must have the' +
+                             ' same shape.')
+
+    def __read_member__(self, member):
+        if not isinstance(member, (list,)):
+            member = [member]
+
+        variables = []
+        valid = None
+        for layer_file in member:
+            fields, info = self.backend.read(layer_file, self.time)
+            self.__set_grid__(info)
+            variables.append(fields)
+            if info.get('mask') is not None:
+                valid = info['mask'] if valid is None else \
+                    valid & info['mask']
+        variables = np.concatenate(variables, axis=0)
+        if len(variables) != len(self.data_format['vars_files']):
+            raise ValueError("The 'vars_file' key from data_format " +
+                             "argument is not properly set.")
+
+        finite = np.isfinite(variables).all(axis=0)
+        valid = finite if valid is None else valid & finite
+
+        return variables, valid
+
+    def __read_batch__(self, members):
+        """Reads a batch of members, stacked along the first axis.
+        """
+        batch = [self.__read_member__(member) for member in members]
+        return (np.stack([variables for variables, _ in batch]),
+                np.stack([valid for _, valid in batch]))
+
+    def __update__(self, variables, valid):
+        """Computes a batch of members and adds their phases to the
+        counters.
+        """
+        if not self._threshold_read:
+            # Read once the grid is known, broadcast over the members
+            self.threshold, self.threshold_mask = read_threshold(
+                self.ros_method, self.threshold, self.backend.read,
+                self.size)
+            self._threshold_read = True
+        if self.threshold_mask is not None:
+            valid &= self.threshold_mask
+
+        vars_files = self.data_format['vars_files']
+        inputs = {name: variables[:, vars_files.index(name)]
+                  for name in ('tair', 'tdew', 'rh') if name in vars_files}
+        if self.dem_mask is None:
+            with np.errstate(invalid='ignore'):
+                result = calculate_method(self.ros_method, self.threshold,
+                                          inputs, self.pressure)
+        else:
+            # Only the pixels with a valid DEM, as (member, pixel) vectors
+            inputs = {name: field[:, self.dem_mask]
+                      for name, field in inputs.items()}
+            result = np.full(valid.shape, np.nan)
+            with np.errstate(invalid='ignore'):
+                result[:, self.dem_mask] = calculate_method(
+                    self.ros_method, self.__gather_threshold__(self.dem_mask),
+                    inputs, self.pressure)
+            valid &= self.dem_mask
+        valid &= np.isfinite(result)
+
+        phase = np.digitize(result, np.array(self.ros_method.phase_bins)) - 1
+        for value in range(len(PHASE_NAMES)):
+            np.add(self.counts[value],
+                   ((phase == value) & valid).sum(axis=0),
+                   out=self.counts[value], casting='unsafe')
+        np.add(self.valid, valid.sum(axis=0), out=self.valid,
+               casting='unsafe')
+        self.members += len(variables)
+
+    def __gather_threshold__(self, computed):
+        """Returns the threshold of the computed pixels, as 1D vectors
+        if it varies by pixel.
+        """
+        def gather(value):
+            return value[computed] if np.ndim(value) > 0 else value
+
+        if self.ros_method.threshold == 'pair':
+            return [gather(value) for value in self.threshold]
+        if self.ros_method.threshold == 'float':
+            return gather(self.threshold)
+        return self.threshold
+
+    def save_file(self, field, file_name, **kwargs):
+        """Saves a probabilities or counts field into a file. The pixels
+        without any valid member are set to the nodata value.
+
+        Args:
+            field (numpy array): The field to save
+            file_name (str): The output file path
+            **kwargs: Extra arguments passed to the backend writer
+        """
+        info = {'projection': self.out_proj.ExportToWkt(),
+                'geotransform': self.geotransform,
+                'size': self.size,
+                'nodata': self.nodata}
+        field = np.where(self.valid > 0, field, self.nodata)
+        self.backend.write(file_name, field, info, **kwargs)
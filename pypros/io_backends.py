@@ -0,0 +1,608 @@
+'''Input and output backends used by PyPros to read the variables fields
+and to write the results.
+
+Available:
+    - gdal  : Any raster format supported by GDAL (GeoTIFF, NetCDF,
+              GRIB...). Each band of a file is a field or a time step.
+    - xarray: NetCDF and Zarr cubes opened lazily with xarray. Only the
+              requested time slice of each variable is loaded.
+'''
+import importlib.util
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+from osgeo import gdal, osr
+from pypros.categories import CATEGORY_NAMES, CLASS_COLORS, NODATA_CLASS
+from pypros.psychrometrics import _is_lazy
+
+
+def get_window(geotransform, size, bbox, projection=None, bbox_proj=None):
+    """Returns the pixel window of a raster covering a bounding box, and
+    the geotransform of the window.
+
+    Args:
+        geotransform (tuple): The raster geotransform
+        size (tuple): The raster (y, x) size
+        bbox (tuple): The bounding box (x_min, y_min, x_max, y_max)
+        projection (str, optional): Defaults to None. The raster projection
+                                    as WKT, required if bbox_proj is set
+        bbox_proj (str, optional): Defaults to None. The bounding box CRS,
+                                   in any format GDAL accepts (i.e.
+                                   EPSG:4326 for longitudes and latitudes).
+                                   If None, the raster CRS.
+
+    Raises:
+        ValueError: Raised if the raster is rotated or the bounding box
+                    doesn't overlap it
+
+    Returns:
+        tuple: The (x_off, y_off, x_size, y_size) window and its
+               geotransform
+    """
+    x_min, y_min, x_max, y_max = bbox
+    if bbox_proj is not None:
+        # The edges are densified, since they are curved in the raster CRS
+        edge = np.linspace(0, 1, 21)
+        x_coords = np.concatenate([x_min + edge * (x_max - x_min),
+                                   x_min + edge * (x_max - x_min),
+                                   np.full(21, x_min), np.full(21, x_max)])
+        y_coords = np.concatenate([np.full(21, y_min), np.full(21, y_max),
+                                   y_min + edge * (y_max - y_min),
+                                   y_min + edge * (y_max - y_min)])
+        src_proj = osr.SpatialReference()
+        src_proj.SetFromUserInput(bbox_proj)
+        dst_proj = osr.SpatialReference()
+        dst_proj.ImportFromWkt(projection)
+        if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+            src_proj.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            dst_proj.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        transform = osr.CoordinateTransformation(src_proj, dst_proj)
+        points = np.array(transform.TransformPoints(
+            list(zip(x_coords.tolist(), y_coords.tolist()))))
+        x_min, y_min = points[:, 0].min(), points[:, 1].min()
+        x_max, y_max = points[:, 0].max(), points[:, 1].max()
+
+    geot = geotransform
+    if geot[2] != 0 or geot[4] != 0:
+        raise ValueError('Bounding boxes are not supported on rotated ' +
+                         'rasters')
+    # Rounded, so the boxes on the pixel edges don't add a pixel
+    cols = np.round((np.array([x_min, x_max]) - geot[0]) / geot[1], 6)
+    rows = np.round((np.array([y_min, y_max]) - geot[3]) / geot[5], 6)
+    col_0 = max(int(np.floor(cols.min())), 0)
+    col_1 = min(int(np.ceil(cols.max())), size[1])
+    row_0 = max(int(np.floor(rows.min())), 0)
+    row_1 = min(int(np.ceil(rows.max())), size[0])
+    if col_1 <= col_0 or row_1 <= row_0:
+        raise ValueError("The bounding box doesn't overlap the raster")
+
+    return ((col_0, row_0, col_1 - col_0, row_1 - row_0),
+            (geot[0] + col_0 * geot[1], geot[1], 0.0,
+             geot[3] + row_0 * geot[5], 0.0, geot[5]))
+
+
+def crop(fields, info, bbox, bbox_proj=None):
+    """Crops fields already read to a bounding box.
+
+    Args:
+        fields (numpy array): The fields, shaped (variables, y, x)
+        info (dict): The fields info, as returned by the backends read
+        bbox (tuple): The bounding box (x_min, y_min, x_max, y_max)
+        bbox_proj (str, optional): Defaults to None. The bounding box CRS,
+                                   see get_window
+
+    Raises:
+        ValueError: Raised if the bounding box doesn't overlap the fields
+
+    Returns:
+        tuple: The cropped fields (a view) and their info
+    """
+    window, geot = get_window(info['geotransform'], info['size'], bbox,
+                              info['projection'], bbox_proj)
+    rows = slice(window[1], window[1] + window[3])
+    cols = slice(window[0], window[0] + window[2])
+    info = dict(info, geotransform=geot, size=(window[3], window[2]))
+    if info.get('mask') is not None:
+        info['mask'] = info['mask'][rows, cols]
+
+    return fields[:, rows, cols], info
+
+
+def read_ahead(read, items, depth=1):
+    """Reads the items in order, while the next ones are read in
+    background threads, so the I/O and the decompression overlap with the
+    processing of each result.
+
+    Args:
+        read (function): The function reading an item
+        items (list): The items to read, such as file paths
+        depth (int, optional): Defaults to 1. The number of items read
+                               ahead. 0 reads each item when requested.
+
+    Yields:
+        object: The result of read for each item, in order
+    """
+    items = list(items)
+    if depth < 1 or len(items) < 2:
+        for item in items:
+            yield read(item)
+        return
+
+    with ThreadPoolExecutor(depth) as executor:
+        pending = [executor.submit(read, item) for item in items[:depth]]
+        for position in range(len(items)):
+            if position + depth < len(items):
+                pending.append(executor.submit(read,
+                                               items[position + depth]))
+            result = pending[position].result()
+            pending[position] = None
+            yield result
+
+
+class GDALBackend:
+    """Reads and writes raster files using GDAL.
+
+    Compressed files can be decoded and encoded by several threads, and
+    the block cache size can be tuned.
+    """
+    name = 'gdal'
+    extension = '.tif'
+
+    def __init__(self, cache_max=None, num_threads=None, read_ahead=1):
+        """
+        Args:
+            cache_max (int, optional): Defaults to None. The GDAL block
+                                       cache size in MB (GDAL_CACHEMAX),
+                                       shared by the whole process. If
+                                       None, the GDAL default is kept.
+            num_threads (int, str, optional): Defaults to None. The number
+                                              of threads decoding the
+                                              compressed blocks when
+                                              reading, and encoding them
+                                              when writing
+                                              (GDAL_NUM_THREADS), or
+                                              ALL_CPUS. If None, a single
+                                              thread is used.
+            read_ahead (int, optional): Defaults to 1. The number of files
+                                        PyPros reads in the background
+                                        while the previous ones are
+                                        processed. 0 disables it.
+        """
+        if cache_max is not None:
+            gdal.SetCacheMax(int(cache_max) * 1024 * 1024)
+        self.cache_max = cache_max
+        self.num_threads = None if num_threads is None else str(num_threads)
+        self.read_ahead = read_ahead
+
+    @contextmanager
+    def _config_options(self):
+        # Thread local, so concurrent reads with other settings don't mix
+        if self.num_threads is None:
+            yield
+            return
+        previous = gdal.GetThreadLocalConfigOption('GDAL_NUM_THREADS', None)
+        gdal.SetThreadLocalConfigOption('GDAL_NUM_THREADS', self.num_threads)
+        try:
+            yield
+        finally:
+            gdal.SetThreadLocalConfigOption('GDAL_NUM_THREADS', previous)
+
+    def read(self, file_name, time=None, factor=1, bbox=None,
+             bbox_proj=None):
+        """Reads the bands of a raster file.
+
+        Args:
+            file_name (str): The raster file path
+            time (int, optional): Defaults to None. The band index (starting
+                                  at 0) to read. NetCDF and GRIB time series
+                                  store each time step as a band. Single
+                                  band files, such as a DEM, are read
+                                  whatever the time. If None, all the
+                                  bands are read.
+            factor (int, optional): Defaults to 1. The decimation factor.
+                                    The bands are read into buffers
+                                    factor times smaller in each
+                                    dimension, so GDAL uses the overviews
+                                    when the file has them. The
+                                    geotransform is adjusted.
+            bbox (tuple, optional): Defaults to None. The bounding box
+                                    (x_min, y_min, x_max, y_max) to read.
+                                    Only the window of pixels covering it
+                                    is read. If None, the whole raster.
+            bbox_proj (str, optional): Defaults to None. The bounding box
+                                       CRS, see get_window
+
+        Raises:
+            FileNotFoundError: Raised when the file can't be opened
+            ValueError: Raised when the band doesn't exist or the bounding
+                        box doesn't overlap the raster
+
+        Returns:
+            tuple: The fields array, shaped (bands, y, x), and a dict with the
+                   'projection' (WKT), 'geotransform' and 'size' of the
+                   raster, and the valid pixels 'mask' (None if all the
+                   pixels are valid) from the bands NoData and mask bands
+        """
+        with self._config_options():
+            return self._read(file_name, time, factor, bbox, bbox_proj)
+
+    def _read(self, file_name, time, factor, bbox, bbox_proj):
+        d_s = gdal.Open(file_name)
+        if d_s is None:
+            raise FileNotFoundError("[Errno 2] No such file or " +
+                                    "directory: '{}'".format(file_name))
+        if time is None:
+            bands = range(d_s.RasterCount)
+        elif d_s.RasterCount == 1:
+            # Static fields, such as the DEM, have a single band
+            bands = [0]
+        elif 0 <= time < d_s.RasterCount:
+            bands = [time]
+        else:
+            raise ValueError('The band {} is out of range, the file {} '
+                             'has {} bands'.format(time, file_name,
+                                                   d_s.RasterCount))
+
+        size = (d_s.RasterYSize, d_s.RasterXSize)
+        geot = d_s.GetGeoTransform()
+        buffer = {}
+        if bbox is not None:
+            window, geot = get_window(geot, size, bbox, d_s.GetProjection(),
+                                      bbox_proj)
+            size = (window[3], window[2])
+            buffer = {'xoff': window[0], 'yoff': window[1],
+                      'win_xsize': window[2], 'win_ysize': window[3]}
+        if factor != 1:
+            window_size = size
+            size = (-(-size[0] // factor), -(-size[1] // factor))
+            buffer.update({'buf_xsize': size[1], 'buf_ysize': size[0]})
+            scale_x = window_size[1] / size[1]
+            scale_y = window_size[0] / size[0]
+            geot = (geot[0], geot[1] * scale_x, geot[2] * scale_y,
+                    geot[3], geot[4] * scale_x, geot[5] * scale_y)
+
+        fields = []
+        mask = None
+        for i in bands:
+            band = d_s.GetRasterBand(i + 1)
+            fields.append(band.ReadAsArray(**buffer))
+            if not band.GetMaskFlags() & gdal.GMF_ALL_VALID:
+                band_mask = band.GetMaskBand().ReadAsArray(**buffer) > 0
+                mask = band_mask if mask is None else mask & band_mask
+        fields = np.stack(fields)
+
+        info = {'projection': d_s.GetProjection(),
+                'geotransform': geot,
+                'size': size,
+                'mask': mask}
+        d_s = None
+
+        return fields, info
+
+    def write(self, file_name, field, info):
+        """Writes a field into a GeoTIFF file. uint8 fields are considered
+        precipitation type classes and are written as Byte, with a color
+        table, the category names and NODATA_CLASS as NoData. Other fields
+        are written as Float32.
+
+        Args:
+            file_name (str): The output file path
+            field (numpy array): The field to write
+            info (dict): The 'projection', 'geotransform' and 'size' of the
+                         field, as returned by read, and optionally its
+                         'nodata' value
+        """
+        driver = gdal.GetDriverByName('GTiff')
+        categorical = field.dtype == np.uint8
+        options = []
+        if self.num_threads is not None:
+            options.append('NUM_THREADS=' + self.num_threads)
+
+        if categorical:
+            d_s = driver.Create(file_name, info['size'][1], info['size'][0],
+                                1, gdal.GDT_Byte,
+                                ['COMPRESS=DEFLATE'] + options)
+        else:
+            d_s = driver.Create(file_name, info['size'][1], info['size'][0],
+                                1, gdal.GDT_Float32, options)
+        d_s.SetGeoTransform(info['geotransform'])
+        d_s.SetProjection(info['projection'])
+
+        band = d_s.GetRasterBand(1)
+        if categorical:
+            color_table = gdal.ColorTable()
+            for value, color in enumerate(CLASS_COLORS):
+                color_table.SetColorEntry(value, color)
+            band.SetColorTable(color_table)
+            band.SetCategoryNames(CATEGORY_NAMES)
+            band.SetNoDataValue(NODATA_CLASS)
+        elif info.get('nodata') is not None:
+            band.SetNoDataValue(info['nodata'])
+        band.WriteArray(np.asarray(field))
+        d_s = None
+
+
+class XarrayBackend:
+    """Reads and writes NetCDF or Zarr cubes using xarray. The files are
+    opened lazily, so only the selected time slice is loaded from disk.
+
+    The projection is taken from the 'crs_wkt' or 'spatial_ref' attributes
+    of the grid mapping variable, as written by GDAL or rioxarray.
+
+    With lazy=True, the fields are returned as Dask arrays and are only
+    loaded, chunk by chunk, when the results are computed or written.
+    """
+    name = 'xarray'
+
+    def __init__(self, variables=None, time_dim='time', out_format='netcdf',
+                 chunks=None, complevel=4, lazy=False):
+        """
+        Args:
+            variables (list, optional): Defaults to None. The variables to
+                                        read from each file, in order.
+                                        Files without any of them, and all
+                                        the files if None, have all their
+                                        gridded variables read.
+            time_dim (str, optional): Defaults to 'time'. The name of the
+                                      time dimension.
+            out_format (str, optional): Defaults to 'netcdf'. The output
+                                        format, netcdf or zarr.
+            chunks (tuple, optional): Defaults to None. The (y, x) chunk
+                                      shape of the output store. If None,
+                                      a single chunk is written.
+            complevel (int, optional): Defaults to 4. The NetCDF deflate
+                                       compression level.
+            lazy (bool, optional): Defaults to False. If True, the fields
+                                   are read as Dask arrays, chunked as
+                                   stored in the files.
+
+        Raises:
+            ValueError: Raised when the output format is not valid
+            ImportError: Raised when xarray, or dask if lazy, is not
+                         installed
+        """
+        if out_format not in ('netcdf', 'zarr'):
+            raise ValueError('Non valid output format. Valid values are ' +
+                             'netcdf and zarr')
+        try:
+            import xarray
+        except ImportError:
+            raise ImportError('The xarray backend requires the xarray ' +
+                              'package')
+        if lazy and importlib.util.find_spec('dask') is None:
+            raise ImportError('The lazy xarray backend requires the dask ' +
+                              'package')
+        self.xarray = xarray
+        self.variables = variables
+        self.time_dim = time_dim
+        self.out_format = out_format
+        self.extension = '.zarr' if out_format == 'zarr' else '.nc'
+        self.chunks = chunks
+        self.complevel = complevel
+        self.lazy = lazy
+
+    def _open(self, file_name):
+        # Without Dask, the variables are still loaded only when selected
+        if str(file_name).rstrip('/').endswith('.zarr'):
+            if self.lazy:
+                return self.xarray.open_zarr(file_name)
+            return self.xarray.open_zarr(file_name, chunks=None)
+        return self.xarray.open_dataset(file_name,
+                                        chunks={} if self.lazy else None)
+
+    def read(self, file_name, time=None, factor=1, bbox=None,
+             bbox_proj=None):
+        """Reads the variables of a NetCDF or Zarr file. Only the selected
+        time slice, and bounding box, is loaded.
+
+        Args:
+            file_name (str): The NetCDF or Zarr file path
+            time (int, datetime, optional): Defaults to None. The time step
+                                            to read, either its index or its
+                                            value. Required if the
+                                            variables have a time dimension
+                                            longer than one.
+            factor (int, optional): Defaults to 1. The decimation factor.
+                                    Only one of each factor rows and
+                                    columns is read.
+            bbox (tuple, optional): Defaults to None. The bounding box
+                                    (x_min, y_min, x_max, y_max) to read.
+                                    If None, the whole grid.
+            bbox_proj (str, optional): Defaults to None. The bounding box
+                                       CRS, see get_window
+
+        Raises:
+            FileNotFoundError: Raised when the file doesn't exist
+            ValueError: Raised when the time step can't be selected or the
+                        bounding box doesn't overlap the grid
+
+        Returns:
+            tuple: The fields array, shaped (variables, y, x), and a dict
+                   with the 'projection' (WKT), 'geotransform' and 'size' of
+                   the fields. Fill values are decoded as NaN, so the
+                   'mask' is always None.
+        """
+        if not os.path.exists(file_name):
+            raise FileNotFoundError("[Errno 2] No such file or " +
+                                    "directory: '{}'".format(file_name))
+        d_s = self._open(file_name)
+
+        names = []
+        if self.variables is not None:
+            names = [name for name in self.variables
+                     if name in d_s.data_vars]
+        if not names:
+            # Files without the variables, such as a separate DEM, are
+            # read whole
+            names = [name for name in d_s.data_vars
+                     if d_s[name].ndim >= 2]
+
+        y_dim, x_dim = d_s[names[0]].dims[-2:]
+        geot = self._get_geotransform(d_s[x_dim].values, d_s[y_dim].values)
+        window = (0, 0, d_s.sizes[x_dim], d_s.sizes[y_dim])
+        if bbox is not None:
+            window, geot = get_window(geot, (window[3], window[2]), bbox,
+                                      self._get_projection(d_s, names[0]),
+                                      bbox_proj)
+        if factor != 1:
+            # The decimated grid is centred on the first pixel read
+            geot = (geot[0] + geot[1] * (1 - factor) / 2, geot[1] * factor,
+                    0.0, geot[3] + geot[5] * (1 - factor) / 2, 0.0,
+                    geot[5] * factor)
+        selection = {x_dim: slice(window[0], window[0] + window[2], factor),
+                     y_dim: slice(window[1], window[1] + window[3], factor)}
+
+        fields = []
+        for name in names:
+            data = d_s[name]
+            if self.time_dim in data.dims:
+                if time is None:
+                    if data.sizes[self.time_dim] != 1:
+                        raise ValueError('The variable {} has several '
+                                         'time steps, but no time was '
+                                         'selected'.format(name))
+                    data = data.isel({self.time_dim: 0})
+                elif isinstance(time, (int, np.integer)):
+                    data = data.isel({self.time_dim: time})
+                else:
+                    data = data.sel({self.time_dim: time})
+            if data.ndim != 2:
+                raise ValueError('Variables fields must be 2D once the ' +
+                                 'time is selected.')
+            data = data.isel(selection)
+            fields.append(data.data if self.lazy else data.values)
+
+        try:
+            fields = np.stack(fields)
+        except ValueError:
+            raise ValueError('Variables fields must have the same shape.')
+
+        info = {'projection': self._get_projection(d_s, names[0]),
+                'geotransform': geot,
+                'size': fields.shape[1:],
+                'mask': None}
+        d_s.close()
+
+        return fields, info
+
+    @staticmethod
+    def _get_projection(d_s, name):
+        grid_mapping = d_s[name].attrs.get(
+            'grid_mapping', d_s[name].encoding.get('grid_mapping'))
+        for crs_name in (grid_mapping, 'spatial_ref', 'crs'):
+            if crs_name is not None and crs_name in d_s.variables:
+                attrs = d_s[crs_name].attrs
+                for key in ('crs_wkt', 'spatial_ref'):
+                    if key in attrs:
+                        return attrs[key]
+        return ''
+
+    @staticmethod
+    def _get_geotransform(x_coords, y_coords):
+        d_x = x_coords[1] - x_coords[0] if len(x_coords) > 1 else 1.0
+        d_y = y_coords[1] - y_coords[0] if len(y_coords) > 1 else -1.0
+        return (float(x_coords[0] - d_x / 2), float(d_x), 0.0,
+                float(y_coords[0] - d_y / 2), 0.0, float(d_y))
+
+    def write(self, file_name, field, info, time=None, name='pros'):
+        """Writes a field into a chunked and compressed NetCDF or Zarr store.
+        uint8 fields are considered precipitation type classes and are
+        written with CF flag attributes.
+
+        Args:
+            file_name (str): The output file or store path
+            field (numpy array): The field to write
+            info (dict): The 'projection', 'geotransform' and 'size' of the
+                         field, as returned by read, and optionally its
+                         'nodata' value
+            time (datetime, optional): Defaults to None. The field time. If
+                                       set, a time dimension is added and,
+                                       for existing Zarr stores, the field
+                                       is appended along it.
+            name (str, optional): Defaults to 'pros'. The variable name.
+        """
+        geot = info['geotransform']
+        size = info['size']
+        x_coords = geot[0] + geot[1] * (np.arange(size[1]) + 0.5)
+        y_coords = geot[3] + geot[5] * (np.arange(size[0]) + 0.5)
+
+        dims = ('y', 'x')
+        data = field if _is_lazy(field) else np.asarray(field)
+        chunks = self.chunks if self.chunks is not None else size
+        if _is_lazy(data):
+            # Each output chunk is computed and written by a single task
+            data = data.rechunk(tuple(chunks))
+        if time is not None:
+            dims = (self.time_dim,) + dims
+            data = data[np.newaxis, :, :]
+            chunks = (1,) + tuple(chunks)
+
+        attrs = {'grid_mapping': 'spatial_ref'}
+        if data.dtype == np.uint8:
+            # CF flags for the precipitation type classes
+            attrs['flag_values'] = np.arange(len(CATEGORY_NAMES),
+                                             dtype=np.uint8)
+            attrs['flag_meanings'] = ' '.join(
+                category.replace(' ', '_') for category in CATEGORY_NAMES)
+            info = dict(info, nodata=NODATA_CLASS)
+
+        d_s = self.xarray.Dataset(
+            {name: (dims, data, attrs)},
+            coords={'x': x_coords, 'y': y_coords})
+        if time is not None:
+            d_s = d_s.assign_coords({self.time_dim: [np.datetime64(time)]})
+            d_s[self.time_dim].encoding['units'] = ('seconds since ' +
+                                                    '1970-01-01 00:00:00')
+        d_s['spatial_ref'] = ((), 0, {
+            'crs_wkt': info['projection'],
+            'spatial_ref': info['projection'],
+            'GeoTransform': ' '.join(str(value) for value in geot)})
+
+        if self.out_format == 'zarr':
+            d_s[name].encoding['chunks'] = tuple(chunks)
+            if info.get('nodata') is not None:
+                d_s[name].encoding['_FillValue'] = info['nodata']
+            if time is not None and os.path.exists(file_name):
+                d_s.to_zarr(file_name, mode='a', append_dim=self.time_dim)
+            else:
+                d_s.to_zarr(file_name, mode='w')
+        else:
+            encoding = {'zlib': True, 'complevel': self.complevel,
+                        'chunksizes': tuple(chunks)}
+            if info.get('nodata') is not None:
+                encoding['_FillValue'] = info['nodata']
+            d_s.to_netcdf(file_name, encoding={name: encoding})
+
+
+BACKENDS = {'gdal': GDALBackend, 'xarray': XarrayBackend}
+
+
+def get_backend(backend):
+    """Returns a backend instance.
+
+    Args:
+        backend (str, dict, object): The backend name (gdal or xarray), a
+                                     dict with the backend 'name' and its
+                                     options, or an already configured
+                                     backend instance
+
+    Raises:
+        ValueError: Raised when the backend name is not valid
+
+    Returns:
+        object: The backend instance
+    """
+    options = {}
+    if isinstance(backend, dict):
+        options = dict(backend)
+        backend = options.pop('name', None)
+    elif not isinstance(backend, str):
+        return backend
+    try:
+        backend_class = BACKENDS[backend]
+    except KeyError:
+        raise ValueError('Non valid backend. Valid values are ' +
+                         ' and '.join(BACKENDS))
+    return backend_class(**options)
@@ -0,0 +1,387 @@
+'''Runs several PyPros jobs (domains, methods and products) described in a
+single JSON or YAML job file, in a pool of worker threads.
+
+The fields read from the files (DEMs, but also the NWP fields used by
+several methods) and the pressure derived from each DEM are kept in
+memory by domain, so they are read and computed only once per run.
+
+Job file example:
+
+.. code:: json
+
+    {
+     "workers": 4,
+     "domains": {
+        "catalonia": {"tair": "/data/cat/tair.tif",
+                      "tdew": "/data/cat/tdew.tif",
+                      "dem": "/data/cat/dem.tif",
+                      "refl": "/data/cat/refl.tif"},
+        "pyrenees": {"tair": "/data/pyr/tair.tif",
+                     "tdew": "/data/pyr/tdew.tif",
+                     "dem": "/data/pyr/dem.tif"}
+     },
+     "jobs": [
+        {"domain": "catalonia", "method": "ks", "out_file": "/out/cat_ks",
+         "products": ["result", "masked", "archive"]},
+        {"domain": "catalonia", "method": "dual_tw", "threshold": [0, 1.5],
+         "out_file": "/out/cat_dual_tw", "products": ["masked"]},
+        {"domain": "pyrenees", "method": "single_tw", "threshold": 1.0,
+         "out_file": "/out/pyr_single_tw"}
+     ]
+    }
+'''
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from pypros.io_backends import crop, get_backend
+from pypros.methods import get_method
+from pypros.profiling import span
+from pypros.psychrometrics import _get_p_from_z
+
+# Variables files a domain can define, in the data_format order
+DOMAIN_VARIABLES = ['tair', 'tdew', 'rh', 'dem']
+
+PRODUCTS = ['result', 'masked', 'archive', 'tiles']
+
+
+class CachedBackend:
+    """Wraps a backend, keeping in memory the fields read, so each file is
+    read only once even if several threads request it at the same time.
+    The cached arrays are read only. Bounding boxes are cropped from the
+    cached whole fields.
+    """
+    def __init__(self, backend):
+        """
+        Args:
+            backend (str, object): The backend name or instance, see
+                                   pypros.io_backends.get_backend
+        """
+        self.backend = get_backend(backend)
+        self.name = self.backend.name
+        self.extension = self.backend.extension
+        # Read ahead by PyPros as the wrapped backend would be
+        self.read_ahead = getattr(self.backend, 'read_ahead', 0)
+        self.reads = 0
+        self._cache = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def read(self, file_name, time=None, bbox=None, bbox_proj=None,
+             **kwargs):
+        """Reads a file with the wrapped backend, or returns the fields
+        already read.
+
+        Args:
+            file_name (str): The file path
+            time (int, datetime, optional): Defaults to None. The time step
+            bbox (tuple, optional): Defaults to None. The bounding box to
+                                    crop, see pypros.io_backends.crop
+            bbox_proj (str, optional): Defaults to None. The bounding box
+                                       CRS
+            **kwargs: Extra arguments passed to the backend read, such as
+                      the decimation factor
+
+        Returns:
+            tuple: The fields and the info dict, see the backend read
+        """
+        if bbox is not None:
+            fields, info = self.read(file_name, time, **kwargs)
+            return crop(fields, info, bbox, bbox_proj)
+
+        key = (file_name, time) + tuple(sorted(kwargs.items()))
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key not in self._cache:
+                fields, info = self.backend.read(file_name, time, **kwargs)
+                for array in (fields, info.get('mask')):
+                    if isinstance(array, np.ndarray):
+                        array.flags.writeable = False
+                self._cache[key] = (fields, info)
+                self.reads += 1
+            return self._cache[key]
+
+    def write(self, file_name, field, info, **kwargs):
+        """Writes a field with the wrapped backend.
+        """
+        self.backend.write(file_name, field, info, **kwargs)
+
+    def clear(self, keep=()):
+        """Removes the cached fields, i.e. when new files are available.
+
+        Args:
+            keep (list, optional): Defaults to (). The file paths kept in
+                                   memory, such as the DEMs
+        """
+        with self._lock:
+            for key in list(self._cache):
+                if key[0] not in keep:
+                    del self._cache[key]
+
+
+class Domain:
+    """A domain of the job file, with its variables files and the cached
+    fields and pressure shared by its jobs.
+    """
+    def __init__(self, name, config):
+        """
+        Args:
+            name (str): The domain name
+            config (dict): The domain configuration: the tair, tdew (or
+                           rh) and, optionally, dem and refl file paths,
+                           the backend (name, or dict of backend options
+                           with its 'name', gdal if missing) and the
+                           time.
+
+        Raises:
+            ValueError: Raised when the configuration is not valid
+        """
+        if 'tair' not in config or ('tdew' not in config and
+                                    'rh' not in config):
+            raise ValueError('The domain {} must define the tair and the '
+                             'tdew or rh files'.format(name))
+        self.name = name
+        self.vars_files = [var for var in DOMAIN_VARIABLES if var in config]
+        self.variables_file = [config[var] for var in self.vars_files]
+        self.refl = config.get('refl')
+        self.time = config.get('time')
+
+        backend = config.get('backend', 'gdal')
+        if isinstance(backend, dict):
+            backend = dict({'name': 'gdal'}, **backend)
+        self.backend = CachedBackend(backend)
+
+        self._pressure = None
+        self._lock = threading.Lock()
+
+    @property
+    def data_format(self):
+        return {'vars_files': self.vars_files}
+
+    @property
+    def dem(self):
+        """str: The DEM file path, None if the domain has no DEM.
+        """
+        if 'dem' not in self.vars_files:
+            return None
+        return self.variables_file[self.vars_files.index('dem')]
+
+    def get_pressure(self, bbox=None, bbox_proj=None):
+        """Returns the surface pressure derived from the domain DEM,
+        computed only once. None if the domain has no DEM.
+
+        Args:
+            bbox (tuple, optional): Defaults to None. The bounding box to
+                                    crop, see pypros.io_backends.crop
+            bbox_proj (str, optional): Defaults to None. The bounding box
+                                       CRS
+        """
+        if self.dem is None:
+            return None
+        with self._lock:
+            fields, info = self.backend.read(self.dem, self.time)
+            if self._pressure is None:
+                self._pressure = _get_p_from_z(fields[0])
+        if bbox is None:
+            return self._pressure
+        return crop(self._pressure[np.newaxis], info, bbox, bbox_proj)[0][0]
+
+
+def load_job_file(job_file):
+    """Loads a JSON or YAML (.yaml, .yml) job file.
+
+    Args:
+        job_file (str): The job file path
+
+    Raises:
+        ImportError: Raised when reading YAML without PyYAML installed
+
+    Returns:
+        dict: The job file content
+    """
+    with open(job_file) as f_p:
+        if job_file.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError('YAML job files require the PyYAML ' +
+                                  'package')
+            return yaml.safe_load(f_p)
+        return json.load(f_p)
+
+
+def check_jobs(config):
+    """Checks the job file content, so errors are raised before any job
+    runs.
+
+    Args:
+        config (dict): The job file content
+
+    Raises:
+        ValueError: Raised when the job file is not valid
+
+    Returns:
+        tuple: The domains dict and the list of jobs
+    """
+    try:
+        domains = {name: Domain(name, domain)
+                   for name, domain in config['domains'].items()}
+        jobs = config['jobs']
+    except KeyError as err:
+        raise ValueError("The job file has some missing key: {}".format(err))
+
+    for position, job in enumerate(jobs):
+        for key in ('domain', 'method', 'out_file'):
+            if key not in job:
+                raise ValueError('The job {} has some missing key: '
+                                 '{}'.format(position, key))
+        if job['domain'] not in domains:
+            raise ValueError('The job {} domain {} is not '
+                             'defined'.format(position, job['domain']))
+        ros_method = get_method(job['method'])
+        ros_method.check_threshold(job.get('threshold'))
+        ros_method.check_variables(domains[job['domain']].vars_files)
+        for product in job.get('products', ['result']):
+            if product not in PRODUCTS:
+                raise ValueError('Non valid product {}. Valid values are '
+                                 '{}'.format(product, ', '.join(PRODUCTS)))
+        if (set(job.get('products', [])) & {'masked', 'archive', 'tiles'}
+                and domains[job['domain']].refl is None):
+            raise ValueError('The job {} products need the domain '
+                             'reflectivity'.format(position))
+        if 'tiles' in job.get('products', []):
+            tiles = job.get('tiles')
+            if (not isinstance(tiles, dict) or 'path' not in tiles
+                    or 'zooms' not in tiles):
+                raise ValueError('The job {} tiles product needs the tiles '
+                                 'path and zooms'.format(position))
+            if tiles.get('format', 'xyz') not in ('xyz', 'mbtiles'):
+                raise ValueError('Non valid tile format. Valid values are ' +
+                                 'xyz and mbtiles')
+
+    return domains, jobs
+
+
+def run_job(job, domain):
+    """Runs a job and writes its products.
+
+    Args:
+        job (dict): The job configuration: domain, method, threshold,
+                    out_file (without extension), products (result, masked,
+                    archive and tiles, defaults to result), precip_only
+                    (true or "True", as in pypros_run) and tiles (path,
+                    zooms and format).
+        domain (Domain): The job domain
+
+    Returns:
+        list: The written files
+    """
+    from pypros.pros import PyPros
+
+    products = job.get('products', ['result'])
+    pressure = None
+    if 'twet' in get_method(job['method']).inputs:
+        pressure = domain.get_pressure()
+    precip_only = (job.get('precip_only') in (True, 'True') and
+                   domain.refl is not None)
+
+    inst = PyPros(domain.variables_file, job['method'], job.get('threshold'),
+                  domain.data_format, backend=domain.backend,
+                  time=domain.time,
+                  refl=domain.refl if precip_only else None,
+                  pressure=pressure)
+
+    out_file = job['out_file']
+    outputs = []
+    if 'result' in products:
+        outputs.append(out_file + domain.backend.extension)
+        inst.save_file(inst.result, outputs[-1])
+
+    if set(products) & {'masked', 'archive', 'tiles'}:
+        pros_masked = inst.refl_mask(None if precip_only else domain.refl)
+        if 'masked' in products:
+            outputs.append(out_file + '_masked' + domain.backend.extension)
+            inst.save_file(pros_masked, outputs[-1])
+        pros_masked = np.asarray(pros_masked)
+        if 'archive' in products:
+            from pypros.categories import save_archive
+            outputs.append(out_file + '_masked.npz')
+            save_archive(outputs[-1], pros_masked, inst.geotransform,
+                         inst.out_proj.ExportToWkt())
+        if 'tiles' in products:
+            from pypros.tiles import TileWriter
+            tiles = job['tiles']
+            writer = TileWriter(tiles['path'], tiles['zooms'],
+                                tiles.get('format', 'xyz'))
+            writer.write(pros_masked, inst.geotransform,
+                         inst.out_proj.ExportToWkt())
+            outputs.append(tiles['path'])
+
+    return outputs
+
+
+def run_jobs(config, workers=None):
+    """Runs all the jobs of a job file in a pool of worker threads. A
+    failing job doesn't stop the rest.
+
+    Args:
+        config (str, dict): The job file path or its content
+        workers (int, optional): Defaults to None. The number of worker
+                                 threads. If None, the job file 'workers'
+                                 value or 4 is used.
+
+    Raises:
+        ValueError: Raised when the job file is not valid
+
+    Returns:
+        list: A dict for each job, in the job file order, with its 'name',
+              'domain', 'method', 'seconds', 'outputs' and 'error' (None
+              if the job succeeded)
+    """
+    if isinstance(config, str):
+        config = load_job_file(config)
+    domains, jobs = check_jobs(config)
+    if workers is None:
+        workers = config.get('workers', 4)
+
+    def timed_job(job):
+        start = time.perf_counter()
+        report = {'name': job.get('name', job['out_file']),
+                  'domain': job['domain'], 'method': job['method'],
+                  'outputs': [], 'error': None}
+        try:
+            with span('job', job=report['name']):
+                report['outputs'] = run_job(job, domains[job['domain']])
+        except Exception as err:
+            report['error'] = str(err)
+        report['seconds'] = time.perf_counter() - start
+        return report
+
+    with ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(timed_job, jobs))
+
+
+def format_report(reports):
+    """Formats the job reports returned by run_jobs as a table.
+
+    Args:
+        reports (list): The job reports
+
+    Returns:
+        str: The report table
+    """
+    lines = ['{:<30} {:<15} {:<10} {:>9}  {}'.format(
+        'job', 'domain', 'method', 'seconds', 'status')]
+    for report in reports:
+        lines.append('{:<30} {:<15} {:<10} {:>9.3f}  {}'.format(
+            report['name'], report['domain'], report['method'],
+            report['seconds'],
+            'ok' if report['error'] is None else report['error']))
+    lines.append('Total job time: {:.3f} s'.format(
+        sum(report['seconds'] for report in reports)))
+
+    return '\n'.join(lines)
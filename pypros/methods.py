@@ -0,0 +1,245 @@
+'''Registry of the precipitation type methods available to PyPros.
+
+Each method declares the inputs its kernel needs, the schema of its
+threshold and the bins used to classify its result into rain, sleet and
+snow, so a configuration can be validated before reading any file.
+
+The kernels import the calculation modules when first called, so this
+module can be used to validate configurations without importing NumPy.
+
+Other packages can add methods with register_method, or by declaring a
+Method instance in the ``pypros.methods`` entry point group.
+'''
+from numbers import Real
+
+# Inputs PyPros can supply to the kernels
+INPUTS = ('tair', 'tdew', 'rh', 'twet')
+
+THRESHOLD_SCHEMAS = ('none', 'float', 'pair')
+
+
+class Method:
+    """A precipitation type method.
+    """
+    def __init__(self, name, kernel, inputs, threshold='none',
+                 default=None, phase_bins=(0.0, 0.5, 1.0)):
+        """
+        Args:
+            name (str): The method name
+            kernel (function): The method kernel, called as
+                               kernel(inputs, threshold), where inputs is a
+                               dict with the declared input fields. Returns
+                               the result field, 0 for rain and 1 for snow.
+            inputs (tuple): The input fields the kernel needs, from tair
+                            (air temperature), tdew (dew point), rh
+                            (relative humidity) and twet (wet bulb
+                            temperature)
+            threshold (str, optional): Defaults to none. The threshold
+                                       schema: none, float or pair (snow
+                                       and rain thresholds)
+            default (float, list, optional): Defaults to None. The
+                                             threshold used when none is
+                                             given
+            phase_bins (tuple, optional): Defaults to (0.0, 0.5, 1.0). The
+                                          lower bounds of the rain, sleet
+                                          and snow result values, used by
+                                          PyPros.refl_mask
+
+        Raises:
+            ValueError: Raised when the inputs or the threshold schema are
+                        not valid
+        """
+        for name_input in inputs:
+            if name_input not in INPUTS:
+                raise ValueError('Non valid input {}. Valid values are '
+                                 '{}'.format(name_input, ', '.join(INPUTS)))
+        if threshold not in THRESHOLD_SCHEMAS:
+            raise ValueError('Non valid threshold schema. Valid values ' +
+                             'are ' + ', '.join(THRESHOLD_SCHEMAS))
+        self.name = name
+        self.kernel = kernel
+        self.inputs = tuple(inputs)
+        self.threshold = threshold
+        self.default = default
+        self.phase_bins = tuple(phase_bins)
+
+    def check_threshold(self, threshold):
+        """Validates a threshold against the method schema.
+
+        Besides the schema values, a threshold can vary by pixel: a field
+        (a NumPy array, or a pair of them), a threshold raster ({'file':
+        path}, with the snow and rain thresholds as two bands for the pair
+        schema), or a lookup by region, with the path of a region ID raster
+        and the threshold of each region ID ({'regions': path, 'values':
+        {id: threshold}}). The files are read by PyPros.
+
+        Args:
+            threshold (float, list, dict): The threshold, or None to use the
+                                           method default
+
+        Raises:
+            ValueError: Raised when the threshold is not valid
+
+        Returns:
+            float, list, dict: The threshold to use
+        """
+        if threshold is None or self.threshold == 'none':
+            return self.default
+        if isinstance(threshold, dict):
+            return self.__check_threshold_files__(threshold)
+
+        if self.threshold == 'float':
+            if _is_field(threshold):
+                return threshold
+            if isinstance(threshold, bool) or not isinstance(threshold,
+                                                             Real):
+                raise ValueError('The threshold for the method {} must '
+                                 'be a float'.format(self.name))
+            return float(threshold)
+
+        if (not isinstance(threshold, (list, tuple)) or
+                len(threshold) != 2):
+            raise ValueError('The thresholds for the method {} must be '
+                             'a list/tuple of length two'.format(self.name))
+        wrong = threshold[1] <= threshold[0]
+        if _is_field(wrong):
+            # Not valid pixels (NaN) are not compared
+            wrong = wrong.any()
+        if wrong:
+            raise ValueError("Incorrect thresholds, th_s value must be " +
+                             "smaller than th_r")
+        return threshold
+
+    def __check_threshold_files__(self, threshold):
+        if set(threshold) == {'file'} and isinstance(threshold['file'], str):
+            return dict(threshold)
+        if (set(threshold) != {'regions', 'values'} or
+                not isinstance(threshold['regions'], str) or
+                not isinstance(threshold['values'], dict) or
+                not threshold['values']):
+            raise ValueError("The threshold files for the method {} must "
+                             "be a 'file', or the 'regions' file and the "
+                             "'values' by region ID".format(self.name))
+        values = {}
+        for region, value in threshold['values'].items():
+            try:
+                region_id = int(region)
+            except ValueError:
+                raise ValueError('Non valid region ID {}'.format(region))
+            if isinstance(value, dict) or _is_field(value):
+                raise ValueError('The threshold of the region {} must be '
+                                 'a value'.format(region))
+            values[region_id] = self.check_threshold(value)
+        return {'regions': threshold['regions'], 'values': values}
+
+    def check_variables(self, vars_files):
+        """Validates that the variables files supply the method inputs.
+
+        Args:
+            vars_files (list): The variables files names, as in the PyPros
+                               data_format
+
+        Raises:
+            ValueError: Raised when some input can't be supplied
+        """
+        available = set(vars_files)
+        if 'tair' not in available:
+            raise ValueError('The variables files must include tair')
+        humidity = set(self.inputs) - {'tair'}
+        if humidity and not available & {'tdew', 'rh'}:
+            raise ValueError('The method {} needs the tdew or rh '
+                             'variables files'.format(self.name))
+
+
+def _is_field(value):
+    # NumPy (or Dask) arrays, without importing NumPy
+    return getattr(value, 'ndim', 0) > 0
+
+
+METHODS = {}
+
+
+def register_method(method):
+    """Adds a method to the registry, replacing any method with the same
+    name.
+
+    Args:
+        method (Method): The method to add
+    """
+    METHODS[method.name] = method
+
+
+def get_method(name):
+    """Returns a registered method. If the name is not registered, the
+    methods of the ``pypros.methods`` entry point group are loaded first.
+
+    Args:
+        name (str): The method name
+
+    Raises:
+        ValueError: Raised when the method is not registered
+
+    Returns:
+        Method: The method
+    """
+    if name not in METHODS:
+        _load_plugins()
+    try:
+        return METHODS[name]
+    except (KeyError, TypeError):
+        raise ValueError('Non valid method. Valid values are ' +
+                         ', '.join(METHODS))
+
+
+def _load_plugins():
+    from importlib.metadata import entry_points
+
+    try:
+        plugins = entry_points(group='pypros.methods')
+    except TypeError:
+        plugins = entry_points().get('pypros.methods', [])
+    for plugin in plugins:
+        register_method(plugin.load())
+
+
+def _koistinen_saltikoff(inputs, threshold):
+    from pypros.ros_methods import calculate_koistinen_saltikoff
+    return calculate_koistinen_saltikoff(inputs['tair'], None,
+                                         r_h=inputs['rh'])
+
+
+def _single_threshold(name):
+    def kernel(inputs, threshold):
+        from pypros.ros_methods import calculate_single_threshold
+        return calculate_single_threshold(inputs[name], threshold)
+    return kernel
+
+
+def _dual_threshold(name):
+    def kernel(inputs, threshold):
+        from pypros.ros_methods import calculate_dual_threshold
+        return calculate_dual_threshold(inputs[name], threshold[0],
+                                        threshold[1])
+    return kernel
+
+
+def _linear_transition(inputs, threshold):
+    from pypros.ros_methods import calculate_linear_transition
+    return calculate_linear_transition(inputs['tair'], threshold[0],
+                                       threshold[1])
+
+
+for _method in (
+        Method('ks', _koistinen_saltikoff, ('tair', 'rh'),
+               phase_bins=(0.0, 0.3, 0.7)),
+        Method('single_tw', _single_threshold('twet'), ('twet',),
+               'float', 1.5),
+        Method('single_ta', _single_threshold('tair'), ('tair',),
+               'float', 0.0),
+        Method('dual_tw', _dual_threshold('twet'), ('twet',),
+               'pair', [0.7, 1.0]),
+        Method('dual_ta', _dual_threshold('tair'), ('tair',),
+               'pair', [0, 3]),
+        Method('linear_tr', _linear_transition, ('tair',),
+               'pair', [0, 3], phase_bins=(0.0, 0.3, 0.7))):
+    register_method(_method)
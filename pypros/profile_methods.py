@@ -0,0 +1,216 @@
+"""Implements precipitation type methodologies using vertical profiles
+(NWP soundings) of temperature and humidity.
+
+The profiles are (levels, y, x) cubes and all the calculations are
+vectorized along the columns, processing the cube in blocks of rows to
+bound the memory use.
+"""
+import numpy as np
+
+from pypros.psychrometrics import ttdp2tw
+from pypros.psychrometrics import _get_p_from_z
+
+# Dry air gas constant in J/(kg K)
+RD = 287.04
+
+
+def get_layers_energy(t_bottom, t_top, p_bottom, p_top):
+    """Returns the positive (melting) and negative (refreezing) energy of
+    layers between two levels, as the area between the temperature
+    profile and the 0 Celsius isotherm in a ln(p) diagram. The temperature
+    is assumed linear in ln(p) inside each layer.
+
+    Args:
+        t_bottom (float, numpy array): The temperature at the layer bottom
+                                       in Celsius
+        t_top (float, numpy array): The temperature at the layer top in
+                                    Celsius
+        p_bottom (float, numpy array): The pressure at the layer bottom in
+                                       hPa
+        p_top (float, numpy array): The pressure at the layer top in hPa
+
+    Returns:
+        tuple: The positive and negative energies in J/kg, both >= 0
+    """
+    depth = RD * np.log(p_bottom / p_top)
+    t_bottom = np.asarray(t_bottom)
+    t_top = np.asarray(t_top)
+
+    t_pos = np.maximum(t_bottom, 0), np.maximum(t_top, 0)
+    t_neg = np.minimum(t_bottom, 0), np.minimum(t_top, 0)
+    spread = np.abs(t_bottom - t_top)
+    crossing = t_bottom * t_top < 0
+
+    # Layers crossing 0 Celsius only add the triangle at each side
+    with np.errstate(divide='ignore', invalid='ignore'):
+        positive = np.where(crossing,
+                            (t_pos[0] + t_pos[1]) ** 2 / (2 * spread),
+                            (t_pos[0] + t_pos[1]) / 2)
+        negative = np.where(crossing,
+                            (t_neg[0] + t_neg[1]) ** 2 / (2 * spread),
+                            -(t_neg[0] + t_neg[1]) / 2)
+
+    return positive * depth, negative * depth
+
+
+def get_profile_energies(twet, pres, p_sfc=None, twet_sfc=None):
+    """Returns the melting energy of the warm layers and the refreezing
+    energy of the cold layer near the surface, below the lowest warm layer,
+    as defined by Bourgouin (2000).
+
+    Levels below the surface (pressure higher than p_sfc) are not used. If
+    the surface wet bulb temperature is supplied, the surface is used as
+    the bottom of the lowest layer above the ground.
+
+    Args:
+        twet (numpy array): The wet bulb temperature profiles in Celsius,
+                            shaped (levels, y, x) from the lowest to the
+                            highest level
+        pres (numpy array): The pressure of the levels in hPa, either
+                            shaped (levels,) or as twet
+        p_sfc (numpy array, optional): Defaults to None. The surface
+                                       pressure in hPa, shaped (y, x)
+        twet_sfc (numpy array, optional): Defaults to None. The surface wet
+                                          bulb temperature in Celsius,
+                                          shaped (y, x)
+
+    Returns:
+        tuple: The melting and refreezing energies in J/kg, shaped (y, x)
+    """
+    pres = np.asarray(pres, dtype=float)
+    if pres.ndim == 1:
+        pres = pres.reshape((-1,) + (1,) * (twet.ndim - 1))
+    pres = np.broadcast_to(pres, twet.shape)
+
+    t_bottom, t_top = twet[:-1], twet[1:]
+    p_bottom, p_top = pres[:-1], pres[1:]
+    used = np.ones(t_bottom.shape, dtype=bool)
+
+    if p_sfc is not None:
+        above_bottom = p_bottom < p_sfc
+        above_top = p_top < p_sfc
+        if twet_sfc is None:
+            used = above_bottom
+        else:
+            # Layers crossing the ground start at the surface
+            t_bottom = np.where(above_bottom, t_bottom, twet_sfc)
+            p_bottom = np.where(above_bottom, p_bottom, p_sfc)
+            used = above_top
+
+    positive, negative = get_layers_energy(t_bottom, t_top,
+                                           p_bottom, p_top)
+    positive = np.where(used, positive, 0)
+    negative = np.where(used, negative, 0)
+
+    # The lowest warm layer only refreezes below its 0 Celsius crossing
+    warm = positive > 0
+    below_warm = ((np.cumsum(warm, axis=0) - warm) == 0) & (
+        ~warm | (t_bottom < 0))
+
+    return positive.sum(axis=0), np.where(below_warm, negative, 0).sum(axis=0)
+
+
+def calculate_bourgouin(tair, tdew, pres, dem=None, tair_sfc=None,
+                        tdew_sfc=None, chunk_rows=64):
+    """Calculates the precipitation type from NWP vertical profiles of
+    temperature and dew point, using the wet bulb temperature profile and
+    the energy method from:
+
+    Bourgouin, P. (2000): A Method to Determine Precipitation Types,
+    Weather and Forecasting, 15, 583-592.
+
+    - melting energy < 5.6 J/kg --> snow --> 1
+    - 5.6 <= melting energy <= 13.2 J/kg --> mixed --> 0.5
+    - melting energy > 13.2 J/kg --> rain --> 0
+
+    When a cold layer near the surface refreezes the melted precipitation,
+
+    - refreezing energy > 66 + 0.66 * melting --> ice pellets --> 0.5
+    - refreezing energy < 46 + 0.66 * melting --> freezing rain --> 0
+    - otherwise --> mixed ice pellets and freezing rain --> 0.5
+
+    Args:
+        tair (numpy array): The air temperature profiles in Celsius, shaped
+                            (levels, y, x)
+        tdew (numpy array): The dew point temperature profiles in Celsius,
+                            shaped (levels, y, x)
+        pres (numpy array): The pressure of the levels in hPa, either
+                            shaped (levels,) or as tair
+        dem (numpy array, optional): Defaults to None. The surface altitude
+                                     in metres. Levels below the ground are
+                                     not used.
+        tair_sfc (numpy array, optional): Defaults to None. The surface air
+                                          temperature in Celsius
+        tdew_sfc (numpy array, optional): Defaults to None. The surface dew
+                                          point temperature in Celsius
+        chunk_rows (int, optional): Defaults to 64. The number of rows
+                                    processed at once.
+
+    Raises:
+        ValueError: Raised if the profiles have different shapes
+
+    Returns:
+        tuple: The precipitation type field and the freezing field, True
+               where the precipitation reaches a surface below 0 Celsius
+               as liquid (freezing rain)
+    """
+    if tair.shape != tdew.shape or len(tair.shape) != 3:
+        raise ValueError('The temperature and dew point profiles must ' +
+                         'have the same (levels, y, x) shape.')
+
+    pres = np.asarray(pres, dtype=float)
+    if pres.ndim == 1:
+        pres = pres[:, np.newaxis, np.newaxis]
+
+    # Levels must go from the bottom to the top
+    reverse = pres[0].flat[0] < pres[-1].flat[0]
+
+    surface = tair_sfc is not None and tdew_sfc is not None
+    ros = np.zeros(tair.shape[1:])
+    freezing = np.zeros(tair.shape[1:], dtype=bool)
+
+    for row in range(0, tair.shape[1], chunk_rows):
+        rows = slice(row, row + chunk_rows)
+        t_chunk = np.asarray(tair[:, rows])
+        td_chunk = np.asarray(tdew[:, rows])
+        p_chunk = pres if pres.shape[1] == 1 else pres[:, rows]
+        if reverse:
+            t_chunk, td_chunk, p_chunk = (t_chunk[::-1], td_chunk[::-1],
+                                          p_chunk[::-1])
+
+        twet = ttdp2tw(t_chunk, td_chunk, p_chunk)
+
+        p_sfc = None if dem is None else _get_p_from_z(dem[rows])
+        twet_sfc = None
+        if surface:
+            if p_sfc is None:
+                p_sfc = np.full(twet.shape[1:], 1013.25)
+            twet_sfc = ttdp2tw(tair_sfc[rows], tdew_sfc[rows], p_sfc)
+            bottom_tw = twet_sfc
+        else:
+            bottom_tw = twet[0]
+            if p_sfc is not None:
+                # The lowest level above the ground
+                above = np.broadcast_to(p_chunk, twet.shape) < p_sfc
+                lowest = np.argmax(above, axis=0)
+                bottom_tw = np.take_along_axis(twet, lowest[np.newaxis],
+                                               axis=0)[0]
+
+        melting, refreezing = get_profile_energies(twet, p_chunk, p_sfc,
+                                                   twet_sfc)
+
+        cold_surface = bottom_tw < 0
+        fzra_limit = 46 + 0.66 * melting
+
+        chunk_ros = np.where(melting > 13.2, 0.0,
+                             np.where(melting >= 5.6, 0.5, 1.0))
+        refrozen = cold_surface & (melting >= 5.6)
+        chunk_ros = np.where(refrozen & (refreezing >= fzra_limit), 0.5,
+                             chunk_ros)
+        chunk_ros = np.where(refrozen & (refreezing < fzra_limit), 0.0,
+                             chunk_ros)
+
+        ros[rows] = chunk_ros
+        freezing[rows] = refrozen & (refreezing < fzra_limit)
+
+    return ros, freezing
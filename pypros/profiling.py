@@ -0,0 +1,317 @@
+'''Opt-in profiling of the PyPros pipeline stages and kernels.
+
+The stages (reading, calculation, masking and writing), the kernels and
+the main expressions of the psychrometric calculations are wrapped with
+profiling spans, which only check a global when no profiler is running.
+A running Profiler records each span with a high resolution timer and,
+optionally, the memory allocated by it (tracemalloc). The spans can be
+saved as a Chrome trace (chrome://tracing, Perfetto or speedscope) or as
+folded stacks for flamegraph.pl.
+
+Example:
+
+.. code:: python
+
+    with Profiler(memory=True) as profiler:
+        inst = PyPros(variables_file, 'single_tw', 1.5)
+        inst.refl_mask(refl)
+    profiler.save('/tmp/pypros_trace.json')
+    print(profiler.format_report())
+
+Production runs can be profiled without changing the code, by setting
+the PYPROS_PROFILE environment variable to the output file path. The
+spans of the whole process are saved when it exits, as folded stacks if
+the path ends with .folded and as a Chrome trace otherwise. {pid} in the
+path is replaced by the process ID, so worker processes don't overwrite
+each other's files. Setting PYPROS_PROFILE_MEMORY=1 tracks the memory
+too.
+
+Only the standard library is imported, so this module can be used by the
+command line entry points before NumPy is loaded.
+'''
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# The running profiler, None when profiling is off
+_active = None
+_active_lock = threading.Lock()
+
+
+class Profiler:
+    """Records the profiling spans of the running code.
+
+    The spans of all the threads are recorded. The memory figures come
+    from tracemalloc, which is process wide, so they are exact for single
+    threaded runs only. Tracking the memory slows down the code noticeably.
+    """
+    def __init__(self, memory=False):
+        """
+        Args:
+            memory (bool, optional): Defaults to False. If True, the memory
+                                     allocated by each span and its peak
+                                     are recorded with tracemalloc
+        """
+        self.memory = memory
+        self.events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = None
+        self._tracemalloc = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """Starts recording the spans.
+
+        Raises:
+            RuntimeError: Raised if another profiler is running
+        """
+        global _active
+        with _active_lock:
+            if _active is not None:
+                raise RuntimeError('A profiler is already running')
+            if self.memory and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracemalloc = True
+            self._origin = time.perf_counter_ns()
+            _active = self
+
+    def stop(self):
+        """Stops recording the spans.
+        """
+        global _active
+        with _active_lock:
+            if _active is self:
+                _active = None
+            if self._tracemalloc:
+                tracemalloc.stop()
+                self._tracemalloc = False
+
+    @contextmanager
+    def span(self, name, category, args=None):
+        """Records a span around a block of code.
+
+        Args:
+            name (str): The span name
+            category (str): The span category, i.e. stage or kernel
+            args (dict, optional): Defaults to None. Extra values saved
+                                   with the span, such as a file name
+        """
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        # The name, the time spent in the children and the memory peak
+        frame = [name, 0, 0]
+        memory = self.memory and tracemalloc.is_tracing()
+        if memory:
+            start_memory, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1][2] = max(stack[-1][2], peak)
+            tracemalloc.reset_peak()
+            frame[2] = start_memory
+        stack.append(frame)
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            end = time.perf_counter_ns()
+            stack.pop()
+            duration = end - start
+            event = {'name': name, 'cat': category,
+                     'ts': start - self._origin, 'dur': duration,
+                     'self': duration - frame[1],
+                     'tid': threading.get_ident(),
+                     'stack': tuple(parent[0] for parent in stack) +
+                     (name,),
+                     'args': dict(args or {})}
+            if stack:
+                stack[-1][1] += duration
+            if memory and tracemalloc.is_tracing():
+                current, peak = tracemalloc.get_traced_memory()
+                peak = max(frame[2], peak)
+                if stack:
+                    stack[-1][2] = max(stack[-1][2], peak)
+                event['args']['allocated'] = current - start_memory
+                event['args']['peak'] = peak - start_memory
+                event['memory'] = current
+            with self._lock:
+                self.events.append(event)
+
+    def chrome_trace(self):
+        """Returns the spans in the Chrome trace event format.
+
+        Returns:
+            dict: The trace, JSON serializable
+        """
+        pid = os.getpid()
+        trace = []
+        for event in self.events:
+            trace.append({'name': event['name'], 'cat': event['cat'],
+                          'ph': 'X', 'ts': event['ts'] / 1000,
+                          'dur': event['dur'] / 1000, 'pid': pid,
+                          'tid': event['tid'], 'args': event['args']})
+            if 'memory' in event:
+                trace.append({'name': 'traced memory', 'ph': 'C',
+                              'ts': (event['ts'] + event['dur']) / 1000,
+                              'pid': pid,
+                              'args': {'bytes': event['memory']}})
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def folded(self):
+        """Returns the spans as folded stacks, with the time spent in each
+        stack itself, in microseconds.
+
+        Returns:
+            str: A line for each stack, as flamegraph.pl reads them
+        """
+        totals = {}
+        for event in self.events:
+            totals[event['stack']] = (totals.get(event['stack'], 0) +
+                                      event['self'])
+        return '\n'.join('{} {}'.format(';'.join(stack), nanoseconds // 1000)
+                         for stack, nanoseconds in sorted(totals.items()))
+
+    def summary(self):
+        """Aggregates the spans by name.
+
+        Returns:
+            list: A dict for each span name, with its 'name', 'category',
+                  number of 'calls', 'total' and 'self' seconds and the
+                  largest memory 'peak' in bytes (None if not tracked),
+                  the largest total time first
+        """
+        rows = {}
+        for event in self.events:
+            row = rows.setdefault(event['name'], {
+                'name': event['name'], 'category': event['cat'],
+                'calls': 0, 'total': 0.0, 'self': 0.0, 'peak': None})
+            row['calls'] += 1
+            row['total'] += event['dur'] / 1e9
+            row['self'] += event['self'] / 1e9
+            if 'peak' in event['args']:
+                row['peak'] = max(row['peak'] or 0, event['args']['peak'])
+        return sorted(rows.values(), key=lambda row: -row['total'])
+
+    def format_report(self):
+        """Formats the summary as a table.
+
+        Returns:
+            str: The summary table
+        """
+        lines = ['{:<30} {:<10} {:>7} {:>10} {:>10} {:>10}'.format(
+            'span', 'category', 'calls', 'total s', 'self s', 'peak MiB')]
+        for row in self.summary():
+            peak = '-' if row['peak'] is None else '{:.2f}'.format(
+                row['peak'] / (1 << 20))
+            lines.append('{:<30} {:<10} {:>7} {:>10.4f} {:>10.4f} '
+                         '{:>10}'.format(row['name'], row['category'],
+                                         row['calls'], row['total'],
+                                         row['self'], peak))
+        return '\n'.join(lines)
+
+    def save(self, file_name):
+        """Saves the spans, as folded stacks if the file name ends with
+        .folded and as a Chrome trace JSON file otherwise.
+
+        Args:
+            file_name (str): The output file path
+        """
+        with open(file_name, 'w') as f_p:
+            if file_name.endswith('.folded'):
+                f_p.write(self.folded() + '\n')
+            else:
+                json.dump(self.chrome_trace(), f_p)
+
+
+def get_active():
+    """Returns the running profiler, i.e. the one started by the
+    PYPROS_PROFILE environment variable.
+
+    Returns:
+        Profiler: The running profiler, None if profiling is off
+    """
+    return _active
+
+
+@contextmanager
+def span(name, category='stage', **args):
+    """Records a block of code in the running profiler, if any.
+
+    Args:
+        name (str): The span name
+        category (str, optional): Defaults to stage. The span category
+        **args: Extra values saved with the span, such as a file name
+    """
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+    with profiler.span(name, category, args):
+        yield
+
+
+def profiled(name=None, category='kernel'):
+    """Decorator recording each call of a function in the running profiler,
+    if any.
+
+    Args:
+        name (str, optional): Defaults to None. The span name. If None, the
+                              function module (without the package) and
+                              name, i.e. psychrometrics.td2hr
+        category (str, optional): Defaults to kernel. The span category
+    """
+    def decorator(function):
+        label = name or '{}.{}'.format(function.__module__.split('.')[-1],
+                                       function.__qualname__)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profiler = _active
+            if profiler is None:
+                return function(*args, **kwargs)
+            with profiler.span(label, category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _start_from_environment():
+    file_name = os.environ.get('PYPROS_PROFILE')
+    if not file_name or _active is not None:
+        return
+    from multiprocessing import util
+
+    profiler = Profiler(memory=os.environ.get('PYPROS_PROFILE_MEMORY',
+                                              '0') not in ('', '0'))
+    profiler.start()
+
+    def save():
+        profiler.stop()
+        profiler.save(file_name.replace('{pid}', str(os.getpid())))
+
+    def after_fork():
+        # Child processes record their own spans only
+        profiler.events = []
+
+    def after_worker_start(_):
+        # Worker processes (i.e. pypros_batch) exit without running the
+        # atexit handlers
+        util.Finalize(None, save, exitpriority=0)
+
+    atexit.register(save)
+    os.register_at_fork(after_in_child=after_fork)
+    util.register_after_fork(profiler, after_worker_start)
+
+
+_start_from_environment()
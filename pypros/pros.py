@@ -1,23 +1,39 @@
 '''Functions to calculate the precipitation type.
 For a point or numpy arrays
 '''
+from functools import partial
+
 import numpy as np
-from osgeo import gdal, osr
+from osgeo import osr
+from pypros.categories import NODATA_CLASS
+from pypros.io_backends import get_backend, read_ahead
+from pypros.psychrometrics import td2hr
+from pypros.psychrometrics import hr2td
 from pypros.psychrometrics import ttd2tw
-from pypros.psychrometrics import get_tw_sadeghi
-from pypros.ros_methods import calculate_koistinen_saltikoff
-from pypros.ros_methods import calculate_single_threshold
-from pypros.ros_methods import calculate_linear_transition
-from pypros.ros_methods import calculate_dual_threshold
+from pypros.psychrometrics import ttdp2tw
+from pypros.psychrometrics import _get_p_from_z
+from pypros.psychrometrics import _is_lazy
+from pypros.methods import get_method
+from pypros.profiling import profiled
+from pypros.profiling import span
 
 
 class PyPros:
     """
     Main project class. Discriminates precipitation type considering
     different methodologies using surface observations.
+
+    Pixels flagged as NoData (or masked) in any of the variables files are
+    not computed and are set to the nodata value in the results.
+
+    If the fields are Dask arrays (see the lazy option of XarrayBackend),
+    the results are lazy too, and are computed chunk by chunk when saved.
     """
+    nodata = -9999.0
+
     def __init__(self, variables_file, method='ks', threshold=None,
-                 data_format=None):
+                 data_format=None, backend='gdal', time=None, refl=None,
+                 pressure=None, resolution=1, bbox=None, bbox_proj=None):
         """
         Args:
             variables_file (str, list): The file paths containing air
@@ -38,13 +54,25 @@ class PyPros:
                             - linear_tr: Linear transition between rain
                                          and snow
 
-            threshold (float, list): Threshold value(s) to use in the
-                                     different methods available.
+                          Other methods can be added to the registry, see
+                          pypros.methods.
 
-                                     Defaults to:
-                                        - static_tw: 1.5
-                                        - static_ta: 0.0
-                                        - linear_tr: [0, 3]
+            threshold (float, list, dict): Threshold value(s) to use in
+                                           the different methods available.
+
+                                           Defaults to:
+                                             - single_tw: 1.5
+                                             - single_ta: 0.0
+                                             - dual_tw  : [0.7, 1.0]
+                                             - dual_ta  : [0, 3]
+                                             - linear_tr: [0, 3]
+
+                                           The thresholds can also vary by
+                                           pixel: a field, a threshold
+                                           raster or a lookup by region ID,
+                                           see Method.check_threshold.
+                                           Pixels without threshold are set
+                                           to NoData.
 
             data_format (dict, optional): Defaults to None. The order of the
                                           variables in the variables files.
@@ -52,129 +80,394 @@ class PyPros:
                                           {'vars_files': ['tair',
                                                           'tdew',
                                                           'dem']}
+                                          The relative humidity, in %, can
+                                          be supplied as 'rh' instead of
+                                          'tdew'.
+
+            backend (str, object, optional): Defaults to gdal. The backend
+                                             used to read the variables
+                                             files and to save the results.
+
+                                             Available:
+                                               - gdal  : GDAL rasters
+                                               - xarray: NetCDF or Zarr
+                                                         cubes
+
+                                             A configured backend instance
+                                             can also be passed.
+
+            time (int, datetime, optional): Defaults to None. The time step
+                                            to read from multi-time files.
+                                            If None, all the bands (gdal)
+                                            or the single time step
+                                            (xarray) are read.
+
+            refl (str, numpy array, optional): Defaults to None. The radar
+                                               reflectivity field, or its
+                                               file path. If supplied, only
+                                               the precipitating pixels
+                                               (refl >= 1 dBZ) are computed
+                                               and the rest of the result
+                                               is set to NoData.
+
+            pressure (numpy array, optional): Defaults to None. The surface
+                                              pressure field in hPa, used by
+                                              the wet bulb methods. If None,
+                                              it's derived from the DEM.
+                                              Useful to share it between
+                                              runs over the same domain.
+
+            resolution (int, optional): Defaults to 1. The resolution
+                                        factor. The files are read
+                                        decimated by this factor in each
+                                        dimension (from the overviews
+                                        when the files have them), so the
+                                        result is computed and saved on a
+                                        coarser grid, useful as a quick
+                                        preview.
+
+            bbox (tuple, optional): Defaults to None. The bounding box
+                                    (x_min, y_min, x_max, y_max) to
+                                    compute. Only the window of the files
+                                    covering it is read, and the results
+                                    are georeferenced on that window. If
+                                    None, the whole files.
+
+            bbox_proj (str, optional): Defaults to None. The bounding box
+                                       CRS, in any format GDAL accepts,
+                                       i.e. EPSG:4326 for a longitude and
+                                       latitude box. If None, the files CRS.
 
         Raises:
-            ValueError: Raised when the method is not valid
+            ValueError: Raised when the method, the threshold, the
+                        data_format or the resolution are not valid, or the
+                        bounding box doesn't overlap the files
+            IndexError: Raised when the threshold field doesn't match the
+                        variables fields
         """
+        if int(resolution) != resolution or resolution < 1:
+            raise ValueError('The resolution factor must be a positive ' +
+                             'integer')
+        self.resolution = int(resolution)
+        self.bbox = None if bbox is None else tuple(bbox)
+        self.bbox_proj = bbox_proj
+
         if data_format is None:
             self.data_format = {'vars_files': ['tair', 'tdew', 'dem']}
         else:
             self.data_format = data_format
 
-        if threshold is None:
-            if method == 'static_ta':
-                self.threshold = 0
-            elif method == 'static_tw':
-                self.threshold = 1.5
-            elif method == 'linear_tr' or method == 'dual_ta':
-                self.threshold = [0, 3]
-            elif method == 'dual_tw':
-                self.threshold = [0.7, 1.0]
-            elif method == 'ks':
-                None
+        # Validated before reading any file
+        self.ros_method = get_method(method)
+        self.threshold = self.ros_method.check_threshold(threshold)
+        self.ros_method.check_variables(self.data_format['vars_files'])
+
+        self.backend = get_backend(backend)
+        self.__read_variables_files__(variables_file, time)
+        self.method = method
+        self.time = time
+        self.pressure = pressure
+
+        self.threshold, valid = read_threshold(
+            self.ros_method, self.threshold, self.__read__, self.size)
+        if valid is not None:
+            self.mask = valid if self.mask is None else self.mask & valid
+
+        self.refl = None
+        if refl is not None:
+            self.refl = self.__read_refl__(refl)
+
+        self.__calculate__()
+
+    @profiled('PyPros.calculate', 'stage')
+    def __calculate__(self):
+        """Calculates the result field. If some pixels are not valid (NoData
+        or not finite in any of the variables), or not precipitating when
+        the reflectivity is supplied, only the rest are computed as
+        compressed 1D vectors (gather, compute, scatter) and the skipped
+        ones are set to NoData. Lazy fields are computed as a whole and the
+        skipped pixels are set to NoData with an expression.
+        """
+        lazy = _is_lazy(self.variables) or _is_lazy(self.refl)
+        self.computed = self.mask
+        if self.refl is not None:
+            wet = self.refl >= 1
+            if self.computed is None:
+                self.computed = wet
             else:
-                raise ValueError('Non valid method. Valid values are ks and ' +
-                                 'static_tw, static_ta and linear_tr')
+                self.computed = self.computed & wet
+
+        if lazy:
+            self.result = self.__calculate_method__(self.variables,
+                                                    self.__get_pressure__())
+            if self.computed is not None:
+                self.result = np.where(self.computed, self.result,
+                                       self.nodata)
+            return
+
+        if self.computed is not None and self.computed.all():
+            self.computed = None
+
+        if self.computed is None:
+            self.result = self.__calculate_method__(self.variables,
+                                                    self.__get_pressure__())
         else:
-            if method == 'single_ta' or method == 'single_tw':
-                if not type(threshold) == float:
-                    raise ValueError('The threshold for the method {} must ' +
-                                     'be a float'.format(method))
-            elif (method == 'linear_tr' or method == 'dual_ta'
-                  or method == 'dual_tw'):
-                if (not (type(threshold) == list or type(threshold) == tuple)
-                   or len(threshold) != 2):
-                    raise ValueError('The thresholds for the method {} must ' +
-                                     'be a list/tuple of length ' +
-                                     'two'.format(method))
-            elif method == 'ks':
-                None
-            else:
-                raise ValueError('Non valid method. Valid values are ks and ' +
-                                 'single_tw, single_ta and linear_tr')
+            self.result = np.full(self.size, self.nodata)
+            if self.computed.any():
+                result = self.__calculate_method__(
+                    self.variables[:, self.computed],
+                    self.__get_pressure__(self.computed),
+                    self.__gather_threshold__(self.computed))
+                self.result = self.result.astype(
+                    np.result_type(result, self.nodata))
+                self.result[self.computed] = result
+
+    def __get_pressure__(self, computed=None):
+        """Returns the pressure from the DEM, if the method needs it. The
+        whole field is computed only once. If only some pixels are computed
+        and the field is not available, the pressure of those pixels is
+        computed as a 1D vector instead.
+        """
+        if ('twet' not in self.ros_method.inputs
+                or 'dem' not in self.data_format['vars_files']):
+            return None
+        if self.pressure is None:
+            dem = self.variables[self.data_format['vars_files'].index('dem')]
+            if computed is not None:
+                return _get_p_from_z(dem[computed])
+            self.pressure = _get_p_from_z(dem)
+        if computed is not None:
+            return self.pressure[computed]
+        return self.pressure
+
+    def __calculate_method__(self, variables, pressure=None,
+                             threshold=None):
+        vars_files = self.data_format['vars_files']
+        inputs = {name: variables[vars_files.index(name)]
+                  for name in ('tair', 'tdew', 'rh') if name in vars_files}
+        if threshold is None:
+            threshold = self.threshold
 
-            self.threshold = threshold
+        return calculate_method(self.ros_method, threshold, inputs,
+                                pressure)
 
-        self.__read_variables_files__(variables_file)
-        self.method = method
+    def __gather_threshold__(self, computed):
+        """Returns the threshold of the computed pixels, as 1D vectors
+        if it varies by pixel.
+        """
+        def gather(value):
+            return value[computed] if np.ndim(value) > 0 else value
+
+        if self.ros_method.threshold == 'pair':
+            return [gather(value) for value in self.threshold]
+        if self.ros_method.threshold == 'float':
+            return gather(self.threshold)
+        return self.threshold
+
+    def interpolate_times(self, variables_file_next, nwp_times, times,
+                          time_next=None, refls=None):
+        """Interpolates linearly the air temperature and the humidity fields
+        between the NWP step read by PyPros and the next one, and calculates
+        the result at each of the given times (i.e. the radar times).
+
+        The fields are blended in memory reusing the same buffers, and the
+        pressure derived from the DEM is computed only once, so each time
+        costs a single blend and classification.
 
-        tair = self.variables[self.data_format['vars_files'].index('tair')]
-        tdew = self.variables[self.data_format['vars_files'].index('tdew')]
-
-        if method == 'ks':
-            self.result = calculate_koistinen_saltikoff(tair, tdew)
-        elif method == 'single_tw' or method == 'dual_tw':
-            try:
-                dem = self.variables[
-                      self.data_format['vars_files'].index('dem')]
-            except ValueError:
-                print('Since no DEM is supplied, wet bulb temperature ' +
-                      'calculations will assume a constant pressure of ' +
-                      '1013.25 hPa.')
-                twet = ttd2tw(tair, tdew)
+        Args:
+            variables_file_next (str, list): The variables files of the next
+                                             NWP step, in the data_format
+                                             order
+            nwp_times (tuple): The times of the NWP step read by PyPros and
+                               of the next one (datetime or numbers)
+            times (list): The times to interpolate to, between both NWP
+                          times
+            time_next (int, datetime, optional): Defaults to None. The time
+                                                 step to read from the next
+                                                 variables files.
+            refls (list, optional): Defaults to None. The reflectivity
+                                    field, or its file path, at each time.
+                                    If supplied, only the precipitating
+                                    pixels are computed. Required if a
+                                    reflectivity was supplied to PyPros,
+                                    since it changes with the time.
+
+        Raises:
+            ValueError: Raised if a time is not between the NWP times, the
+                        fields of both steps don't match or the
+                        reflectivity at each time is missing
+
+        Yields:
+            tuple: The time and the result field at that time. The result
+                   attribute is also updated, so refl_mask and save_file
+                   can be used at each step.
+        """
+        if refls is None and self.refl is not None:
+            raise ValueError('The reflectivity at each time must be '
+                             'supplied, as PyPros was given one.')
+        previous = self.variables
+        previous_mask = self.mask
+        self.__read_variables_files__(variables_file_next, time_next)
+        if self.variables.shape != previous.shape:
+            raise ValueError('Variables fields must have the same shape.')
+        if previous_mask is not None:
+            if self.mask is None:
+                self.mask = previous_mask
             else:
-                twet = get_tw_sadeghi(tair, tdew, dem)
-            if method == 'single_tw':
-                self.result = calculate_single_threshold(twet, self.threshold)
-            elif method == 'dual_tw':
-                self.result = calculate_dual_threshold(twet, self.threshold[0],
-                                                       self.threshold[1])
-        elif method == 'single_ta':
-            self.result = calculate_single_threshold(tair, self.threshold)
-        elif method == 'linear_tr':
-            self.result = calculate_linear_transition(tair, self.threshold[0],
-                                                      self.threshold[1])
-        elif method == 'dual_ta':
-            self.result = calculate_dual_threshold(tair, self.threshold[0],
-                                                   self.threshold[1])
-
-    def __read_variables_files__(self, variables_file):
-        if isinstance(variables_file, (list,)):
-            self.variables = None
-            for layer_file in variables_file:
-                d_s = gdal.Open(layer_file)
-                if d_s is None:
-                    raise FileNotFoundError("[Errno 2] No such file or " +
-                                            "directory: 'BadFile'")
-                for i in range(d_s.RasterCount):
-                    layer_data = d_s.GetRasterBand(i + 1)\
-                                 .ReadAsArray()[np.newaxis, :, :]
-                    if self.variables is None:
-                        self.variables = layer_data
-                    else:
-                        try:
-                            self.variables = np.concatenate((self.variables,
-                                                             layer_data),
-                                                            axis=0)
-                        except Exception:
-                            raise ValueError('Variables fields must have the' +
-                                             ' same shape.')
-        else:
-            d_s = gdal.Open(variables_file)
-            self.variables = d_s.ReadAsArray()
+                self.mask = self.mask & previous_mask
+
+        if refls is not None:
+            refls = read_ahead(self.__read_refl__, refls,
+                               getattr(self.backend, 'read_ahead', 0))
+
+        blended = [i for i, name in enumerate(self.data_format['vars_files'])
+                   if name in ('tair', 'tdew', 'rh')]
+        difference = self.variables[blended] - previous[blended]
+        self.variables = previous.copy()
+        interval = nwp_times[1] - nwp_times[0]
+        # The whole pressure field, shared by all the times
+        self.__get_pressure__()
+
+        for time in times:
+            weight = (time - nwp_times[0]) / interval
+            if not 0 <= weight <= 1:
+                raise ValueError('The time {} is not between the NWP '
+                                 'times'.format(time))
+            if _is_lazy(previous):
+                self.variables = np.stack([
+                    previous[index] + difference[blended.index(index)] *
+                    weight if index in blended else previous[index]
+                    for index in range(previous.shape[0])])
+            else:
+                for position, index in enumerate(blended):
+                    np.multiply(difference[position], weight,
+                                out=self.variables[index])
+                    self.variables[index] += previous[index]
+
+            if refls is not None:
+                self.refl = next(refls)
+            self.__calculate__()
+
+            yield time, self.result
+
+    def __read_variables_files__(self, variables_file, time=None):
+        if not isinstance(variables_file, (list,)):
+            variables_file = [variables_file]
+
+        self.variables = None
+        self.mask = None
+        # The next files are read while the previous ones are processed
+        reads = read_ahead(lambda layer_file: self.__read__(layer_file, time),
+                           variables_file,
+                           getattr(self.backend, 'read_ahead', 0))
+        for layer_data, info in reads:
+            if info.get('mask') is not None:
+                if self.mask is None:
+                    self.mask = info['mask']
+                else:
+                    self.mask = self.mask & info['mask']
+            if self.variables is None:
+                self.variables = layer_data
+            else:
+                try:
+                    self.variables = np.concatenate((self.variables,
+                                                     layer_data),
+                                                    axis=0)
+                except Exception:
+                    raise ValueError('Variables fields must have the' +
+                                     ' same shape.')
+
+        if self.variables.dtype.kind == 'f':
+            finite = np.isfinite(self.variables).all(axis=0)
+            if _is_lazy(finite):
+                # Not evaluated until the result is computed
+                self.mask = finite if self.mask is None else self.mask & finite
+            elif not finite.all():
+                if self.mask is None:
+                    self.mask = finite
+                else:
+                    self.mask = self.mask & finite
+        if (self.mask is not None and not _is_lazy(self.mask)
+                and self.mask.all()):
+            self.mask = None
 
         self.out_proj = osr.SpatialReference()
-        self.out_proj.ImportFromWkt(d_s.GetProjection())
-        self.size = (d_s.RasterYSize, d_s.RasterXSize)
-        self.geotransform = d_s.GetGeoTransform()
-        d_s = None
+        self.out_proj.ImportFromWkt(info['projection'])
+        self.size = info['size']
+        self.geotransform = info['geotransform']
+
+    def __read__(self, file_name, time=None):
+        # Backends without decimated or window reads are still supported
+        # for whole files
+        kwargs = {}
+        if self.resolution != 1:
+            kwargs['factor'] = self.resolution
+        if self.bbox is not None:
+            kwargs['bbox'] = self.bbox
+            if self.bbox_proj is not None:
+                kwargs['bbox_proj'] = self.bbox_proj
+        with span('read', file=file_name):
+            return self.backend.read(file_name, time, **kwargs)
+
+    def __read_refl__(self, refl):
+        if isinstance(refl, str):
+            fields, info = self.__read__(refl, self.time)
+            refl = fields[0].astype(float)
+            if info.get('mask') is not None:
+                refl[~info['mask']] = np.nan
+        if refl.shape != tuple(self.size):
+            raise IndexError('Variables fields must have the' +
+                             ' same shape.')
+        return refl
 
-    def save_file(self, field, file_name):
+    def save_file(self, field, file_name, **kwargs):
         """Saves the calculate field data into a file
 
         Args:
+            field (numpy array): The field to save
             file_name (str): The output file path
+            **kwargs: Extra arguments passed to the backend writer, such as
+                      the time of the field for the xarray backend
+        """
+        info = {'projection': self.out_proj.ExportToWkt(),
+                'geotransform': self.geotransform,
+                'size': self.size}
+        # Skipped pixels (not valid or not precipitating) hold the nodata
+        if self.mask is not None or self.computed is not None:
+            info['nodata'] = self.nodata
+        with span('write', file=file_name):
+            self.backend.write(file_name, field, info, **kwargs)
+
+    def publish(self, publisher, field=None, file_name=None, **kwargs):
+        """Publishes a field into shared memory, so local processes can
+        read it without waiting for the output file. If a file name is
+        given, the file is then written in a background thread.
+
+        Args:
+            publisher (ResultPublisher): The shared memory publisher, see
+                                         pypros.publish
+            field (numpy array, optional): Defaults to None. The field to
+                                           publish. If None, the result.
+            file_name (str, optional): Defaults to None. The output file
+                                       path, written in the background
+            **kwargs: Extra arguments passed to save_file
+
+        Returns:
+            int: The published version
         """
-        driver = gdal.GetDriverByName('GTiff')
+        if field is None:
+            field = self.result
+        field = np.asarray(field)
 
-        d_s = driver.Create(file_name, self.size[1], self.size[0], 1,
-                            gdal.GDT_Float32)
-        d_s.SetGeoTransform(self.geotransform)
-        d_s.SetProjection(self.out_proj.ExportToWkt())
+        writer = None
+        if file_name is not None:
+            writer = partial(self.save_file, field, file_name, **kwargs)
 
-        d_s.GetRasterBand(1).WriteArray(field)
+        return publisher.publish(field, self.geotransform,
+                                 self.out_proj.ExportToWkt(), writer)
 
-    def refl_mask(self, refl):
+    @profiled('PyPros.refl_mask', 'stage')
+    def refl_mask(self, refl=None):
         """Calculates the precipitation type masked. The output classification
         is as follows:
 
@@ -202,34 +495,186 @@ class PyPros:
         - 15dBZ: 14
         - 25dbZ: 15
 
+        Only the precipitating pixels are classified.
+
         Args:
-            refl (numpy.array): Array with reflectivity values
+            refl (numpy.array, str, optional): Defaults to None. Array with
+                                               reflectivity values, or its
+                                               file path. If None, the
+                                               reflectivity supplied to
+                                               PyPros is used.
 
         Raises:
             IndexError: Raised if the types don't match in size or type
+            ValueError: Raised if no reflectivity is available
 
         Returns:
-            float, numpy array: The precipitation type classification value
+            numpy array: The uint8 precipitation type classification value
+                         (see pypros.categories). Pixels without valid input
+                         data or reflectivity (NoData or NaN, i.e. outside
+                         the radar range), or not computed, are set to
+                         NODATA_CLASS.
         """
+        if refl is None:
+            if self.refl is None:
+                raise ValueError('No reflectivity field supplied.')
+            refl = self.refl
+        elif isinstance(refl, str):
+            refl = self.__read_refl__(refl)
+
         if self.result.shape != refl.shape:
             raise IndexError('Variables fields must have the' +
                              ' same shape.')
 
+        wet = refl >= 1
+        if _is_lazy(self.result) or _is_lazy(refl):
+            return self.__lazy_refl_mask__(wet, refl)
+
+        pros = np.zeros(refl.shape, dtype=np.uint8)
+        if self.computed is not None:
+            pros[wet & ~self.computed] = NODATA_CLASS
+            wet &= self.computed
+        with span('refl_mask.gather', 'expression'):
+            result_wet, refl_wet = self.result[wet], refl[wet]
+        classes = self.__classify__(result_wet, refl_wet)
+        with span('refl_mask.scatter', 'expression'):
+            pros[wet] = classes
+            if self.mask is not None:
+                pros[~self.mask] = NODATA_CLASS
+            pros[~np.isfinite(refl)] = NODATA_CLASS
+
+        return pros
+
+    def __lazy_refl_mask__(self, wet, refl):
+        pros = np.where(wet, self.__classify__(self.result, refl), 0)
+        invalid = ~np.isfinite(refl)
+        if self.computed is not None:
+            invalid = invalid | (wet & ~self.computed)
+        if self.mask is not None:
+            invalid = invalid | ~self.mask
+        pros = np.where(invalid, NODATA_CLASS, pros)
+
+        return pros.astype(np.uint8)
+
+    @profiled('PyPros.classify', 'expression')
+    def __classify__(self, result, refl):
         refl_bins = np.array([1, 5, 10, 15, 25])
         refl_class = np.digitize(refl, refl_bins)
 
-        if self.method == 'ks' or self.method == 'linear_tr':
-            prob_bins = np.array([0.0, 0.3, 0.7])
-            ks_class = np.digitize(self.result, prob_bins) - 1
-            pros = (refl_class + ks_class * 5) * (refl >= 1)
+        phase = np.digitize(result, np.array(self.ros_method.phase_bins)) - 1
 
-        elif self.method == 'single_tw' or self.method == 'single_ta':
-            rain = np.digitize(self.result, np.array([1]))
-            pros = (refl_class + rain * 10) * (refl >= 1)
+        return refl_class + phase * 5
 
-        elif self.method == 'dual_tw' or self.method == 'dual_ta':
-            prob_bins = np.array([0.0, 0.5, 1])
-            dual_class = np.digitize(self.result, prob_bins) - 1
-            pros = (refl_class + dual_class * 5) * (refl >= 1)
 
-        return pros
+def read_threshold(ros_method, threshold, read, size):
+    """Reads a threshold varying by pixel, given as a raster or as a lookup
+    by region ID (see Method.check_threshold), into threshold fields.
+    Other thresholds are returned as they are.
+
+    The region IDs are looked up with a sorted search, so the lookup is
+    vectorized whatever the IDs values are.
+
+    Args:
+        ros_method (Method): The method, see pypros.methods
+        threshold (float, list, dict): The checked method threshold
+        read (function): The reader of the threshold files, called with
+                         the file path, returning the fields and their
+                         info as the backends do
+        size (tuple): The fields size
+
+    Raises:
+        ValueError: Raised when the threshold raster bands don't match the
+                    method threshold
+        IndexError: Raised when the threshold fields size is not the
+                    given one
+
+    Returns:
+        tuple: The threshold, and the mask of the pixels with a valid
+               threshold (None if all of them are valid)
+    """
+    if ros_method.threshold == 'none':
+        return threshold, None
+    bands = 2 if ros_method.threshold == 'pair' else 1
+
+    valid = None
+    if isinstance(threshold, dict) and 'file' in threshold:
+        fields, info = read(threshold['file'])
+        if fields.shape[0] != bands:
+            raise ValueError('The threshold file of the method {} must '
+                             'have {} band(s)'.format(ros_method.name,
+                                                      bands))
+        # Small static fields, read eagerly even by lazy backends. Copied,
+        # since the backend arrays can be cached and read only.
+        fields = np.array(fields, dtype=float)
+        valid = info.get('mask')
+    elif isinstance(threshold, dict):
+        regions, info = read(threshold['regions'])
+        regions = np.asarray(regions[0])
+        ids = np.array(sorted(threshold['values']))
+        values = np.array([threshold['values'][region_id]
+                           for region_id in ids], dtype=float)
+        position = np.clip(np.searchsorted(ids, regions), 0, len(ids) - 1)
+        valid = ids[position] == regions
+        if info.get('mask') is not None:
+            valid &= np.asarray(info['mask'])
+        # (region, band) to (band, y, x)
+        fields = np.moveaxis(values.reshape(len(ids), bands)[position], -1,
+                             0)
+    else:
+        for field in (threshold if bands == 2 else [threshold]):
+            if np.ndim(field) > 0 and np.shape(field) != tuple(size):
+                raise IndexError('The threshold fields must have the ' +
+                                 'variables fields shape.')
+        return threshold, None
+
+    if fields.shape[1:] != tuple(size):
+        raise IndexError('The threshold fields must have the ' +
+                         'variables fields shape.')
+    finite = np.isfinite(fields).all(axis=0)
+    valid = finite if valid is None else np.asarray(valid) & finite
+    fields[:, ~valid] = np.nan
+    if valid.all():
+        valid = None
+
+    if bands == 2:
+        return ros_method.check_threshold([fields[0], fields[1]]), valid
+    return fields[0], valid
+
+
+def calculate_method(ros_method, threshold, inputs, pressure=None):
+    """Computes the inputs a method needs and runs its kernel. The fields
+    can have any shape, such as (member, y, x), as long as the pressure
+    broadcasts against them.
+
+    Args:
+        ros_method (Method): The method, see pypros.methods
+        threshold (float, list): The checked method threshold
+        inputs (dict): The 'tair' and the 'tdew' or 'rh' fields
+        pressure (numpy array, optional): Defaults to None. The surface
+                                          pressure in hPa. If None, a
+                                          constant 1013.25 hPa is assumed.
+
+    Returns:
+        numpy array: The method result
+    """
+    inputs = dict(inputs)
+    needed = ros_method.inputs
+    tair = inputs['tair']
+
+    # The relative humidity is computed once and shared by the inputs
+    if 'rh' in needed and 'rh' not in inputs:
+        inputs['rh'] = td2hr(tair, inputs['tdew'])
+    if 'twet' in needed:
+        if pressure is None:
+            print('Since no DEM is supplied, wet bulb temperature ' +
+                  'calculations will assume a constant pressure of ' +
+                  '1013.25 hPa.')
+            inputs['twet'] = ttd2tw(tair, inputs.get('tdew'),
+                                    r_h=inputs.get('rh'))
+        else:
+            if 'tdew' not in inputs:
+                inputs['tdew'] = hr2td(tair, inputs['rh'])
+            inputs['twet'] = ttdp2tw(tair, inputs['tdew'], pressure)
+
+    with span('method.' + ros_method.name, 'kernel'):
+        return ros_method.kernel(inputs, threshold)
@@ -1,18 +1,36 @@
 '''
 Psychrometric calculations
 '''
+from numbers import Number
 from numpy import power
 from numpy import arctan
-from numpy import array
-from math import exp
-
-
+from numpy import asarray
+from numpy import divide
+from numpy import exp as np_exp
+from numpy import generic
+from numpy import ndarray
+from numpy import result_type
+from numpy import where
+from math import log
+from pypros.profiling import profiled
+from pypros.profiling import span
+
+# 7.5 * ln(10), to evaluate 10**(7.5 * x) as exp(MAGNUS_LN * x)
+MAGNUS_LN = 7.5 * log(10)
+
+
+@profiled()
 def td2hr(temp, tempd):
     """
     Returns the relative humidity from the temperature and the dew point
     Formula from:
     https://www.aprweather.com/pages/calc.htm
 
+    The ratio of both vapour pressures is evaluated as a single
+    exponential, in place (as an expression for lazy arrays, such as Dask
+    arrays). The dtype of the inputs is kept, so float32 fields give
+    float32 results.
+
     Both float values or numpy matrices can be passed as input
     and get as output
 
@@ -23,18 +41,40 @@ def td2hr(temp, tempd):
     Returns:
         float, numpy array: The relative humidity in %
     """
-    es = 10**(7.5*tempd/(237.7+tempd))
-    e = 10**(7.5*temp/(237.7+temp))
-
-    return 100*(es/e)
-
-
+    if _is_lazy(temp) or _is_lazy(tempd):
+        return 100 * np_exp(MAGNUS_LN * (tempd / (tempd + 237.7) -
+                                         temp / (temp + 237.7)))
+
+    dtype = result_type(temp, tempd, 1.0)
+    temp = asarray(temp, dtype=dtype)
+    tempd = asarray(tempd, dtype=dtype)
+
+    with span('td2hr.ratios', 'expression'):
+        r_h = asarray(tempd + 237.7)
+        divide(tempd, r_h, out=r_h)
+        exponent = asarray(temp + 237.7)
+        divide(temp, exponent, out=exponent)
+        r_h -= exponent
+    with span('td2hr.exp', 'expression'):
+        r_h *= MAGNUS_LN
+        np_exp(r_h, out=r_h)
+        r_h *= 100
+
+    if r_h.ndim == 0:
+        return r_h[()]
+    return r_h
+
+
+@profiled()
 def hr2td(temp, r_h):
     '''
     Returns the dew point from the relative humidity and the temperature
     Formula from:
     https://www.aprweather.com/pages/calc.htm
 
+    The powers of the humidity deficit are evaluated with products. The
+    dtype of the inputs is kept, so float32 fields give float32 results.
+
     Both float values or numpy matrices can be passed as input
     and get as output
 
@@ -45,13 +85,32 @@ def hr2td(temp, r_h):
     Returns:
         float, numpy array: The dew point in Celsius
     '''
-    return (temp - (14.55 + 0.114 * temp) *
-            (1.0 - (0.01 * r_h)) -
-            (((2.5 + 0.007 * temp) * (1 - (0.01 * r_h))) ** 3.0) -
-            ((15.9 + 0.117 * temp) * (1 - (0.01 * r_h)) ** 14.0))
+    if not (_is_lazy(temp) or _is_lazy(r_h)):
+        dtype = result_type(temp, r_h, 1.0)
+        temp = asarray(temp, dtype=dtype)
+        r_h = asarray(r_h, dtype=dtype)
+
+    deficit = 1.0 - 0.01 * r_h
+
+    cube = (2.5 + 0.007 * temp) * deficit
+    cube *= cube * cube
+    power_2 = deficit * deficit
+    power_4 = power_2 * power_2
+    power_2 *= power_4
+    power_4 *= power_4
+    power_4 *= power_2
 
+    tempd = temp - (14.55 + 0.114 * temp) * deficit
+    tempd -= cube
+    tempd -= (15.9 + 0.117 * temp) * power_4
 
-def ttd2tw(temp, tempd):
+    if tempd.ndim == 0:
+        return tempd[()]
+    return tempd
+
+
+@profiled()
+def ttd2tw(temp, tempd, r_h=None):
     """Gets the wet bulb temperature from the temperature and the dew point
     Formula taken from:
     https://journals.ametsoc.org/doi/full/10.1175/JAMC-D-11-0143.1
@@ -61,11 +120,18 @@ def ttd2tw(temp, tempd):
     Args:
         temp (float, numpy array): The temperature in Celsius
         tempd (float, numpy array): The dew point in Celsius
+        r_h (float, numpy array, optional): Defaults to None. The relative
+                                            humidity in %, if already
+                                            calculated with td2hr. The dew
+                                            point is not used in this case.
 
     Returns:
         float, numpy array: The wet bulb temperature in Celsius
     """
-    rh = td2hr(temp, tempd)
+    if r_h is None:
+        rh = td2hr(temp, tempd)
+    else:
+        rh = r_h
 
     return (temp*arctan(0.151977 * power((rh + 8.313659), 0.5)) +
             arctan(temp+rh) - arctan(rh-1.676331) +
@@ -73,47 +139,46 @@ def ttd2tw(temp, tempd):
             arctan(0.023101*rh) - 4.686035)
 
 
-def trhp2tw(temp, rh, z):
+@profiled()
+def trhp2tw(temp, rh, z, iterations=32):
     """Gets the wet bulb temperature from the temperature, relative humidity
     and pressure. Formula taken from:
     https://www.weather.gov/epz/wxcalc_wetbulb (Brice and Hall, 2003)
 
+    The formula is solved for all the pixels at once, with a fixed number
+    of bisection steps between temp - 100 and temp, so it works with lazy
+    arrays (such as Dask arrays) too.
+
     Args:
         temp (float, numpy array): The temperature in Celsius
-        rh (float, numpy array): The relative humidity in [0,1]
+        rh (float, numpy array): The relative humidity in %
         z (float, numpy array): The altitude in metres
+        iterations (int, optional): Defaults to 32. The number of bisection
+                                    steps. 32 steps give a precision
+                                    better than 1e-7 Celsius.
 
     Returns:
         float, numpy array: The wet bulb temperature in Celsius
     """
-    shape = temp.shape
-
-    temp = temp.reshape(-1)
-    rh = rh.reshape(-1)
-    p = _get_p_from_z(z).reshape(-1)
-
-    tw_out = []
-
-    for i in range(len(temp)):
-        rh_s = rh[i] + 1
-        tw = temp[i]
-
-        while rh_s >= rh[i]:
-            tw = tw - 0.001
-            es = 6.112*exp(17.67*temp[i]/(temp[i]+243.5))
-            ew = 6.112*exp(17.67*tw/(tw+243.5))
-            e = ew - p[i]*(temp[i]-tw)*0.00066*(1+(0.00115*tw))
-
-            rh_s = e / es * 100
+    p = _get_p_from_z(z)
+    es = 6.112*np_exp(17.67*temp/(temp+243.5))
 
-        tw_out.append(tw)
+    low = temp - 100.0
+    high = temp + 0.0
+    for _ in range(iterations):
+        tw = (low + high) / 2
+        ew = 6.112*np_exp(17.67*tw/(tw+243.5))
+        e = ew - p*(temp-tw)*0.00066*(1+(0.00115*tw))
 
-    tw_out = array(tw_out)
-    tw_out = tw_out.reshape(shape)
+        # The relative humidity grows with the wet bulb temperature
+        above = e / es * 100 >= rh
+        high = where(above, tw, high)
+        low = where(above, low, tw)
 
-    return tw_out
+    return (low + high) / 2
 
 
+@profiled()
 def _get_p_from_z(z):
     """Gets pressure field from altitude field considering an OACI atmosphere.
 
@@ -129,12 +194,16 @@ def _get_p_from_z(z):
     return p
 
 
+@profiled()
 def get_tw_sadeghi(tair, tdew, z):
     '''Gets the wet bulb temperature from air temperature, dew point
     temperature and pressure. Formula taken from:
     https://journals.ametsoc.org/doi/pdf/10.1175/JTECH-D-12-00191.1
 
-    Results close to trhp2tw, but computationally efficient
+    Results close to trhp2tw, but computationally efficient: from -20 to
+    40 Celsius, dew point depressions up to 30 Celsius and altitudes up to
+    3000 m, the maximum error is 1.4 Celsius (0.4 RMS), about 7 times
+    faster (see pypros.benchmark)
 
     Args:
         tair (float, numpy array): The air temperature in Celsius
@@ -144,16 +213,50 @@ def get_tw_sadeghi(tair, tdew, z):
     Returns:
         float, numpy array: The wet bulb temperature in Celsius
     '''
+    return ttdp2tw(tair, tdew, _get_p_from_z(z))
 
-    p = _get_p_from_z(z) / 10
-    ea = 0.611*(10**(7.5*tdew/(237.3+tdew)))
+
+@profiled()
+def ttdp2tw(tair, tdew, p):
+    '''Gets the wet bulb temperature from air temperature, dew point
+    temperature and pressure, with the Sadeghi et al. formula (see
+    get_tw_sadeghi). Useful when the pressure is known, as in NWP
+    pressure levels.
+
+    Args:
+        tair (float, numpy array): The air temperature in Celsius
+        tdew (float, numpy array): The dew point temperature in Celsius
+        p (float, numpy array): The pressure in hPa
+
+    Returns:
+        float, numpy array: The wet bulb temperature in Celsius
+    '''
+    p = p / 10
+    with span('ttdp2tw.vapour_pressure', 'expression'):
+        ea = 0.611*(10**(7.5*tdew/(237.3+tdew)))
 
     psych_ct = 6.42e-4
 
-    lambda0 = 0.0014 * 2.71828**(0.027 * tair)
-    xi = -3*(10**-7)*tair**3 - (10**-5)*tair**2 + 2*(10**-5)*tair + (
-         4.44*(10**-2))
-    phi = xi + psych_ct*p
-    psi = 0.611 - psych_ct*p*(tair) - ea
+    with span('ttdp2tw.coefficients', 'expression'):
+        lambda0 = 0.0014 * 2.71828**(0.027 * tair)
+        xi = -3*(10**-7)*tair**3 - (10**-5)*tair**2 + 2*(10**-5)*tair + (
+             4.44*(10**-2))
+        phi = xi + psych_ct*p
+        psi = 0.611 - psych_ct*p*(tair) - ea
+
+    with span('ttdp2tw.root', 'expression'):
+        return (-phi + (phi**2 - 4*lambda0*psi)**(0.5)) / (2*lambda0)
+
+
+def _is_lazy(value):
+    """Returns True for array objects other than numpy arrays, such as Dask
+    arrays, which can't be evaluated in place.
 
-    return (-phi + (phi**2 - 4*lambda0*psi)**(0.5)) / (2*lambda0)
+    Args:
+        value (object): The value to check
+
+    Returns:
+        bool: True if the value is a lazy array
+    """
+    return (hasattr(value, '__array_function__') and
+            not isinstance(value, (ndarray, generic, Number)))
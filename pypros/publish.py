@@ -0,0 +1,291 @@
+'''Publishes the latest PyPros result (or classes) field into a named
+shared memory segment, so processes on the same host can map it without
+reading the output files.
+
+The segment starts with a header of HEADER_SIZE bytes (shape, dtype,
+geotransform, projection, time and a version counter) followed by the
+field data. The version counter works as a sequence lock: it's odd while
+a field is being written, so readers retry until they get a consistent
+copy. The segment outlives the publishing process until it's unlinked, so
+consecutive runs update the same segment.
+'''
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+MAGIC = b'PROS'
+HEADER_SIZE = 4096
+# magic, layout version, sequence, time, rows, columns, dtype, geotransform
+# and projection length
+_HEADER = struct.Struct('<4sIQdQQ8s6dI')
+_SEQUENCE_OFFSET = 8
+PROJECTION_SIZE = HEADER_SIZE - _HEADER.size
+
+
+def _open_segment(name, create=False, size=0):
+    # The segments are not unlinked when the process that opened them exits
+    try:
+        return shared_memory.SharedMemory(name=name, create=create,
+                                          size=size, track=False)
+    except TypeError:
+        segment = shared_memory.SharedMemory(name=name, create=create,
+                                             size=size)
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(segment._name, 'shared_memory')
+        return segment
+
+
+def _unlink_segment(segment):
+    # Before Python 3.13, SharedMemory.unlink unregisters the segment from
+    # the resource tracker, which doesn't track it, printing an error
+    if hasattr(segment, '_track') or os.name == 'nt':
+        segment.unlink()
+    else:
+        import _posixshmem
+        _posixshmem.shm_unlink(segment._name)
+
+
+class _Segment:
+    def __init__(self, segment):
+        self.segment = segment
+        header = _HEADER.unpack_from(segment.buf)
+        if header[0] != MAGIC:
+            raise ValueError('The shared memory segment {} is not a PyPros '
+                             'result'.format(segment.name))
+        self.shape = (header[4], header[5])
+        self.dtype = np.dtype(header[6].rstrip(b'\0').decode())
+        self.sequence = np.ndarray((1,), np.uint64, buffer=segment.buf,
+                                   offset=_SEQUENCE_OFFSET)
+        self.data = np.ndarray(self.shape, self.dtype, buffer=segment.buf,
+                               offset=HEADER_SIZE)
+
+    def read_header(self):
+        header = _HEADER.unpack_from(self.segment.buf)
+        projection = bytes(self.segment.buf[_HEADER.size:_HEADER.size +
+                                            header[-1]]).decode()
+        return tuple(header[7:13]), projection, header[3]
+
+    def close(self):
+        # The numpy views must be released before closing the segment
+        self.sequence = None
+        self.data = None
+        self.segment.close()
+
+
+class ResultPublisher:
+    """Publishes fields of a fixed shape and dtype into a named shared
+    memory segment, created if it doesn't exist yet.
+    """
+    def __init__(self, name, shape, dtype=np.float64):
+        """
+        Args:
+            name (str): The shared memory segment name
+            shape (tuple): The (y, x) shape of the fields
+            dtype (numpy dtype, optional): Defaults to numpy.float64. The
+                                           fields type, numpy.uint8 for the
+                                           refl_mask classes.
+
+        Raises:
+            ValueError: Raised if the existing segment holds fields of a
+                        different shape or dtype
+        """
+        dtype = np.dtype(dtype)
+        shape = tuple(int(size) for size in shape)
+        try:
+            segment = _open_segment(name)
+        except FileNotFoundError:
+            segment = _open_segment(name, True, HEADER_SIZE + int(
+                np.prod(shape)) * dtype.itemsize)
+            _HEADER.pack_into(segment.buf, 0, MAGIC, 1, 0, 0.0, shape[0],
+                              shape[1], dtype.str.encode(),
+                              *([0.0] * 6), 0)
+
+        self._segment = _Segment(segment)
+        if self._segment.shape != shape or self._segment.dtype != dtype:
+            self._segment.close()
+            raise ValueError('The shared memory segment {} holds fields of '
+                             'a different shape or type'.format(name))
+        self.name = name
+        self._executor = None
+        self._pending = []
+
+    @property
+    def version(self):
+        """int: The number of fields published into the segment.
+        """
+        return int(self._segment.sequence[0]) // 2
+
+    def publish(self, field, geotransform, projection='', writer=None):
+        """Copies a field into the segment and increases the version.
+
+        Args:
+            field (numpy array): The field
+            geotransform (tuple): The field geotransform
+            projection (str, optional): Defaults to ''. The field projection,
+                                        as WKT
+            writer (function, optional): Defaults to None. A function
+                                         called without arguments in a
+                                         background thread once the field
+                                         is published, such as a call to
+                                         PyPros.save_file.
+
+        Raises:
+            IndexError: Raised if the field shape doesn't match
+            ValueError: Raised if the projection doesn't fit in the header
+
+        Returns:
+            int: The published version
+        """
+        if field.shape != self._segment.shape:
+            raise IndexError('Variables fields must have the' +
+                             ' same shape.')
+        projection = projection.encode()
+        if len(projection) > PROJECTION_SIZE:
+            raise ValueError('The projection must be shorter than {} '
+                             'bytes'.format(PROJECTION_SIZE))
+
+        sequence = self._segment.sequence
+        # An odd sequence means a previous writer died while publishing
+        start = int(sequence[0]) | 1
+        sequence[0] = start
+        np.copyto(self._segment.data, field, casting='unsafe')
+        header = _HEADER.unpack_from(self._segment.segment.buf)
+        _HEADER.pack_into(self._segment.segment.buf, 0, MAGIC, header[1],
+                          start, time.time(), header[4], header[5],
+                          header[6], *geotransform, len(projection))
+        self._segment.segment.buf[_HEADER.size:
+                                  _HEADER.size + len(projection)] = projection
+        sequence[0] = start + 1
+
+        if writer is not None:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(1)
+            self._pending = [future for future in self._pending
+                             if not future.done()]
+            self._pending.append(self._executor.submit(writer))
+
+        return (start + 1) // 2
+
+    def flush(self):
+        """Waits for the background writers and raises their errors.
+        """
+        pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        """Waits for the background writers and closes the segment. The
+        segment is kept for the readers, see unlink.
+        """
+        self.flush()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self._segment.close()
+
+    def unlink(self):
+        """Closes and removes the segment.
+        """
+        segment = self._segment.segment
+        self.close()
+        _unlink_segment(segment)
+
+
+class ResultReader:
+    """Reads the fields published into a named shared memory segment.
+    """
+    def __init__(self, name):
+        """
+        Args:
+            name (str): The shared memory segment name
+
+        Raises:
+            FileNotFoundError: Raised if the segment doesn't exist
+            ValueError: Raised if the segment is not a PyPros result
+        """
+        segment = _open_segment(name)
+        try:
+            self._segment = _Segment(segment)
+        except ValueError:
+            segment.close()
+            raise
+        self.name = name
+        self.shape = self._segment.shape
+        self.dtype = self._segment.dtype
+
+    @property
+    def version(self):
+        """int: The number of fields published into the segment.
+        """
+        return int(self._segment.sequence[0]) // 2
+
+    def read(self, copy=True, timeout=1.0):
+        """Reads the latest published field.
+
+        Args:
+            copy (bool, optional): Defaults to True. If False, a read only
+                                   view of the segment is returned without
+                                   copying the data. The view changes when
+                                   a new field is published, so the version
+                                   must be checked again after using it.
+            timeout (float, optional): Defaults to 1. The maximum time in
+                                       seconds waiting for a consistent
+                                       field.
+
+        Raises:
+            TimeoutError: Raised if the field is still being written after
+                          the timeout
+
+        Returns:
+            tuple: The field, its geotransform, its projection, its
+                   publishing time (seconds since the epoch) and its
+                   version
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            start = int(self._segment.sequence[0])
+            if start % 2 == 0:
+                if copy:
+                    field = self._segment.data.copy()
+                else:
+                    field = self._segment.data.view()
+                    field.flags.writeable = False
+                geotransform, projection, published = \
+                    self._segment.read_header()
+                if int(self._segment.sequence[0]) == start:
+                    return (field, geotransform, projection, published,
+                            start // 2)
+            if time.monotonic() > deadline:
+                raise TimeoutError('The field is still being written.')
+            time.sleep(0.0005)
+
+    def wait(self, version, timeout=None, interval=0.01):
+        """Waits until a version newer than the given one is published.
+
+        Args:
+            version (int): The last version read
+            timeout (float, optional): Defaults to None. The maximum time
+                                       to wait in seconds. None waits
+                                       forever.
+            interval (float, optional): Defaults to 0.01. The polling
+                                        interval in seconds.
+
+        Returns:
+            bool: True if a newer version is available
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.version <= version:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(interval)
+        return True
+
+    def close(self):
+        """Closes the segment. Views returned with copy=False must be
+        released first.
+        """
+        self._segment.close()
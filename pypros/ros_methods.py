@@ -1,10 +1,24 @@
 """Implements several rain or snow methodologies.
 """
+from math import log
 from pypros.psychrometrics import td2hr
+from pypros.psychrometrics import _is_lazy
+from pypros.profiling import profiled
 from numpy import where
+from numpy import array
+from numpy import asarray
+from numpy import errstate
+from numpy import exp
+from numpy import negative
+from numpy import reciprocal
+from numpy import result_type
 
+# Natural logarithm of the 2.7182818 base used by Koistinen and Saltikoff
+KS_LOG_BASE = log(2.7182818)
 
-def calculate_koistinen_saltikoff(temp, tempd):
+
+@profiled()
+def calculate_koistinen_saltikoff(temp, tempd, r_h=None):
     """Returns the Koistinen-Saltikoff value.
 
     Koistinen J., Saltikoff E. (1998): Experience of customer products of
@@ -18,41 +32,83 @@ def calculate_koistinen_saltikoff(temp, tempd):
     - 0.3 < prob < 0.7 --> sleet
     - prob > 0.7 --> snow
 
+    The probability is evaluated as a logistic function (see expit), so
+    very cold pixels don't raise overflow warnings.
+
     Both float values or numpy matrices can be passed as input
     and get as output
 
     Args:
         temp (float, numpy array): The temperature in Celsius
         tempd (float, numpy array): The dew point in Celsius
+        r_h (float, numpy array, optional): Defaults to None. The relative
+                                            humidity in %, if already
+                                            calculated with td2hr. The dew
+                                            point is not used in this case.
 
     Returns:
         float, numpy array: The Koistinen J., Saltikoff E. formula value
     """
-    prob = 1 - 1 / (1 + 2.7182818 ** (22.0-2.7*temp-0.2*td2hr(temp, tempd)))
-    return prob
+    if r_h is None:
+        r_h = td2hr(temp, tempd)
+
+    return expit((22.0 - 2.7*temp - 0.2*r_h) * KS_LOG_BASE)
+
+
+@profiled()
+def expit(x):
+    """Returns the logistic function 1 / (1 + exp(-x)).
+
+    Large negative arguments make exp(-x) overflow to inf, which gives the
+    exact limit value 0, so the overflow warning is silenced. The result is
+    calculated in place in a single buffer, except for lazy arrays (such as
+    Dask arrays), which are evaluated as an expression.
+
+    Args:
+        x (float, numpy array): The function argument
+
+    Returns:
+        float, numpy array: The logistic function value, in [0, 1]
+    """
+    if _is_lazy(x):
+        return 1 / (1 + exp(-x))
 
+    value = array(x, dtype=result_type(x, 1.0))
 
+    negative(value, out=value)
+    with errstate(over='ignore'):
+        exp(value, out=value)
+    value += 1
+    reciprocal(value, out=value)
+
+    if value.ndim == 0:
+        return value[()]
+    return value
+
+
+@profiled()
 def calculate_single_threshold(field, th):
     """Calculates the precipitation type based on a threshold value.
     If value > threshold --> rain --> 0
     If value <= threshold --> snow --> 1
 
+    Non finite values are kept. The input field is not modified, and lazy
+    arrays (such as Dask arrays) return lazy results.
+
     Args:
         field (float, numpy array): Meteorological variable field
-        th (float): Threshold from which precipitation type is discriminated
+        th (float, numpy array): Threshold from which precipitation type
+                                 is discriminated. A field broadcasting
+                                 against the input field gives a
+                                 threshold for each pixel.
 
     Returns:
         float, numpy array: Precipitation type field
     """
-    above_th = where(field > th)
-    under_th = where(field <= th)
-
-    field[above_th] = 0
-    field[under_th] = 1
-
-    return field
+    return where(field > th, 0, where(field <= th, 1, field))
 
 
+@profiled()
 def calculate_dual_threshold(field, th_s, th_r):
     """Calculates the precipitation type based on two threshold
     values, one for rain and one for snow.
@@ -60,34 +116,34 @@ def calculate_dual_threshold(field, th_s, th_r):
     If value <= th_s --> snow --> 1
     If th_s < value < th_r --> mixed --> 0.5
 
+    Non finite values are kept and the input field is not modified. The
+    thresholds can be fields broadcasting against the input field, i.e. a
+    threshold for each pixel.
+
     Args:
         field (float, numpy array): Meteorological variable field
-        th_s (float): Snow threshold. Values below this threshold
-                      classified as snow.
-        th_r (float): Rain threshold. Values above this threshold
-                      classified as rain.
+        th_s (float, numpy array): Snow threshold. Values below this
+                                   threshold classified as snow.
+        th_r (float, numpy array): Rain threshold. Values above this
+                                   threshold classified as rain.
 
     Raises:
-        ValueError: Raised if th_r is smaller than th_s.
+        ValueError: Raised if th_r is smaller than th_s (at any pixel).
 
     Returns:
         float, numpy array: Precipitation type field
     """
-    if th_r <= th_s:
+    if (asarray(th_r) <= th_s).any():
         raise ValueError("Incorrect thresholds, th_s value must be " +
                          "smaller than th_r")
 
-    above_th_r = where(field >= th_r)
-    under_th_s = where(field <= th_s)
-    mixed = where((field < th_r) & (field > th_s))
-
-    field[above_th_r] = 0
-    field[under_th_s] = 1
-    field[mixed] = 0.5
+    mixed = (field < th_r) & (field > th_s)
 
-    return field
+    return where(field >= th_r, 0,
+                 where(field <= th_s, 1, where(mixed, 0.5, field)))
 
 
+@profiled()
 def calculate_linear_transition(field, th_s, th_r):
     """Calculates the probability of precipitation type based on
     two threshold values, one for rain and one for snow. Assumes
@@ -96,29 +152,26 @@ def calculate_linear_transition(field, th_s, th_r):
     If value <= th_s --> snow --> 1
     If th_s < value < th_r --> mixed --> (0, 1)
 
+    Non finite values are kept and the input field is not modified. The
+    thresholds can be fields broadcasting against the input field, i.e. a
+    threshold for each pixel.
+
     Args:
         field (float, numpy array): Meteorological variable field
-        th_s (float): Snow threshold. Values below this threshold
-                      classified as snow.
-        th_r (float): Rain threshold. Values above this threshold
-                      classified as rain.
+        th_s (float, numpy array): Snow threshold. Values below this
+                                   threshold classified as snow.
+        th_r (float, numpy array): Rain threshold. Values above this
+                                   threshold classified as rain.
 
     Raises:
-        ValueError: Raised if th_r is smaller than th_s.
+        ValueError: Raised if th_r is smaller than th_s (at any pixel).
 
     Returns:
         float, numpy array: Probability of precipitation type field
     """
-    if th_r <= th_s:
+    if (asarray(th_r) <= th_s).any():
         raise ValueError("Incorrect thresholds, th_s value must be " +
                          "smaller than th_r")
 
-    above_th_r = where(field >= th_r)
-    under_th_s = where(field <= th_s)
-    mixed = where((field < th_r) & (field > th_s))
-
-    field[above_th_r] = 0
-    field[under_th_s] = 1
-    field[mixed] = (field[mixed] - th_r) / (th_s - th_r)
-
-    return field
+    return where(field >= th_r, 0,
+                 where(field <= th_s, 1, (field - th_r) / (th_s - th_r)))
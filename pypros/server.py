@@ -0,0 +1,337 @@
+'''Local PyPros service answering on demand requests over HTTP on a UNIX
+socket.
+
+The server keeps the fields of its domains (DEMs, derived pressure and
+the latest NWP fields) in memory, so each request only computes the
+requested bounding box with the requested method and threshold. The
+requests are computed by a bounded pool of worker threads, and requests
+beyond the pool and its queue are rejected with the 503 status.
+
+Endpoints:
+    - GET /domains: The domains and their variables, as JSON
+    - POST /pros: Computes a request, a JSON object with the domain,
+      method, threshold, bbox, bbox_proj, product (result or masked) and
+      format (npz or tiff). The npz format is a compressed NumPy archive
+      with the field, geotransform and projection arrays.
+    - POST /reload: Drops the cached NWP fields of a domain ({"domain":
+      name}), so the files are read again on the next request. The DEM is
+      kept.
+
+The domains are configured as in the pypros_jobs job files (see
+pypros.jobs). Example client, using the query helper:
+
+.. code:: python
+
+    field, geotransform, projection = query(
+        '/run/pypros.sock', domain='catalonia', method='single_tw',
+        threshold=1.5, bbox=[380000, 4580000, 420000, 4620000])
+'''
+import http.client
+import io
+import json
+import os
+import socket
+import socketserver
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+
+import numpy as np
+
+from pypros.jobs import Domain, load_job_file
+from pypros.methods import get_method
+
+FORMATS = {'npz': 'application/octet-stream', 'tiff': 'image/tiff'}
+
+PRODUCTS = ['result', 'masked']
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Idle keep alive connections release their worker
+    timeout = 30
+
+    def address_string(self):
+        # UNIX sockets have no client address
+        return 'local'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send(status, json.dumps({'error': message}).encode())
+
+    def do_GET(self):
+        if self.path != '/domains':
+            self.send_error_json(404, 'Unknown path {}'.format(self.path))
+            return
+        self.send(200, json.dumps({
+            name: domain.vars_files + (['refl'] if domain.refl else [])
+            for name, domain in self.server.domains.items()}).encode())
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/pros':
+                body, content_type = self.server.compute(request)
+                self.send(200, body, content_type)
+            elif self.path == '/reload':
+                self.server.reload(request.get('domain'))
+                self.send(200, b'{}')
+            else:
+                self.send_error_json(404,
+                                     'Unknown path {}'.format(self.path))
+        except (ValueError, IndexError, KeyError) as err:
+            self.send_error_json(400, str(err))
+        except Exception as err:
+            self.send_error_json(500, str(err))
+
+
+class _BusyHandler(_Handler):
+    # Answers 503 to a request without computing it
+    timeout = 1
+
+    def do_GET(self):
+        self.close_connection = True
+        self.send_error_json(503, 'The server is busy')
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.do_GET()
+
+
+class PyProsServer(socketserver.UnixStreamServer):
+    """HTTP server on a UNIX socket computing PyPros requests.
+    """
+    def __init__(self, config, socket_path, workers=4, queue_size=16,
+                 verbose=False):
+        """
+        Args:
+            config (str, dict): The domains configuration, as in the
+                                pypros_jobs job files (only the 'domains'
+                                key is used), or its file path
+            socket_path (str): The UNIX socket path. An existing socket
+                               file is replaced.
+            workers (int, optional): Defaults to 4. The number of worker
+                                     threads computing the requests
+            queue_size (int, optional): Defaults to 16. The number of
+                                        requests waiting for a worker.
+                                        Further requests are rejected.
+            verbose (bool, optional): Defaults to False. If True, each
+                                      request is logged to the standard
+                                      error
+
+        Raises:
+            ValueError: Raised when the configuration is not valid
+        """
+        if isinstance(config, str):
+            config = load_job_file(config)
+        try:
+            self.domains = {name: Domain(name, domain)
+                            for name, domain in config['domains'].items()}
+        except KeyError as err:
+            raise ValueError("The configuration file has some missing " +
+                             "key: {}".format(err))
+        self.verbose = verbose
+        self._executor = ThreadPoolExecutor(workers)
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, _Handler)
+
+    def process_request(self, request, client_address):
+        """Hands the request to the worker pool, or rejects it if the pool
+        and its queue are full.
+        """
+        if not self._slots.acquire(blocking=False):
+            try:
+                _BusyHandler(request, client_address, self)
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self._executor.submit(self._process, request, client_address)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        """Waits for the running requests and removes the socket file.
+        """
+        super().server_close()
+        self._executor.shutdown()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+    def check_request(self, request):
+        """Checks a /pros request before computing it.
+
+        Args:
+            request (dict): The request
+
+        Raises:
+            ValueError: Raised when the request is not valid
+
+        Returns:
+            Domain: The request domain
+        """
+        if request.get('domain') not in self.domains:
+            raise ValueError('Non valid domain. Valid values are ' +
+                             ', '.join(self.domains))
+        domain = self.domains[request['domain']]
+        ros_method = get_method(request.get('method', 'ks'))
+        request['threshold'] = ros_method.check_threshold(
+            request.get('threshold'))
+        ros_method.check_variables(domain.vars_files)
+        if request.get('product', 'result') not in PRODUCTS:
+            raise ValueError('Non valid product. Valid values are ' +
+                             ', '.join(PRODUCTS))
+        if request.get('product') == 'masked' and domain.refl is None:
+            raise ValueError('The masked product needs the domain ' +
+                             'reflectivity')
+        if request.get('format', 'npz') not in FORMATS:
+            raise ValueError('Non valid format. Valid values are ' +
+                             ', '.join(FORMATS))
+        return domain
+
+    def compute(self, request):
+        """Computes a /pros request.
+
+        Args:
+            request (dict): The request
+
+        Raises:
+            ValueError: Raised when the request is not valid
+
+        Returns:
+            tuple: The response body and its content type
+        """
+        from pypros.pros import PyPros
+
+        domain = self.check_request(request)
+        bbox, bbox_proj = request.get('bbox'), request.get('bbox_proj')
+        pressure = None
+        if 'twet' in get_method(request.get('method', 'ks')).inputs:
+            pressure = domain.get_pressure(bbox, bbox_proj)
+
+        inst = PyPros(domain.variables_file, request.get('method', 'ks'),
+                      request['threshold'], domain.data_format,
+                      backend=domain.backend, time=domain.time,
+                      pressure=pressure, bbox=bbox, bbox_proj=bbox_proj)
+        field = inst.result
+        if request.get('product') == 'masked':
+            field = inst.refl_mask(domain.refl)
+        field = np.asarray(field)
+
+        if request.get('format', 'npz') == 'tiff':
+            return _to_geotiff(inst, field), FORMATS['tiff']
+        buffer = io.BytesIO()
+        np.savez_compressed(buffer, field=field,
+                            geotransform=np.array(inst.geotransform),
+                            projection=np.array(inst.out_proj.ExportToWkt()))
+        return buffer.getvalue(), FORMATS['npz']
+
+    def reload(self, name):
+        """Drops the cached fields of a domain, except its DEM.
+
+        Args:
+            name (str): The domain name
+
+        Raises:
+            ValueError: Raised when the domain doesn't exist
+        """
+        if name not in self.domains:
+            raise ValueError('Non valid domain. Valid values are ' +
+                             ', '.join(self.domains))
+        domain = self.domains[name]
+        domain.backend.clear(keep=[domain.dem])
+
+
+def _to_geotiff(inst, field):
+    # Written in memory, without file round trips
+    from osgeo import gdal
+    from pypros.io_backends import GDALBackend
+
+    info = {'projection': inst.out_proj.ExportToWkt(),
+            'geotransform': inst.geotransform,
+            'size': inst.size}
+    if inst.mask is not None or inst.computed is not None:
+        info['nodata'] = inst.nodata
+    file_name = '/vsimem/pypros_{}.tif'.format(uuid.uuid4().hex)
+    try:
+        GDALBackend().write(file_name, field, info)
+        handle = gdal.VSIFOpenL(file_name, 'rb')
+        gdal.VSIFSeekL(handle, 0, os.SEEK_END)
+        size = gdal.VSIFTellL(handle)
+        gdal.VSIFSeekL(handle, 0, os.SEEK_SET)
+        body = gdal.VSIFReadL(1, size, handle)
+        gdal.VSIFCloseL(handle)
+    finally:
+        gdal.Unlink(file_name)
+    return body
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP client connection over a UNIX socket.
+    """
+    def __init__(self, socket_path, timeout=60):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def query(socket_path, timeout=60, **request):
+    """Requests a field to a PyProsServer.
+
+    Args:
+        socket_path (str): The server UNIX socket path
+        timeout (float, optional): Defaults to 60. The timeout in seconds
+        **request: The request: domain, method, threshold, bbox, bbox_proj
+                   and product
+
+    Raises:
+        ValueError: Raised when the request is not valid
+        RuntimeError: Raised when the server fails or is busy
+
+    Returns:
+        tuple: The field, its geotransform and its projection
+    """
+    request['format'] = 'npz'
+    connection = UnixHTTPConnection(socket_path, timeout)
+    try:
+        connection.request('POST', '/pros', json.dumps(request),
+                           {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        body = response.read()
+    finally:
+        connection.close()
+
+    if response.status != 200:
+        message = json.loads(body)['error'] if body else response.reason
+        if response.status == 400:
+            raise ValueError(message)
+        raise RuntimeError(message)
+    with np.load(io.BytesIO(body)) as data:
+        return (data['field'], tuple(data['geotransform']),
+                str(data['projection']))
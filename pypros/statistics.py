@@ -0,0 +1,218 @@
+'''Accumulated precipitation type statistics over long archives.
+
+The classes of each time step (as returned by PyPros.refl_mask) are added
+to running per-pixel counters, so the memory use doesn't depend on the
+number of time steps. Counters of different time chunks can be computed
+in parallel and merged.
+'''
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                wait)
+
+import numpy as np
+
+from pypros.categories import NODATA_CLASS
+
+PHASE_NAMES = ['dry', 'rain', 'sleet', 'snow']
+
+# Phase of each refl_mask class
+PHASE_BINS = np.array([0] + [1] * 5 + [2] * 5 + [3] * 5, dtype=np.uint8)
+
+
+class PrecipTypeCounter:
+    """Running per-pixel counters of the precipitation type classes.
+    """
+    def __init__(self, shape, by_phase=True, dtype=np.uint32):
+        """
+        Args:
+            shape (tuple): The (y, x) shape of the classes fields
+            by_phase (bool, optional): Defaults to True. If True, the
+                                       classes are counted by phase (dry,
+                                       rain, sleet and snow). Otherwise,
+                                       each of the 16 classes is counted.
+            dtype (numpy dtype, optional): Defaults to numpy.uint32. The
+                                           counters type, uint16 halves the
+                                           memory for up to 65535 steps.
+        """
+        self.shape = tuple(shape)
+        self.by_phase = by_phase
+        self.names = PHASE_NAMES if by_phase else list(range(16))
+        self.counts = np.zeros((len(self.names),) + self.shape, dtype=dtype)
+        self.valid = np.zeros(self.shape, dtype=dtype)
+        self.steps = 0
+
+    def update(self, classes):
+        """Adds the classes of a time step to the counters. NoData pixels
+        are not counted.
+
+        Args:
+            classes (numpy array): The classes field
+
+        Raises:
+            IndexError: Raised if the classes field shape doesn't match
+            OverflowError: Raised if the counters type is too small
+        """
+        if classes.shape != self.shape:
+            raise IndexError('Variables fields must have the' +
+                             ' same shape.')
+        if self.steps >= np.iinfo(self.counts.dtype).max:
+            raise OverflowError('Too many steps for the counters type.')
+
+        valid = classes != NODATA_CLASS
+        if self.by_phase:
+            bins = PHASE_BINS[np.where(valid, classes, 0)]
+        else:
+            bins = classes
+
+        for value in range(len(self.names)):
+            np.add(self.counts[value], (bins == value) & valid,
+                   out=self.counts[value], casting='unsafe')
+        np.add(self.valid, valid, out=self.valid, casting='unsafe')
+        self.steps += 1
+
+    def merge(self, other):
+        """Adds the counters of another PrecipTypeCounter.
+
+        Args:
+            other (PrecipTypeCounter): The counters to add
+
+        Raises:
+            ValueError: Raised if the counters are not compatible
+            OverflowError: Raised if the counters type is too small
+        """
+        if (other.shape != self.shape or other.by_phase != self.by_phase):
+            raise ValueError('The counters must have the same shape and ' +
+                             'classes.')
+        if self.steps + other.steps > np.iinfo(self.counts.dtype).max:
+            raise OverflowError('Too many steps for the counters type.')
+        self.counts += other.counts.astype(self.counts.dtype)
+        self.valid += other.valid.astype(self.valid.dtype)
+        self.steps += other.steps
+
+    def frequencies(self):
+        """Returns the frequency of each class over the valid time steps.
+
+        Returns:
+            numpy array: The float32 frequencies, shaped (classes, y, x).
+                         NaN where no time step was valid.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (self.counts / self.valid.astype(np.float32)).astype(
+                np.float32)
+
+    def save(self, file_name):
+        """Saves the counters into a compressed .npz file.
+
+        Args:
+            file_name (str): The output file path
+        """
+        with open(file_name, 'wb') as f_p:
+            np.savez_compressed(f_p, counts=self.counts, valid=self.valid,
+                                steps=self.steps, by_phase=self.by_phase)
+
+    @classmethod
+    def load(cls, file_name):
+        """Loads the counters saved with save.
+
+        Args:
+            file_name (str): The counters file path
+
+        Returns:
+            PrecipTypeCounter: The loaded counters
+        """
+        with np.load(file_name) as data:
+            counter = cls(data['valid'].shape, bool(data['by_phase']),
+                          data['counts'].dtype)
+            counter.counts[:] = data['counts']
+            counter.valid[:] = data['valid']
+            counter.steps = int(data['steps'])
+        return counter
+
+
+def pros_classes(item):
+    """Calculates the classes of a time step with PyPros. To be used as
+    the loader of aggregate.
+
+    Args:
+        item (dict): The PyPros arguments (variables_file, method,
+                     threshold, data_format...) and the reflectivity
+                     'refl', which is used up front, so only the
+                     precipitating pixels are computed.
+
+    Returns:
+        numpy array: The classes field
+    """
+    from pypros.pros import PyPros
+
+    arguments = dict(item)
+    return PyPros(**arguments).refl_mask()
+
+
+def _aggregate_chunk(items, loader, shape, by_phase, dtype):
+    counter = PrecipTypeCounter(shape, by_phase, dtype)
+    for item in items:
+        counter.update(loader(item))
+    return counter
+
+
+def _chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _merge_finished(counter, running):
+    # Merges the finished chunks and returns the running ones
+    finished, running = wait(running, return_when=FIRST_COMPLETED)
+    for future in finished:
+        counter.merge(future.result())
+    return running
+
+
+def aggregate(items, shape, loader=pros_classes, by_phase=True,
+              dtype=np.uint32, workers=1, chunk_size=100):
+    """Accumulates the precipitation type classes of a sequence of time
+    steps. With several workers, the sequence is split into chunks of
+    time steps that are counted in parallel processes and then merged.
+
+    Args:
+        items (iterable): The time steps, passed to the loader
+        shape (tuple): The (y, x) shape of the classes fields
+        loader (function, optional): Defaults to pros_classes. Returns the
+                                     classes field of a time step. Must be
+                                     a module level function if workers
+                                     is more than 1.
+        by_phase (bool, optional): Defaults to True. Count by phase or by
+                                   class, see PrecipTypeCounter.
+        dtype (numpy dtype, optional): Defaults to numpy.uint32. The
+                                       counters type.
+        workers (int, optional): Defaults to 1. The number of processes.
+        chunk_size (int, optional): Defaults to 100. The number of time
+                                    steps per parallel chunk.
+
+    Returns:
+        PrecipTypeCounter: The accumulated counters
+    """
+    if workers <= 1:
+        return _aggregate_chunk(items, loader, shape, by_phase, dtype)
+
+    counter = PrecipTypeCounter(shape, by_phase, dtype)
+    chunks = _chunks(items, chunk_size)
+
+    # A bounded number of chunks in flight, each counter dropped once
+    # merged, so the memory doesn't grow with the number of chunks
+    with ProcessPoolExecutor(workers) as executor:
+        running = set()
+        for chunk in chunks:
+            if len(running) >= 2 * workers:
+                running = _merge_finished(counter, running)
+            running.add(executor.submit(_aggregate_chunk, chunk, loader,
+                                        shape, by_phase, dtype))
+        while running:
+            running = _merge_finished(counter, running)
+
+    return counter
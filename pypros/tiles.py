@@ -0,0 +1,321 @@
+'''Tile pyramids of the precipitation type classes for web map serving.
+
+The refl_mask classes are warped to Web Mercator by blocks of tiles,
+cut into 256x256 colormapped PNG tiles and written as an XYZ directory
+({z}/{x}/{y}.png) or an MBTiles (SQLite) file. Only a block is in memory
+at a time, whatever the zoom level. The tiles are encoded in parallel
+and, since a hash of each tile is stored with the pyramid, only the tiles
+that changed since the previous cycle are written again.
+'''
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from osgeo import gdal, osr
+from pypros.categories import CLASS_COLORS, NODATA_CLASS
+
+TILE_SIZE = 256
+# The tiles warped together, in each direction
+BLOCK_TILES = 8
+MERCATOR_EXTENT = 20037508.342789244
+_CREATE_HASHES = ('CREATE TABLE IF NOT EXISTS tile_hashes ' +
+                  '(key TEXT PRIMARY KEY, hash TEXT)')
+
+
+def encode_png(tile, colors):
+    """Encodes a classes array as a paletted PNG image. Values without
+    color are drawn transparent, as the first color.
+
+    Args:
+        tile (numpy array): The uint8 classes array
+        colors (list): The RGBA color of each class value
+
+    Returns:
+        bytes: The PNG image
+    """
+    tile = np.where(tile < len(colors), tile, 0).astype(np.uint8)
+    height, width = tile.shape
+
+    def chunk(chunk_type, data):
+        return (struct.pack('>I', len(data)) + chunk_type + data +
+                struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+    rows = np.zeros((height, width + 1), dtype=np.uint8)
+    rows[:, 1:] = tile
+    palette = np.array(colors, dtype=np.uint8)
+
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height,
+                                       8, 3, 0, 0, 0)) +
+            chunk(b'PLTE', palette[:, :3].tobytes()) +
+            chunk(b'tRNS', palette[:, 3].tobytes()) +
+            chunk(b'IDAT', zlib.compress(rows.tobytes(), 6)) +
+            chunk(b'IEND', b''))
+
+
+def get_tile_range(bounds, zoom):
+    """Gets the XYZ tiles covering some Web Mercator bounds.
+
+    Args:
+        bounds (tuple): The (xmin, ymin, xmax, ymax) Web Mercator bounds
+        zoom (int): The zoom level
+
+    Returns:
+        tuple: The (x_min, y_min, x_max, y_max) tile indices, both ends
+               included
+    """
+    tile_span = 2 * MERCATOR_EXTENT / 2 ** zoom
+    last = 2 ** zoom - 1
+
+    def index(value):
+        return min(max(int(math.floor(value / tile_span)), 0), last)
+
+    return (index(bounds[0] + MERCATOR_EXTENT),
+            index(MERCATOR_EXTENT - bounds[3]),
+            index(bounds[2] + MERCATOR_EXTENT - 1e-6),
+            index(MERCATOR_EXTENT - bounds[1] - 1e-6))
+
+
+def get_tile_bounds(tile_x, tile_y, zoom):
+    """Gets the Web Mercator bounds of an XYZ tile.
+
+    Args:
+        tile_x (int): The tile column
+        tile_y (int): The tile row, from the north
+        zoom (int): The zoom level
+
+    Returns:
+        tuple: The (xmin, ymin, xmax, ymax) tile bounds
+    """
+    tile_span = 2 * MERCATOR_EXTENT / 2 ** zoom
+    return (-MERCATOR_EXTENT + tile_x * tile_span,
+            MERCATOR_EXTENT - (tile_y + 1) * tile_span,
+            -MERCATOR_EXTENT + (tile_x + 1) * tile_span,
+            MERCATOR_EXTENT - tile_y * tile_span)
+
+
+def mercator_to_lonlat(x, y):
+    """Converts Web Mercator coordinates to longitude and latitude.
+
+    Args:
+        x (float): The x coordinate in metres
+        y (float): The y coordinate in metres
+
+    Returns:
+        tuple: The longitude and latitude in degrees
+    """
+    return (x / MERCATOR_EXTENT * 180,
+            math.degrees(math.atan(math.sinh(y / MERCATOR_EXTENT * math.pi))))
+
+
+class TileWriter:
+    """Writes the tile pyramid of a precipitation type classes field.
+    """
+    def __init__(self, out_path, zooms, tile_format='xyz', colors=None,
+                 workers=4):
+        """
+        Args:
+            out_path (str): The output directory (xyz) or file (mbtiles)
+            zooms (list): The zoom levels to write
+            tile_format (str, optional): Defaults to xyz. The pyramid
+                                         format, xyz or mbtiles.
+            colors (list, optional): Defaults to None. The RGBA color of
+                                     each class value. If None,
+                                     CLASS_COLORS is used.
+            workers (int, optional): Defaults to 4. The number of threads
+                                     encoding tiles.
+
+        Raises:
+            ValueError: Raised when the tile format is not valid
+        """
+        if tile_format not in ('xyz', 'mbtiles'):
+            raise ValueError('Non valid tile format. Valid values are ' +
+                             'xyz and mbtiles')
+        self.out_path = out_path
+        self.zooms = list(zooms)
+        self.tile_format = tile_format
+        self.colors = CLASS_COLORS if colors is None else colors
+        self.workers = workers
+
+    def write(self, classes, geotransform, projection):
+        """Writes the tiles that changed since the previous call.
+
+        Args:
+            classes (numpy array): The classes field, as returned by
+                                   PyPros.refl_mask. NoData values are
+                                   drawn transparent.
+            geotransform (tuple): The field geotransform
+            projection (str): The field projection, as WKT
+
+        Returns:
+            int: The number of tiles written or deleted
+        """
+        classes = np.where((classes >= 0) & (classes < NODATA_CLASS),
+                           classes, 0)
+        src = gdal.GetDriverByName('MEM').Create(
+            '', classes.shape[1], classes.shape[0], 1, gdal.GDT_Byte)
+        src.SetGeoTransform(geotransform)
+        src.SetProjection(projection)
+        src.GetRasterBand(1).WriteArray(classes.astype(np.uint8))
+
+        bounds = self._get_mercator_bounds(src)
+        old_hashes = self._load_hashes()
+        new_hashes = {}
+        written = [0]
+
+        def encode(item):
+            return item[0], encode_png(item[1], self.colors)
+
+        def changed_images(executor):
+            # Each block is encoded and written before warping the next
+            for zoom in self.zooms:
+                for block in self._cut_tiles(src, bounds, zoom):
+                    pending = []
+                    for key, tile in block:
+                        if not tile.any():
+                            continue
+                        tile_hash = hashlib.sha1(tile.tobytes()).hexdigest()
+                        new_hashes[key] = tile_hash
+                        if old_hashes.get(key) != tile_hash:
+                            pending.append((key, tile))
+                    written[0] += len(pending)
+                    yield from executor.map(encode, pending)
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            if self.tile_format == 'xyz':
+                removed = self._write_xyz(changed_images(executor),
+                                          old_hashes, new_hashes)
+            else:
+                removed = self._write_mbtiles(changed_images(executor),
+                                              old_hashes, new_hashes, bounds)
+        src = None
+
+        return written[0] + removed
+
+    def _get_mercator_bounds(self, src):
+        geot = src.GetGeoTransform()
+        x_size, y_size = src.RasterXSize, src.RasterYSize
+        edge = np.linspace(0, 1, 21)
+        cols = np.concatenate([edge, edge, np.zeros(21), np.ones(21)])
+        rows = np.concatenate([np.zeros(21), np.ones(21), edge, edge])
+        x_coords = geot[0] + cols * x_size * geot[1] + rows * y_size * geot[2]
+        y_coords = geot[3] + cols * x_size * geot[4] + rows * y_size * geot[5]
+
+        src_proj = osr.SpatialReference()
+        src_proj.ImportFromWkt(src.GetProjection())
+        dst_proj = osr.SpatialReference()
+        dst_proj.ImportFromEPSG(3857)
+        if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+            src_proj.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+            dst_proj.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        transform = osr.CoordinateTransformation(src_proj, dst_proj)
+        points = np.array(transform.TransformPoints(
+            list(zip(x_coords.tolist(), y_coords.tolist()))))
+
+        return (points[:, 0].min(), points[:, 1].min(),
+                points[:, 0].max(), points[:, 1].max())
+
+    def _cut_tiles(self, src, bounds, zoom):
+        # Yields the tiles of each block of up to BLOCK_TILES x BLOCK_TILES
+        x_min, y_min, x_max, y_max = get_tile_range(bounds, zoom)
+        for block_y in range(y_min, y_max + 1, BLOCK_TILES):
+            last_y = min(block_y + BLOCK_TILES - 1, y_max)
+            for block_x in range(x_min, x_max + 1, BLOCK_TILES):
+                last_x = min(block_x + BLOCK_TILES - 1, x_max)
+                out_bounds = (get_tile_bounds(block_x, last_y, zoom)[:2] +
+                              get_tile_bounds(last_x, block_y, zoom)[2:])
+
+                warped = gdal.Warp('', src, format='MEM',
+                                   dstSRS='EPSG:3857',
+                                   outputBounds=out_bounds,
+                                   width=(last_x - block_x + 1) * TILE_SIZE,
+                                   height=(last_y - block_y + 1) * TILE_SIZE,
+                                   resampleAlg='near', dstNodata=0)
+                data = warped.GetRasterBand(1).ReadAsArray()
+                warped = None
+
+                yield [('{}/{}/{}'.format(zoom, tile_x, tile_y),
+                        data[(tile_y - block_y) * TILE_SIZE:
+                             (tile_y - block_y + 1) * TILE_SIZE,
+                             (tile_x - block_x) * TILE_SIZE:
+                             (tile_x - block_x + 1) * TILE_SIZE])
+                       for tile_y in range(block_y, last_y + 1)
+                       for tile_x in range(block_x, last_x + 1)]
+
+    def _load_hashes(self):
+        if self.tile_format == 'xyz':
+            hashes_file = os.path.join(self.out_path, 'hashes.json')
+            if not os.path.exists(hashes_file):
+                return {}
+            with open(hashes_file) as f_p:
+                return json.load(f_p)
+
+        if not os.path.exists(self.out_path):
+            return {}
+        # MBTiles files not written by PyPros have no hashes
+        with sqlite3.connect(self.out_path) as conn:
+            conn.execute(_CREATE_HASHES)
+            return dict(conn.execute('SELECT key, hash FROM tile_hashes'))
+
+    def _write_xyz(self, images, old_hashes, hashes):
+        # The hashes are complete once the images are written
+        for key, image in images:
+            tile_file = os.path.join(self.out_path, key + '.png')
+            os.makedirs(os.path.dirname(tile_file), exist_ok=True)
+            with open(tile_file, 'wb') as f_p:
+                f_p.write(image)
+        removed = [key for key in old_hashes if key not in hashes]
+        for key in removed:
+            tile_file = os.path.join(self.out_path, key + '.png')
+            if os.path.exists(tile_file):
+                os.remove(tile_file)
+
+        os.makedirs(self.out_path, exist_ok=True)
+        with open(os.path.join(self.out_path, 'hashes.json'), 'w') as f_p:
+            json.dump(hashes, f_p)
+        return len(removed)
+
+    def _write_mbtiles(self, images, old_hashes, hashes, bounds):
+        conn = sqlite3.connect(self.out_path)
+        conn.execute('CREATE TABLE IF NOT EXISTS metadata ' +
+                     '(name TEXT PRIMARY KEY, value TEXT)')
+        conn.execute('CREATE TABLE IF NOT EXISTS tiles ' +
+                     '(zoom_level INTEGER, tile_column INTEGER, ' +
+                     'tile_row INTEGER, tile_data BLOB, ' +
+                     'PRIMARY KEY (zoom_level, tile_column, tile_row))')
+        conn.execute(_CREATE_HASHES)
+
+        def tms_key(key):
+            zoom, tile_x, tile_y = (int(value) for value in key.split('/'))
+            return zoom, tile_x, 2 ** zoom - 1 - tile_y
+
+        for key, image in images:
+            conn.execute('INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)',
+                         tms_key(key) + (sqlite3.Binary(image),))
+        removed = [key for key in old_hashes if key not in hashes]
+        for key in removed:
+            conn.execute('DELETE FROM tiles WHERE zoom_level = ? AND ' +
+                         'tile_column = ? AND tile_row = ?', tms_key(key))
+
+        conn.execute('DELETE FROM tile_hashes')
+        conn.executemany('INSERT INTO tile_hashes VALUES (?, ?)',
+                         hashes.items())
+
+        lon_min, lat_min = mercator_to_lonlat(bounds[0], bounds[1])
+        lon_max, lat_max = mercator_to_lonlat(bounds[2], bounds[3])
+        metadata = {'name': 'pypros', 'format': 'png', 'type': 'overlay',
+                    'minzoom': str(min(self.zooms)),
+                    'maxzoom': str(max(self.zooms)),
+                    'bounds': '{},{},{},{}'.format(lon_min, lat_min,
+                                                   lon_max, lat_max)}
+        conn.executemany('INSERT OR REPLACE INTO metadata VALUES (?, ?)',
+                         metadata.items())
+        conn.commit()
+        conn.close()
+        return len(removed)
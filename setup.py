@@ -18,7 +18,14 @@ setuptools.setup(
     url="https://github.com/pypa/sampleproject",
     packages=setuptools.find_packages(),
     install_requires=['numpy'],
-    scripts=['bin/pypros_run'],
+    extras_require={
+        'xarray': ['xarray', 'netCDF4', 'zarr'],
+        'dask': ['xarray', 'netCDF4', 'zarr', 'dask[array]']},
+    entry_points={
+        'console_scripts': ['pypros_run=pypros.cli:main',
+                            'pypros_jobs=pypros.cli:jobs_main',
+                            'pypros_batch=pypros.cli:batch_main',
+                            'pypros_server=pypros.cli:server_main']},
     classifiers=[
         'Development Status :: 2 - Pre-Alpha',
         'Intended Audience :: Science/Research',
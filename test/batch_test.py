@@ -0,0 +1,143 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy
+
+from osgeo import gdal, osr
+from pypros.batch import get_items, read_manifest, run_batch, format_report
+from pypros.cli import batch_main
+
+
+def _crash_run(tair, tdew, config_file, out_file, dem=None, refl=None):
+    # Kills the worker process, as a crashing driver would
+    if out_file.endswith('0010'):
+        os._exit(1)
+
+
+class TestBatch(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        for name in ('tair_0000', 'tair_0010', 'tair_0020', 'tdew', 'dem'):
+            cls.write_field(name)
+
+        cls.config_file = os.path.join(cls.tmp_dir, 'config.json')
+        with open(cls.config_file, 'w') as f_p:
+            json.dump({'method': 'single_tw', 'threshold': 1,
+                       'data_format': {
+                           'vars_files': ['tair', 'tdew', 'dem']},
+                       'refl_masked': 'False'}, f_p)
+
+    @classmethod
+    def write_field(cls, name):
+        driver = gdal.GetDriverByName('GTiff')
+        d_s = driver.Create(os.path.join(cls.tmp_dir, name + '.tif'), 3, 3,
+                            1, gdal.GDT_Float32)
+        d_s.GetRasterBand(1).WriteArray(numpy.full((3, 3), 2.0))
+        d_s.SetGeoTransform((0, 100, 0, 300, 0, -100))
+        proj = osr.SpatialReference()
+        proj.ImportFromEPSG(25831)
+        d_s.SetProjection(proj.ExportToWkt())
+        d_s = None
+
+    def get_config(self, name):
+        return {'config': self.config_file,
+                'manifest': os.path.join(self.tmp_dir, name,
+                                         'manifest.jsonl'),
+                'start': '2020-01-01T00:00', 'end': '2020-01-01T00:30',
+                'step': 10,
+                'tair': os.path.join(self.tmp_dir,
+                                     'tair_{time:%H%M}.tif'),
+                'tdew': os.path.join(self.tmp_dir, 'tdew.tif'),
+                'dem': os.path.join(self.tmp_dir, 'dem.tif'),
+                'out_file': os.path.join(self.tmp_dir, name, '{time:%H}',
+                                         'pros_{time:%H%M}')}
+
+    def test_get_items(self):
+        items = get_items(self.get_config('items'))
+        self.assertEqual([item['name'] for item in items],
+                         ['2020-01-01T00:00:00', '2020-01-01T00:10:00',
+                          '2020-01-01T00:20:00', '2020-01-01T00:30:00'])
+        self.assertEqual(items[1]['tair'],
+                         os.path.join(self.tmp_dir, 'tair_0010.tif'))
+        self.assertIsNone(items[1]['refl'])
+
+        items = get_items({'items': [{'tair': 'tair.tif',
+                                      'tdew': 'tdew.tif',
+                                      'out_file': 'out'}]})
+        self.assertEqual(items[0]['name'], 'out')
+
+        with self.assertRaises(ValueError) as cm:
+            get_items(dict(self.get_config('items'), step=0))
+        self.assertEqual('The batch step must be positive',
+                         str(cm.exception))
+        with self.assertRaises(ValueError) as cm:
+            get_items({'items': [{'tair': 'tair.tif'}]})
+        self.assertEqual('The item 0 has some missing key: tdew',
+                         str(cm.exception))
+
+    def test_run_batch(self):
+        config = self.get_config('run')
+        report = run_batch(config, workers=2)
+        self.assertEqual((report['processed'], report['failed'],
+                          report['skipped']), (4, 1, 0))
+        self.assertEqual(report['failures'][0]['name'],
+                         '2020-01-01T00:30:00')
+        self.assertTrue(report['failures'][0]['error'].startswith(
+            'FileNotFoundError'))
+        self.assertGreater(report['throughput'], 0)
+        self.assertTrue(os.path.exists(os.path.join(
+            self.tmp_dir, 'run', '00', 'pros_0020.tif')))
+        self.assertIn('Processed: 4 (1 failed), skipped: 0',
+                      format_report(report))
+
+        # A truncated record, as left by a crash, is ignored
+        with open(config['manifest'], 'a') as f_p:
+            f_p.write('{"name": "2020-01-01T00:3')
+        report = run_batch(config, workers=2)
+        self.assertEqual((report['processed'], report['skipped']), (0, 4))
+
+        self.write_field('tair_0030')
+        try:
+            report = run_batch(config, workers=2, retry_failed=True)
+        finally:
+            os.remove(os.path.join(self.tmp_dir, 'tair_0030.tif'))
+        self.assertEqual((report['processed'], report['failed'],
+                          report['skipped']), (1, 0, 3))
+        self.assertEqual(read_manifest(config['manifest'])[
+            '2020-01-01T00:30:00']['status'], 'ok')
+
+    def test_run_batch_crash(self):
+        config = self.get_config('crash')
+        with mock.patch('pypros.cli.pypros_run', _crash_run):
+            report = run_batch(config, workers=2)
+        self.assertEqual((report['processed'], report['failed']), (4, 1))
+        self.assertEqual(report['failures'][0],
+                         {'name': '2020-01-01T00:10:00',
+                          'out_file': os.path.join(self.tmp_dir, 'crash',
+                                                   '00', 'pros_0010'),
+                          'status': 'failed',
+                          'error': 'The worker process died',
+                          'seconds': report['failures'][0]['seconds']})
+
+    def test_batch_main(self):
+        batch_file = os.path.join(self.tmp_dir, 'batch.json')
+        with open(batch_file, 'w') as f_p:
+            json.dump(self.get_config('main'), f_p)
+
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            self.assertEqual(batch_main([batch_file, '--workers', '1']), 1)
+        self.assertIn('FileNotFoundError', stdout.getvalue())
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertEqual(batch_main(['/tmp/BadFile.json']), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+from pypros.benchmark import compare_wet_bulb, format_report, get_test_grid
+from pypros.benchmark import compare_io, format_io_report
+from pypros.psychrometrics import get_tw_sadeghi
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_get_test_grid(self):
+        tair, tdew, z = get_test_grid(10, z_range=(0, 1000))
+        self.assertEqual(tair.shape, (10, 10, 5))
+        self.assertEqual(tair.min(), -20)
+        self.assertEqual((tair - tdew).max(), 30)
+        self.assertEqual(z.max(), 1000)
+
+    def test_compare_wet_bulb(self):
+        results = compare_wet_bulb(size=12, repeats=1)
+
+        self.assertEqual(list(results),
+                         ['reference', 'ttd2tw', 'get_tw_sadeghi'])
+        self.assertEqual(results['reference']['max_error'], 0)
+        # Accuracy regression limits
+        self.assertLess(results['get_tw_sadeghi']['max_error'], 1.5)
+        self.assertLess(results['get_tw_sadeghi']['rms_error'], 0.5)
+        self.assertLess(results['ttd2tw']['max_error'], 5.0)
+        self.assertEqual(results['ttd2tw']['error'].shape, (12, 12, 6))
+        for result in results.values():
+            self.assertGreater(result['throughput'], 0)
+
+        self.assertEqual(len(format_report(results).split('\n')), 4)
+
+    def test_compare_io(self):
+        results = compare_io(size=32, repeats=1)
+
+        self.assertEqual(list(results),
+                         ['default', 'threads', 'threads_read_ahead'])
+        for result in results.values():
+            self.assertGreater(result['read'], 0)
+            self.assertGreater(result['pros'], 0)
+        self.assertEqual(len(format_io_report(results).split('\n')), 4)
+
+    def test_compare_custom(self):
+        results = compare_wet_bulb({'sadeghi_f32': lambda tair, tdew, z:
+                                    get_tw_sadeghi(tair.astype('float32'),
+                                                   tdew.astype('float32'),
+                                                   z)},
+                                   size=8, repeats=1, z_range=(0, 500))
+        self.assertEqual(list(results), ['reference', 'sadeghi_f32'])
+        self.assertLess(results['sadeghi_f32']['max_error'], 1.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import time
+import unittest
+
+from pypros.cache import ResultCache
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache = ResultCache(os.path.join(self.tmp_dir, 'cache'),
+                                 max_size=250)
+
+    def write_file(self, name, content):
+        file_name = os.path.join(self.tmp_dir, name)
+        with open(file_name, 'w') as f_p:
+            f_p.write(content)
+        return file_name
+
+    def test_key(self):
+        tair = self.write_file('tair.tif', 'tair')
+        key = self.cache.key([tair, None], {'method': 'ks'})
+        self.assertEqual(key, self.cache.key([tair], {'method': 'ks'}))
+        self.assertNotEqual(key, self.cache.key([tair],
+                                                {'method': 'single_tw'}))
+
+        time.sleep(0.01)
+        self.write_file('tair.tif', 'changed')
+        self.assertNotEqual(key, self.cache.key([tair], {'method': 'ks'}))
+
+        store = os.path.join(self.tmp_dir, 'store.zarr')
+        os.makedirs(os.path.join(store, 't2m'))
+        with open(os.path.join(store, 't2m', '0.0'), 'w') as f_p:
+            f_p.write('chunk')
+        self.assertEqual(len(self.cache.hash_file(store)), 64)
+
+        with self.assertRaises(FileNotFoundError):
+            self.cache.key(['/tmp/BadFile.tif'], {})
+
+    def test_get_put(self):
+        result = self.write_file('out.tif', 'result')
+        masked = self.write_file('out_masked.tif', 'masked')
+        self.assertIsNone(self.cache.outputs('key'))
+        self.assertFalse(self.cache.get('key', {'.tif': result}))
+
+        self.cache.put('key', {'.tif': result, '_masked.tif': masked})
+        self.assertEqual(self.cache.outputs('key'),
+                         ['.tif', '_masked.tif'])
+
+        for link in (False, True):
+            rerun = os.path.join(self.tmp_dir, 'rerun_{}'.format(link))
+            self.assertTrue(self.cache.get(
+                'key', {'.tif': rerun + '.tif',
+                        '_masked.tif': rerun + '_masked.tif'}, link))
+            with open(rerun + '_masked.tif') as f_p:
+                self.assertEqual(f_p.read(), 'masked')
+
+    def test_evict(self):
+        output = self.write_file('out.tif', 'x' * 100)
+        for key in ('first', 'second'):
+            self.cache.put(key, {'.tif': output})
+            time.sleep(0.01)
+        # Using an entry makes it the most recent one
+        self.cache.get('first', {'.tif': output})
+        self.cache.put('third', {'.tif': output})
+
+        self.assertEqual([key for key, _, _ in self.cache.entries()],
+                         ['first', 'third'])
+        self.assertEqual(self.cache.evict(), [])
+
+        with self.assertRaises(ValueError):
+            ResultCache(self.tmp_dir, max_size=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
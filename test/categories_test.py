@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+from pypros.categories import pack_classes
+from pypros.categories import unpack_classes
+from pypros.categories import save_archive
+from pypros.categories import load_archive
+from pypros.categories import CATEGORY_NAMES, CLASS_COLORS, NODATA_CLASS
+import numpy
+
+
+class TestCategories(unittest.TestCase):
+    def test_names_colors(self):
+        self.assertEqual(len(CATEGORY_NAMES), 16)
+        self.assertEqual(len(CLASS_COLORS), 16)
+
+    def test_pack_classes(self):
+        classes = numpy.arange(15, dtype=numpy.uint8).reshape((3, 5))
+
+        packed = pack_classes(classes)
+
+        self.assertEqual(packed.dtype, numpy.uint8)
+        self.assertEqual(packed.size, 8)
+        self.assertEqual(packed[0], 1)
+        self.assertTrue((unpack_classes(packed, (3, 5)) == classes).all())
+
+    def test_archive(self):
+        classes = numpy.random.randint(0, 16, (200, 300)).astype(numpy.uint8)
+        classes[0][0] = NODATA_CLASS
+        geotransform = (0.0, 100.0, 0.0, 200.0, 0.0, -100.0)
+        file_name = os.path.join(tempfile.mkdtemp(), 'pros.npz')
+
+        save_archive(file_name, classes, geotransform, 'WKT')
+        out_classes, out_geotransform, projection = load_archive(file_name)
+
+        self.assertTrue((out_classes == classes).all())
+        self.assertEqual(out_geotransform, geotransform)
+        self.assertEqual(projection, 'WKT')
+        self.assertTrue(os.path.getsize(file_name) < classes.nbytes)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,234 @@
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from multiprocessing import shared_memory
+
+import numpy
+
+from osgeo import gdal, osr
+from pypros.cli import check_config, main, Timer
+from pypros.profiling import Profiler, get_active
+
+
+class TestCli(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.files = {}
+        for name, value in (('tair', 2.0), ('tdew', 0.0), ('dem', 500.0)):
+            cls.files[name] = os.path.join(cls.tmp_dir, name + '.tif')
+            driver = gdal.GetDriverByName('GTiff')
+            d_s = driver.Create(cls.files[name], 3, 3, 1, gdal.GDT_Float32)
+            d_s.GetRasterBand(1).WriteArray(numpy.full((3, 3), value))
+            d_s.SetGeoTransform((0, 100, 0, 300, 0, -100))
+            proj = osr.SpatialReference()
+            proj.ImportFromEPSG(25831)
+            d_s.SetProjection(proj.ExportToWkt())
+            d_s = None
+
+        cls.config = {'method': 'single_tw', 'threshold': 1,
+                      'data_format': {'vars_files': ['tair', 'tdew', 'dem']},
+                      'refl_masked': 'False'}
+
+    def write_config(self, config):
+        config_file = os.path.join(self.tmp_dir, 'config.json')
+        with open(config_file, 'w') as f_p:
+            json.dump(config, f_p)
+        return config_file
+
+    def test_lazy_imports(self):
+        code = ('import sys, pypros.cli; print(sorted(module for module in ' +
+                '("numpy", "osgeo", "pypros.pros") if module in sys.modules))')
+        output = subprocess.check_output([sys.executable, '-c', code])
+        self.assertEqual(output.decode().strip(), '[]')
+
+    def test_check_config(self):
+        config = dict(self.config)
+        variables_file = check_config(config, self.files['tair'],
+                                      self.files['tdew'], self.files['dem'])
+        self.assertEqual(len(variables_file), 3)
+        self.assertEqual(config['threshold'], 1.0)
+
+        with self.assertRaises(ValueError) as cm:
+            check_config(dict(self.config, method='static_tw'),
+                         self.files['tair'], self.files['tdew'],
+                         self.files['dem'])
+        self.assertEqual('Non valid method. Valid values are ks, ' +
+                         'single_tw, single_ta, dual_tw, dual_ta, linear_tr',
+                         str(cm.exception))
+
+        with self.assertRaises(ValueError) as cm:
+            check_config(dict(self.config, method='single_ta',
+                              threshold='1'),
+                         self.files['tair'], self.files['tdew'],
+                         self.files['dem'])
+        self.assertEqual('The threshold for the method single_ta must be a ' +
+                         'float', str(cm.exception))
+
+        with self.assertRaises(ValueError) as cm:
+            check_config(dict(self.config, method='dual_ta'),
+                         self.files['tair'], self.files['tdew'],
+                         self.files['dem'])
+        self.assertEqual('The thresholds for the method dual_ta must be a ' +
+                         'list/tuple of length two', str(cm.exception))
+
+        with self.assertRaises(FileNotFoundError):
+            check_config(dict(self.config), '/tmp/BadFile.tif',
+                         self.files['tdew'], self.files['dem'])
+
+    def test_main(self):
+        config_file = self.write_config(self.config)
+        out_file = os.path.join(self.tmp_dir, 'out')
+
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            status = main([self.files['tair'], self.files['tdew'],
+                           '--dem', self.files['dem'], '--timings',
+                           config_file, out_file])
+        self.assertEqual(status, 0)
+        self.assertIsNotNone(gdal.Open(out_file + '.tif'))
+        self.assertIn('calculation', stderr.getvalue())
+
+    def test_main_preview(self):
+        config_file = self.write_config(dict(self.config, preview=2))
+        out_file = os.path.join(self.tmp_dir, 'out_preview')
+
+        status = main([self.files['tair'], self.files['tdew'],
+                       '--dem', self.files['dem'], config_file, out_file])
+        self.assertEqual(status, 0)
+        self.assertEqual(gdal.Open(out_file + '_preview.tif').RasterXSize, 2)
+        self.assertEqual(gdal.Open(out_file + '.tif').RasterXSize, 3)
+
+        with self.assertRaises(ValueError) as cm:
+            check_config(dict(self.config, preview=0), self.files['tair'],
+                         self.files['tdew'], self.files['dem'])
+        self.assertEqual('The preview resolution factor must be a ' +
+                         'positive integer', str(cm.exception))
+
+    def test_main_precip_only(self):
+        refl_file = os.path.join(self.tmp_dir, 'refl.tif')
+        driver = gdal.GetDriverByName('GTiff')
+        d_s = driver.Create(refl_file, 3, 3, 1, gdal.GDT_Float32)
+        d_s.GetRasterBand(1).WriteArray(numpy.array([[0.0, 12.0, 12.0]] * 3))
+        d_s.SetGeoTransform((0, 100, 0, 300, 0, -100))
+        d_s = None
+
+        # Both the JSON bool and the string are accepted
+        for precip_only in (True, 'True'):
+            config_file = self.write_config(dict(self.config,
+                                                 precip_only=precip_only))
+            out_file = os.path.join(self.tmp_dir, 'out_precip')
+            status = main([self.files['tair'], self.files['tdew'],
+                           '--dem', self.files['dem'], '--refl', refl_file,
+                           config_file, out_file])
+            self.assertEqual(status, 0)
+            band = gdal.Open(out_file + '.tif').GetRasterBand(1)
+            self.assertEqual(band.ReadAsArray()[0][0],
+                             band.GetNoDataValue())
+
+    def test_main_bbox(self):
+        config_file = self.write_config(self.config)
+        out_file = os.path.join(self.tmp_dir, 'out_bbox')
+
+        status = main([self.files['tair'], self.files['tdew'],
+                       '--dem', self.files['dem'],
+                       '--bbox', '0', '150', '200', '300',
+                       config_file, out_file])
+        self.assertEqual(status, 0)
+        d_s = gdal.Open(out_file + '.tif')
+        self.assertEqual((d_s.RasterXSize, d_s.RasterYSize), (2, 2))
+
+    def test_main_cache(self):
+        config_file = self.write_config(dict(self.config, cache={
+            'path': os.path.join(self.tmp_dir, 'cache')}))
+        for run in ('first', 'rerun'):
+            out_file = os.path.join(self.tmp_dir, 'out_' + run)
+            stderr = io.StringIO()
+            with contextlib.redirect_stderr(stderr):
+                status = main([self.files['tair'], self.files['tdew'],
+                               '--dem', self.files['dem'], '--timings',
+                               config_file, out_file])
+            self.assertEqual(status, 0)
+            self.assertTrue(os.path.exists(out_file + '.tif'))
+        # The rerun is served from the cache
+        self.assertNotIn('calculation', stderr.getvalue())
+        self.assertIn('cache', stderr.getvalue())
+
+    def test_main_profile(self):
+        config_file = self.write_config(self.config)
+        out_file = os.path.join(self.tmp_dir, 'out_profile')
+        profile = os.path.join(self.tmp_dir, 'profile.json')
+
+        status = main([self.files['tair'], self.files['tdew'],
+                       '--dem', self.files['dem'], '--profile', profile,
+                       config_file, out_file])
+        self.assertEqual(status, 0)
+        with open(profile) as f_p:
+            names = {event['name'] for event in json.load(f_p)['traceEvents']}
+        self.assertTrue({'read', 'PyPros.calculate', 'method.single_tw',
+                         'psychrometrics.ttdp2tw', 'write'} <= names)
+
+        # Along with a running profiler, as PYPROS_PROFILE starts
+        os.remove(profile)
+        with Profiler() as running:
+            status = main([self.files['tair'], self.files['tdew'],
+                           '--dem', self.files['dem'], '--profile', profile,
+                           config_file, out_file])
+            self.assertIs(get_active(), running)
+        self.assertEqual(status, 0)
+        self.assertTrue(os.path.exists(profile))
+        self.assertIn('PyPros.calculate', [event['name']
+                                           for event in running.events])
+
+    def test_main_publish(self):
+        from pypros.publish import ResultReader
+
+        name = 'pypros_cli_{}'.format(os.getpid())
+        config_file = self.write_config(dict(self.config,
+                                             publish={'name': name}))
+        out_file = os.path.join(self.tmp_dir, 'out_published')
+
+        status = main([self.files['tair'], self.files['tdew'],
+                       '--dem', self.files['dem'], config_file, out_file])
+        self.assertEqual(status, 0)
+        self.assertIsNotNone(gdal.Open(out_file + '.tif'))
+
+        reader = ResultReader(name + '_result')
+        try:
+            field, _, _, _, version = reader.read()
+            self.assertEqual(version, 1)
+            self.assertEqual(field.shape, (3, 3))
+        finally:
+            reader.close()
+            shared_memory.SharedMemory(name + '_result').unlink()
+
+    def test_main_wrong(self):
+        config = dict(self.config)
+        del config['refl_masked']
+        config_file = self.write_config(config)
+
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            status = main([self.files['tair'], self.files['tdew'],
+                           config_file, 'out'])
+        self.assertEqual(status, 1)
+        self.assertEqual(stderr.getvalue().strip(),
+                         "The configuration file has some missing key: " +
+                         "'refl_masked'")
+
+    def test_timer(self):
+        timer = Timer()
+        timer.step('validation')
+        timer.step('imports')
+        self.assertEqual([name for name, _ in timer.steps],
+                         ['validation', 'imports'])
+        self.assertEqual(len(timer.report().split('\n')), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import tempfile
+import unittest
+
+import numpy
+
+from osgeo import gdal, osr
+from pypros.ensemble import EnsemblePros, PHASE_NAMES
+from pypros.pros import PyPros
+
+
+class TestEnsemblePros(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.dem = cls.write_field('dem', numpy.array([[0, 500, 1000],
+                                                      [1500, 2000, 3000]]))
+        # Warm, near zero and cold members
+        cls.members = []
+        for member, tair in enumerate((10.0, 1.0, -5.0, -5.0)):
+            field = numpy.full((2, 3), tair)
+            if member == 3:
+                field[0][0] = numpy.nan
+            cls.members.append([
+                cls.write_field('tair_{}'.format(member), field),
+                cls.write_field('tdew_{}'.format(member), field - 1)])
+
+    @classmethod
+    def write_field(cls, name, field):
+        file_name = os.path.join(cls.tmp_dir, name + '.tif')
+        driver = gdal.GetDriverByName('GTiff')
+        d_s = driver.Create(file_name, field.shape[1], field.shape[0], 1,
+                            gdal.GDT_Float32)
+        d_s.GetRasterBand(1).WriteArray(field)
+        d_s.SetGeoTransform((0, 100, 0, 200, 0, -100))
+        proj = osr.SpatialReference()
+        proj.ImportFromEPSG(25831)
+        d_s.SetProjection(proj.ExportToWkt())
+        d_s = None
+        return file_name
+
+    def test_probabilities(self):
+        ens = EnsemblePros(self.members, 'single_tw', 1.5, dem=self.dem)
+        self.assertEqual(ens.members, 4)
+        self.assertEqual(ens.probabilities.shape, (3, 2, 3))
+        self.assertEqual(ens.probabilities.dtype, numpy.float32)
+
+        rain = ens.probabilities[PHASE_NAMES.index('rain')]
+        snow = ens.probabilities[PHASE_NAMES.index('snow')]
+        self.assertAlmostEqual(rain[1][1], 0.25)
+        self.assertAlmostEqual(snow[1][1], 0.75)
+        self.assertAlmostEqual(snow[0][0], 2 / 3)
+        self.assertEqual(ens.valid[0][0], 3)
+        self.assertTrue(numpy.allclose(ens.probabilities.sum(axis=0), 1))
+
+        ens.save_file(snow, os.path.join(self.tmp_dir, 'p_snow.tif'))
+
+    def test_dem_nodata(self):
+        # The sea pixels are not computed
+        dem = numpy.array([[-9999.0, 500, 1000], [1500, 2000, numpy.nan]])
+        dem_file = self.write_field('dem_nodata', dem)
+        d_s = gdal.Open(dem_file)
+        d_s.GetRasterBand(1).SetNoDataValue(-9999.0)
+        d_s = None
+
+        ens = EnsemblePros(self.members, 'single_tw', 1.5, dem=dem_file)
+        reference = EnsemblePros(self.members, 'single_tw', 1.5,
+                                 dem=self.dem)
+        self.assertEqual(ens.valid[0][0], 0)
+        self.assertEqual(ens.valid[1][2], 0)
+        self.assertTrue(numpy.isnan(ens.probabilities[:, 0, 0]).all())
+        self.assertTrue(numpy.allclose(ens.probabilities[:, 0, 1:],
+                                       reference.probabilities[:, 0, 1:]))
+
+        out_file = os.path.join(self.tmp_dir, 'valid.tif')
+        ens.save_file(ens.valid, out_file)
+        band = gdal.Open(out_file).GetRasterBand(1)
+        self.assertEqual(band.GetNoDataValue(), EnsemblePros.nodata)
+        self.assertEqual(band.ReadAsArray()[0][0], EnsemblePros.nodata)
+        self.assertEqual(band.ReadAsArray()[0][1], 4)
+
+    def test_deterministic(self):
+        for method, threshold in (('ks', None), ('dual_tw', [0.7, 1.0]),
+                                  ('linear_tr', [0, 3])):
+            ens = EnsemblePros(self.members[1:2], method, threshold,
+                               dem=self.dem)
+            inst = PyPros(self.members[1] + [self.dem], method, threshold)
+            phase = numpy.digitize(
+                inst.result, numpy.array(inst.ros_method.phase_bins)) - 1
+            for value in range(len(PHASE_NAMES)):
+                self.assertTrue((ens.counts[value] ==
+                                 (phase == value)).all())
+
+    def test_threshold_lookup(self):
+        regions = self.write_field('regions', numpy.array([[1.0, 1.0, 1.0],
+                                                           [2.0, 2.0, 3.0]]))
+        ens = EnsemblePros(self.members, 'single_ta',
+                           {'regions': regions,
+                            'values': {1: 0.0, 2: 20.0}}, batch_size=3)
+        snow = ens.probabilities[PHASE_NAMES.index('snow')]
+        self.assertAlmostEqual(snow[0][1], 0.5)
+        self.assertAlmostEqual(snow[1][1], 1)
+        self.assertEqual(ens.valid[1][2], 0)
+        self.assertTrue(numpy.isnan(snow[1][2]))
+
+    def test_batch_size(self):
+        ens = EnsemblePros(self.members, 'ks', dem=self.dem)
+        for batch_size in (1, 3, 10):
+            other = EnsemblePros(self.members, 'ks', dem=self.dem,
+                                 batch_size=batch_size)
+            self.assertTrue((other.counts == ens.counts).all())
+            self.assertTrue((other.valid == ens.valid).all())
+
+    def test_wrong(self):
+        with self.assertRaises(ValueError) as cm:
+            EnsemblePros([])
+        self.assertEqual('The ensemble has no members.', str(cm.exception))
+
+        with self.assertRaises(ValueError) as cm:
+            EnsemblePros(self.members, 'dual_ta', [3, 0])
+        self.assertEqual('Incorrect thresholds, th_s value must be ' +
+                         'smaller than th_r', str(cm.exception))
+
+        wrong = self.write_field('tair_wrong', numpy.zeros((2, 2)))
+        with self.assertRaises(IndexError):
+            EnsemblePros(self.members[:1] + [[wrong, wrong]])
+
+
+if __name__ == '__main__':
+    unittest.main()
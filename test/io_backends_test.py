@@ -0,0 +1,316 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+from osgeo import gdal, osr
+from pypros.io_backends import GDALBackend, XarrayBackend, get_backend
+from pypros.io_backends import get_window, read_ahead
+
+try:
+    import xarray
+except ImportError:
+    xarray = None
+
+
+class TestGDALBackend(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.file_name = '/tmp/io_backends_multi.tif'
+        cls.fields = numpy.arange(2 * 3 * 4, dtype='float32')\
+                          .reshape((2, 3, 4))
+
+        driver = gdal.GetDriverByName('GTiff')
+        d_s = driver.Create(cls.file_name, 4, 3, 2, gdal.GDT_Float32)
+        for i in range(2):
+            d_s.GetRasterBand(i + 1).WriteArray(cls.fields[i])
+        d_s.SetGeoTransform((0, 100, 0, 300, 0, -100))
+
+        proj = osr.SpatialReference()
+        proj.ImportFromEPSG(25831)
+        d_s.SetProjection(proj.ExportToWkt())
+        d_s = None
+
+    def test_read(self):
+        fields, info = GDALBackend().read(self.file_name)
+        self.assertEqual(fields.shape, (2, 3, 4))
+        self.assertEqual(info['size'], (3, 4))
+        self.assertEqual(info['geotransform'], (0, 100, 0, 300, 0, -100))
+        self.assertIsNone(info['mask'])
+
+        fields, info = GDALBackend().read(self.file_name, time=1)
+        self.assertEqual(fields.shape, (1, 3, 4))
+        self.assertTrue((fields[0] == self.fields[1]).all())
+
+    def test_read_time(self):
+        # Single band files, such as a DEM, are read whatever the time
+        dem_file = '/tmp/io_backends_dem.tif'
+        driver = gdal.GetDriverByName('GTiff')
+        d_s = driver.Create(dem_file, 4, 3, 1, gdal.GDT_Float32)
+        d_s.GetRasterBand(1).WriteArray(self.fields[0])
+        d_s.SetGeoTransform((0, 100, 0, 300, 0, -100))
+        d_s = None
+        fields, info = GDALBackend().read(dem_file, time=3)
+        self.assertEqual(fields.shape, (1, 3, 4))
+        self.assertTrue((fields[0] == self.fields[0]).all())
+
+        with self.assertRaises(ValueError) as cm:
+            GDALBackend().read(self.file_name, time=3)
+        self.assertEqual('The band 3 is out of range, the file ' +
+                         self.file_name + ' has 2 bands', str(cm.exception))
+
+    def test_read_factor(self):
+        fields, info = GDALBackend().read(self.file_name, factor=2)
+        self.assertEqual(fields.shape, (2, 2, 2))
+        self.assertEqual(info['size'], (2, 2))
+        self.assertEqual(info['geotransform'], (0, 200, 0, 300, 0, -150))
+        self.assertEqual(fields[0][0][0], self.fields[0][0][0])
+
+    def test_read_bbox(self):
+        fields, info = GDALBackend().read(self.file_name,
+                                          bbox=(150, 50, 300, 200))
+        self.assertEqual(fields.shape, (2, 2, 2))
+        self.assertEqual(info['size'], (2, 2))
+        self.assertEqual(info['geotransform'], (100, 100, 0, 200, 0, -100))
+        self.assertTrue((fields[1] == self.fields[1][1:, 1:3]).all())
+
+        with self.assertRaises(ValueError) as cm:
+            GDALBackend().read(self.file_name, bbox=(500, 0, 600, 100))
+        self.assertEqual("The bounding box doesn't overlap the raster",
+                         str(cm.exception))
+
+    def test_get_window(self):
+        window, geot = get_window((0, 100, 0, 300, 0, -100), (3, 4),
+                                  (-1000, 100, 200, 1000))
+        self.assertEqual(window, (0, 0, 2, 2))
+        self.assertEqual(geot, (0, 100, 0, 300, 0, -100))
+
+        with self.assertRaises(ValueError):
+            get_window((0, 100, 10, 300, 0, -100), (3, 4), (0, 0, 1, 1))
+
+    def test_io_options(self):
+        backend = GDALBackend(cache_max=64, num_threads=2)
+        self.assertEqual(gdal.GetCacheMax(), 64 * 1024 * 1024)
+        fields, info = backend.read(self.file_name)
+        self.assertTrue((fields == self.fields).all())
+        self.assertIsNone(gdal.GetThreadLocalConfigOption('GDAL_NUM_THREADS',
+                                                          None))
+        backend.write('/tmp/io_backends_threads.tif', fields[0], info)
+
+        backend = get_backend({'name': 'gdal', 'read_ahead': 0})
+        self.assertEqual(backend.read_ahead, 0)
+        self.assertIsNone(backend.num_threads)
+
+    def test_read_ahead(self):
+        for depth in (0, 1, 3):
+            self.assertEqual(list(read_ahead(lambda item: item * 2,
+                                             range(5), depth)),
+                             [0, 2, 4, 6, 8])
+
+        reads = read_ahead(GDALBackend().read,
+                           [self.file_name, '/tmp/BadFile.tif'])
+        self.assertEqual(next(reads)[0].shape, (2, 3, 4))
+        with self.assertRaises(FileNotFoundError):
+            next(reads)
+
+    def test_read_nodata(self):
+        nodata_file = '/tmp/io_backends_nodata.tif'
+        driver = gdal.GetDriverByName('GTiff')
+        d_s = driver.Create(nodata_file, 4, 3, 1, gdal.GDT_Float32)
+        d_s.GetRasterBand(1).SetNoDataValue(0)
+        d_s.GetRasterBand(1).WriteArray(self.fields[0])
+        d_s = None
+
+        _, info = GDALBackend().read(nodata_file)
+        self.assertFalse(info['mask'][0][0])
+        self.assertEqual(info['mask'].sum(), 11)
+
+    def test_read_wrong(self):
+        with self.assertRaises(FileNotFoundError):
+            GDALBackend().read('/tmp/BadFile.tif')
+
+    def test_write(self):
+        backend = GDALBackend()
+        fields, info = backend.read(self.file_name)
+        backend.write('/tmp/io_backends_out.tif', fields[0], info)
+
+        out_fields, out_info = backend.read('/tmp/io_backends_out.tif')
+        self.assertTrue((out_fields[0] == fields[0]).all())
+        self.assertEqual(out_info['geotransform'], info['geotransform'])
+
+    def test_get_backend(self):
+        self.assertIsInstance(get_backend('gdal'), GDALBackend)
+        backend = GDALBackend()
+        self.assertIs(get_backend(backend), backend)
+
+        with self.assertRaises(ValueError) as cm:
+            get_backend('grib')
+        self.assertEqual('Non valid backend. Valid values are gdal and ' +
+                         'xarray', str(cm.exception))
+
+
+@unittest.skipIf(xarray is None, 'xarray is not installed')
+class TestXarrayBackend(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        cls.file_name = os.path.join(cls.tmp_dir, 'nwp.nc')
+        cls.tair = numpy.arange(3 * 3 * 4, dtype='float32')\
+                        .reshape((3, 3, 4))
+        times = numpy.array(['2019-01-01T00', '2019-01-01T01',
+                             '2019-01-01T02'], dtype='datetime64[ns]')
+
+        d_s = xarray.Dataset(
+            {'t2m': (('time', 'y', 'x'), cls.tair),
+             'd2m': (('time', 'y', 'x'), cls.tair - 2),
+             'orog': (('y', 'x'), cls.tair[0] * 10)},
+            coords={'time': times,
+                    'x': numpy.arange(4) * 100.0 + 50,
+                    'y': 300 - numpy.arange(3) * 100.0 - 50})
+        d_s.to_netcdf(cls.file_name)
+
+    def test_read_time_slice(self):
+        backend = XarrayBackend(variables=['t2m', 'd2m', 'orog'])
+
+        fields, info = backend.read(self.file_name, time=1)
+        self.assertEqual(fields.shape, (3, 3, 4))
+        self.assertTrue((fields[0] == self.tair[1]).all())
+        self.assertTrue((fields[1] == self.tair[1] - 2).all())
+        self.assertTrue((fields[2] == self.tair[0] * 10).all())
+        self.assertEqual(info['geotransform'],
+                         (0.0, 100.0, 0.0, 300.0, 0.0, -100.0))
+
+        fields, info = backend.read(self.file_name,
+                                    time=numpy.datetime64('2019-01-01T02'))
+        self.assertTrue((fields[0] == self.tair[2]).all())
+
+    def test_read_separate_file(self):
+        # Files without the variables, such as a DEM, are read whole
+        dem_file = os.path.join(self.tmp_dir, 'dem.nc')
+        xarray.Dataset(
+            {'elevation': (('y', 'x'), self.tair[0] * 10)},
+            coords={'x': numpy.arange(4) * 100.0 + 50,
+                    'y': 300 - numpy.arange(3) * 100.0 - 50}).to_netcdf(
+                        dem_file)
+        backend = XarrayBackend(variables=['t2m', 'd2m'])
+        fields, info = backend.read(dem_file, time=1)
+        self.assertEqual(fields.shape, (1, 3, 4))
+        self.assertTrue((fields[0] == self.tair[0] * 10).all())
+
+        fields, info = backend.read(self.file_name, time=1)
+        self.assertEqual(fields.shape, (2, 3, 4))
+
+    def test_read_factor(self):
+        backend = XarrayBackend(variables=['t2m', 'orog'])
+        fields, info = backend.read(self.file_name, time=0, factor=2)
+        self.assertEqual(fields.shape, (2, 2, 2))
+        self.assertTrue((fields[0] == self.tair[0][::2, ::2]).all())
+        self.assertEqual(info['geotransform'],
+                         (-50.0, 200.0, 0.0, 350.0, 0.0, -200.0))
+
+    def test_read_bbox(self):
+        backend = XarrayBackend(variables=['t2m', 'orog'])
+        fields, info = backend.read(self.file_name, time=2,
+                                    bbox=(120, 0, 400, 180))
+        self.assertEqual(fields.shape, (2, 2, 3))
+        self.assertTrue((fields[0] == self.tair[2][1:, 1:]).all())
+        self.assertEqual(info['geotransform'],
+                         (100.0, 100.0, 0.0, 200.0, 0.0, -100.0))
+
+    def test_read_wrong(self):
+        backend = XarrayBackend(variables=['t2m'])
+        with self.assertRaises(ValueError) as cm:
+            backend.read(self.file_name)
+        self.assertEqual('The variable t2m has several time steps, but no ' +
+                         'time was selected', str(cm.exception))
+
+        with self.assertRaises(FileNotFoundError):
+            backend.read(os.path.join(self.tmp_dir, 'BadFile.nc'))
+
+        with self.assertRaises(ValueError) as cm:
+            XarrayBackend(out_format='grib')
+        self.assertEqual('Non valid output format. Valid values are ' +
+                         'netcdf and zarr', str(cm.exception))
+
+    def test_write(self):
+        info = {'projection': 'LOCAL_CS["test"]',
+                'geotransform': (0.0, 100.0, 0.0, 300.0, 0.0, -100.0),
+                'size': (3, 4)}
+
+        for out_format in ('netcdf', 'zarr'):
+            backend = XarrayBackend(out_format=out_format, chunks=(2, 2))
+            out_file = os.path.join(self.tmp_dir, 'out' + backend.extension)
+            backend.write(out_file, self.tair[0], info)
+
+            fields, out_info = backend.read(out_file)
+            self.assertTrue((fields[0] == self.tair[0]).all())
+            for key in info:
+                self.assertEqual(out_info[key], info[key])
+
+    def test_write_nodata(self):
+        info = {'projection': '',
+                'geotransform': (0.0, 100.0, 0.0, 300.0, 0.0, -100.0),
+                'size': (3, 4), 'nodata': -9999.0}
+        field = self.tair[0].copy()
+        field[0][0] = -9999.0
+
+        backend = XarrayBackend()
+        out_file = os.path.join(self.tmp_dir, 'out_nodata.nc')
+        backend.write(out_file, field, info)
+
+        fields, _ = backend.read(out_file)
+        self.assertTrue(numpy.isnan(fields[0][0][0]))
+        self.assertTrue((fields[0][1:] == field[1:]).all())
+
+    def test_write_append_time(self):
+        info = {'projection': '',
+                'geotransform': (0.0, 100.0, 0.0, 300.0, 0.0, -100.0),
+                'size': (3, 4)}
+        backend = XarrayBackend(out_format='zarr')
+        out_file = os.path.join(self.tmp_dir, 'series.zarr')
+        for i in range(3):
+            backend.write(out_file, self.tair[i], info,
+                          time=numpy.datetime64('2019-01-01T00:06') +
+                          numpy.timedelta64(6 * i, 'm'))
+
+        fields, _ = backend.read(out_file, time=2)
+        self.assertTrue((fields[0] == self.tair[2]).all())
+
+    def test_lazy(self):
+        backend = XarrayBackend(variables=['t2m', 'd2m'], lazy=True,
+                                out_format='zarr', chunks=(2, 2))
+        fields, info = backend.read(self.file_name, time=1)
+        self.assertTrue(hasattr(fields, 'dask'))
+        self.assertTrue((fields.compute()[1] == self.tair[1] - 2).all())
+
+        out_file = os.path.join(self.tmp_dir, 'lazy.zarr')
+        backend.write(out_file, fields[0] * 2, info)
+
+        fields, _ = XarrayBackend(lazy=True).read(out_file)
+        self.assertTrue((fields[0].compute() == self.tair[1] * 2).all())
+
+    def test_without_dask(self):
+        # Only the lazy reads need Dask
+        out_file = os.path.join(self.tmp_dir, 'no_dask.zarr')
+        code = '; '.join([
+            'import sys', 'sys.modules["dask"] = None',
+            'from pypros.io_backends import XarrayBackend',
+            'backend = XarrayBackend(out_format="zarr")',
+            'fields, info = backend.read({!r}, time=1)'.format(
+                self.file_name),
+            'backend.write({!r}, fields[0], info)'.format(out_file),
+            'print(backend.read({!r})[0].sum())'.format(out_file),
+            'XarrayBackend(lazy=True)'])
+        process = subprocess.run([sys.executable, '-c', code],
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+        self.assertEqual(float(process.stdout), self.tair[1].sum())
+        self.assertIn(b'ImportError: The lazy xarray backend requires the '
+                      b'dask package', process.stderr)
+
+
+if __name__ == '__main__':
+    unittest.main()
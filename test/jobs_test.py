@@ -0,0 +1,182 @@
+import json
+import os
+import tempfile
+import unittest
+
+import numpy
+
+from osgeo import gdal, osr
+from pypros.io_backends import GDALBackend
+from pypros.jobs import CachedBackend, Domain, run_jobs, format_report
+from pypros.pros import PyPros
+
+
+class TestJobs(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        size = (3, 3)
+        fields = {'tair': numpy.array([[20.0] * 3, [2.0] * 3, [-1.0] * 3]),
+                  'tdew': numpy.array([[20.0] * 3, [0.0] * 3, [-1.0] * 3]),
+                  'dem': numpy.array([[0.0] * 3, [1500.0] * 3,
+                                      [3000.0] * 3]),
+                  'refl': numpy.full(size, 12.0)}
+        cls.files = {}
+        for name, field in fields.items():
+            cls.files[name] = os.path.join(cls.tmp_dir, name + '.tif')
+            driver = gdal.GetDriverByName('GTiff')
+            d_s = driver.Create(cls.files[name], size[1], size[0], 1,
+                                gdal.GDT_Float32)
+            d_s.GetRasterBand(1).WriteArray(field)
+            d_s.SetGeoTransform((0, 100, 0, 300, 0, -100))
+            proj = osr.SpatialReference()
+            proj.ImportFromEPSG(25831)
+            d_s.SetProjection(proj.ExportToWkt())
+            d_s = None
+
+    def get_config(self):
+        return {'domains': {'catalonia': dict(self.files),
+                            'pyrenees': {'tair': self.files['tair'],
+                                         'tdew': self.files['tdew']}},
+                'jobs': [{'domain': 'catalonia', 'method': 'ks',
+                          'out_file': os.path.join(self.tmp_dir, 'cat_ks'),
+                          'products': ['result', 'masked', 'archive']},
+                         {'domain': 'catalonia', 'method': 'single_tw',
+                          'threshold': 1.5,
+                          'out_file': os.path.join(self.tmp_dir, 'cat_tw')},
+                         {'domain': 'catalonia', 'method': 'dual_tw',
+                          'threshold': [0.5, 1.0],
+                          'out_file': os.path.join(self.tmp_dir, 'cat_dtw')},
+                         {'domain': 'pyrenees', 'method': 'single_ta',
+                          'threshold': 0.5, 'name': 'pyr',
+                          'out_file': os.path.join(self.tmp_dir, 'pyr_ta')}]}
+
+    def test_cached_backend(self):
+        backend = CachedBackend('gdal')
+        fields, _ = backend.read(self.files['dem'])
+        fields_again, _ = backend.read(self.files['dem'])
+
+        self.assertIs(fields, fields_again)
+        self.assertEqual(backend.reads, 1)
+        self.assertFalse(fields.flags.writeable)
+        self.assertEqual(backend.extension, '.tif')
+        self.assertEqual(backend.read_ahead, 1)
+        self.assertEqual(CachedBackend({'name': 'gdal',
+                                        'read_ahead': 0}).read_ahead, 0)
+
+    def test_cached_threshold_file(self):
+        # Float64 rasters are cached read only, and must not be modified
+        th_file = os.path.join(self.tmp_dir, 'th.tif')
+        driver = gdal.GetDriverByName('GTiff')
+        d_s = driver.Create(th_file, 3, 3, 1, gdal.GDT_Float64)
+        d_s.GetRasterBand(1).WriteArray(numpy.array([[25.0] * 3, [0.0] * 3,
+                                                     [-9999.0] * 3]))
+        d_s.GetRasterBand(1).SetNoDataValue(-9999.0)
+        d_s.SetGeoTransform((0, 100, 0, 300, 0, -100))
+        d_s = None
+
+        backend = CachedBackend('gdal')
+        for _ in range(2):
+            inst = PyPros([self.files['tair'], self.files['tdew']],
+                          'single_ta', {'file': th_file},
+                          {'vars_files': ['tair', 'tdew']}, backend=backend)
+            self.assertEqual(inst.result[:, 0].tolist(),
+                             [1, 0, PyPros.nodata])
+        fields, _ = backend.read(th_file)
+        self.assertEqual(fields[0][2][0], -9999.0)
+        self.assertEqual(backend.reads, 3)
+
+    def test_domain(self):
+        domain = Domain('catalonia', self.files)
+        self.assertEqual(domain.data_format,
+                         {'vars_files': ['tair', 'tdew', 'dem']})
+        self.assertIs(domain.get_pressure(), domain.get_pressure())
+        self.assertAlmostEqual(domain.get_pressure()[0][0], 1013.25)
+
+        self.assertIsNone(Domain('pyrenees', {'tair': 'a.tif',
+                                              'rh': 'b.tif'}).get_pressure())
+        domain = Domain('pyrenees', {'tair': 'a.tif', 'rh': 'b.tif',
+                                     'backend': {'num_threads': 2}})
+        self.assertEqual(domain.backend.name, 'gdal')
+
+        with self.assertRaises(ValueError) as cm:
+            Domain('pyrenees', {'tair': 'a.tif'})
+        self.assertEqual('The domain pyrenees must define the tair and the ' +
+                         'tdew or rh files', str(cm.exception))
+
+    def test_run_jobs(self):
+        job_file = os.path.join(self.tmp_dir, 'jobs.json')
+        config = self.get_config()
+        config['jobs'][0]['precip_only'] = 'True'
+        config['jobs'][1]['precip_only'] = True
+        with open(job_file, 'w') as f_p:
+            json.dump(config, f_p)
+
+        reports = run_jobs(job_file, workers=3)
+
+        self.assertEqual([report['error'] for report in reports],
+                         [None] * 4)
+        self.assertEqual(reports[3]['name'], 'pyr')
+        self.assertEqual(len(reports[0]['outputs']), 3)
+        self.assertTrue(os.path.exists(reports[0]['outputs'][2]))
+        for report in reports:
+            for output in report['outputs']:
+                if output.endswith('.tif'):
+                    self.assertIsNotNone(gdal.Open(output))
+
+        reference = PyPros([self.files['tair'], self.files['tdew'],
+                            self.files['dem']], 'single_tw', 1.5)
+        fields, _ = GDALBackend().read(reports[1]['outputs'][0])
+        self.assertTrue((fields[0] == reference.result).all())
+
+        report = format_report(reports)
+        self.assertEqual(len(report.split('\n')), 6)
+
+    def test_run_jobs_error(self):
+        config = self.get_config()
+        config['domains']['pyrenees']['tair'] = '/tmp/BadFile.tif'
+        reports = run_jobs(config, workers=2)
+
+        self.assertIsNone(reports[0]['error'])
+        self.assertIsNotNone(reports[3]['error'])
+
+    def test_run_jobs_wrong(self):
+        config = self.get_config()
+        config['jobs'][0]['domain'] = 'ebro'
+        with self.assertRaises(ValueError) as cm:
+            run_jobs(config)
+        self.assertEqual('The job 0 domain ebro is not defined',
+                         str(cm.exception))
+
+        config = self.get_config()
+        config['jobs'][3]['products'] = ['masked']
+        with self.assertRaises(ValueError) as cm:
+            run_jobs(config)
+        self.assertEqual('The job 3 products need the domain reflectivity',
+                         str(cm.exception))
+
+        config = self.get_config()
+        config['jobs'][1]['threshold'] = 'wrong'
+        with self.assertRaises(ValueError) as cm:
+            run_jobs(config)
+        self.assertEqual('The threshold for the method single_tw must be a ' +
+                         'float', str(cm.exception))
+
+        config = self.get_config()
+        config['jobs'][0]['products'] = ['tiles']
+        config['jobs'][0]['tiles'] = {'path': '/tmp/tiles'}
+        with self.assertRaises(ValueError) as cm:
+            run_jobs(config)
+        self.assertEqual('The job 0 tiles product needs the tiles path and '
+                         'zooms', str(cm.exception))
+
+        config = self.get_config()
+        del config['jobs']
+        with self.assertRaises(ValueError) as cm:
+            run_jobs(config)
+        self.assertEqual("The job file has some missing key: 'jobs'",
+                         str(cm.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
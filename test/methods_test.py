@@ -0,0 +1,88 @@
+import unittest
+
+import numpy
+
+from pypros.methods import Method, get_method, register_method, METHODS
+
+
+class TestMethods(unittest.TestCase):
+    def test_get_method(self):
+        method = get_method('dual_tw')
+        self.assertEqual(method.inputs, ('twet',))
+        self.assertEqual(method.check_threshold(None), [0.7, 1.0])
+        self.assertEqual(method.check_threshold((0, 2)), (0, 2))
+
+        with self.assertRaises(ValueError) as cm:
+            get_method('static_ta')
+        self.assertTrue(str(cm.exception).startswith(
+            'Non valid method. Valid values are ks, single_tw'))
+
+    def test_check_threshold(self):
+        method = get_method('single_ta')
+        self.assertEqual(method.check_threshold(1), 1.0)
+        self.assertIsInstance(method.check_threshold(1), float)
+
+        for threshold in ('1', True, [1, 2]):
+            with self.assertRaises(ValueError) as cm:
+                method.check_threshold(threshold)
+            self.assertEqual('The threshold for the method single_ta ' +
+                             'must be a float', str(cm.exception))
+
+        self.assertIsNone(get_method('ks').check_threshold(3.0))
+
+    def test_check_threshold_fields(self):
+        method = get_method('dual_ta')
+        field = numpy.array([[0.0, numpy.nan], [1.0, 2.0]])
+        threshold = [field, field + 1]
+        self.assertIs(method.check_threshold(threshold), threshold)
+        self.assertIs(get_method('single_ta').check_threshold(field), field)
+        self.assertEqual(method.check_threshold({'file': '/tmp/th.tif'}),
+                         {'file': '/tmp/th.tif'})
+        with self.assertRaises(ValueError) as cm:
+            method.check_threshold([field, field - 1])
+        self.assertEqual('Incorrect thresholds, th_s value must be ' +
+                         'smaller than th_r', str(cm.exception))
+
+        self.assertEqual(method.check_threshold(
+            {'regions': '/tmp/regions.tif', 'values': {'1': [0, 2]}}),
+            {'regions': '/tmp/regions.tif', 'values': {1: [0, 2]}})
+        for values, message in (
+                ({}, "The threshold files for the method dual_ta must " +
+                 "be a 'file', or the 'regions' file and the 'values' by " +
+                 "region ID"),
+                ({'north': [0, 2]}, 'Non valid region ID north'),
+                ({'1': {'file': '/tmp/th.tif'}}, 'The threshold of the ' +
+                 'region 1 must be a value'),
+                ({'1': [2, 0]}, 'Incorrect thresholds, th_s value must ' +
+                 'be smaller than th_r')):
+            with self.assertRaises(ValueError) as cm:
+                method.check_threshold({'regions': '/tmp/regions.tif',
+                                        'values': values})
+            self.assertEqual(message, str(cm.exception))
+
+    def test_register_method(self):
+        def kernel(inputs, threshold):
+            return numpy.where(inputs['rh'] > threshold, 1.0, 0.0)
+
+        register_method(Method('rh_threshold', kernel, ('rh',), 'float',
+                               80.0))
+        try:
+            method = get_method('rh_threshold')
+            method.check_variables(['tair', 'rh'])
+            result = method.kernel({'rh': numpy.array([70.0, 90.0])},
+                                   method.check_threshold(None))
+            self.assertEqual(list(result), [0.0, 1.0])
+
+            with self.assertRaises(ValueError):
+                method.check_variables(['tair', 'dem'])
+        finally:
+            del METHODS['rh_threshold']
+
+        with self.assertRaises(ValueError) as cm:
+            Method('wrong', kernel, ('pressure',))
+        self.assertEqual('Non valid input pressure. Valid values are ' +
+                         'tair, tdew, rh, twet', str(cm.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+from pypros.profile_methods import calculate_bourgouin
+from pypros.profile_methods import get_layers_energy
+from pypros.profile_methods import get_profile_energies
+from pypros.profile_methods import RD
+import numpy
+
+
+class TestProfileMethods(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pres = numpy.array([1000, 925, 850, 700, 500.0])
+        # Columns: all cold, all warm, warm nose over a cold surface
+        tair = numpy.array([[-5, 10, -3],
+                            [-8, 8, -6],
+                            [-10, 6, 6],
+                            [-15, 0, 2],
+                            [-30, -15, -20]], dtype=float)
+        cls.tair = tair[:, numpy.newaxis, :]
+        cls.tdew = cls.tair - 1
+
+    def test_get_layers_energy(self):
+        positive, negative = get_layers_energy(2.0, 2.0, 1000.0, 900.0)
+        self.assertAlmostEqual(positive, 2 * RD * numpy.log(1000 / 900.0))
+        self.assertEqual(negative, 0)
+
+        # Half of the layer above 0, half below
+        positive, negative = get_layers_energy(2.0, -2.0, 1000.0, 900.0)
+        self.assertAlmostEqual(positive, 0.5 * RD * numpy.log(1000 / 900.0))
+        self.assertAlmostEqual(negative, positive)
+
+    def test_get_profile_energies(self):
+        twet = numpy.array([-2.0, 3.0, 3.0, -5.0])[:, numpy.newaxis]
+        pres = numpy.array([1000.0, 900.0, 800.0, 700.0])
+
+        melting, refreezing = get_profile_energies(twet, pres)
+        self.assertTrue(melting[0] > 0)
+        self.assertTrue(refreezing[0] > 0)
+
+        # The cold layer above the warm one doesn't refreeze
+        _, refreezing_top = get_profile_energies(twet[1:], pres[1:])
+        self.assertEqual(refreezing_top[0], 0)
+
+        # Levels under the ground are skipped
+        melting, refreezing = get_profile_energies(twet, pres,
+                                                   numpy.array([850.0]))
+        self.assertEqual(refreezing[0], 0)
+
+    def test_calculate_bourgouin(self):
+        ros, freezing = calculate_bourgouin(self.tair, self.tdew, self.pres)
+
+        self.assertEqual(ros.shape, (1, 3))
+        self.assertEqual(ros[0][0], 1)
+        self.assertEqual(ros[0][1], 0)
+        self.assertEqual(ros[0][2], 0)
+        self.assertFalse(freezing[0][1])
+        self.assertTrue(freezing[0][2])
+
+    def test_calculate_bourgouin_chunks(self):
+        tair = numpy.repeat(self.tair, 5, axis=1)
+        tdew = numpy.repeat(self.tdew, 5, axis=1)
+        dem = numpy.zeros((5, 3))
+
+        ros, _ = calculate_bourgouin(tair, tdew, self.pres, dem=dem,
+                                     chunk_rows=2)
+        reference, _ = calculate_bourgouin(self.tair, self.tdew, self.pres)
+        self.assertTrue((ros == reference).all())
+
+        # Levels ordered from the top
+        ros, _ = calculate_bourgouin(tair[::-1], tdew[::-1],
+                                     self.pres[::-1], dem=dem)
+        self.assertTrue((ros == reference).all())
+
+    def test_calculate_bourgouin_wrong(self):
+        with self.assertRaises(ValueError) as cm:
+            calculate_bourgouin(self.tair, self.tdew[1:], self.pres)
+        self.assertEqual('The temperature and dew point profiles must have ' +
+                         'the same (levels, y, x) shape.', str(cm.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
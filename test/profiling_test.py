@@ -0,0 +1,88 @@
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy
+
+from pypros.profiling import Profiler, profiled, span
+from pypros.psychrometrics import td2hr, get_tw_sadeghi
+
+
+class TestProfiling(unittest.TestCase):
+    def test_profiler(self):
+        tair = numpy.full((50, 50), 5.0)
+        with Profiler(memory=True) as profiler:
+            with span('outer', file='tair.tif'):
+                td2hr(tair, tair - 2)
+            get_tw_sadeghi(tair, tair - 2, 500.0)
+
+        td2hr(tair, tair - 2)
+        names = [event['name'] for event in profiler.events]
+        self.assertEqual(names.count('psychrometrics.td2hr'), 1)
+        self.assertIn('ttdp2tw.root', names)
+
+        outer = profiler.events[names.index('outer')]
+        self.assertEqual(outer['args']['file'], 'tair.tif')
+        self.assertGreater(outer['args']['peak'], tair.nbytes)
+        td2hr_event = profiler.events[names.index('psychrometrics.td2hr')]
+        self.assertEqual(td2hr_event['stack'],
+                         ('outer', 'psychrometrics.td2hr'))
+        self.assertLessEqual(outer['self'], outer['dur'] -
+                             td2hr_event['dur'])
+
+        trace = profiler.chrome_trace()
+        phases = {event['ph'] for event in trace['traceEvents']}
+        self.assertEqual(phases, {'X', 'C'})
+        json.dumps(trace)
+
+        folded = profiler.folded().split('\n')
+        self.assertIn('outer;psychrometrics.td2hr;td2hr.exp',
+                      [line.rsplit(' ', 1)[0] for line in folded])
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit()
+                            for line in folded))
+
+        summary = {row['name']: row for row in profiler.summary()}
+        self.assertEqual(summary['outer']['calls'], 1)
+        self.assertEqual(summary['td2hr.exp']['category'], 'expression')
+        self.assertIn('psychrometrics.ttdp2tw', profiler.format_report())
+
+    def test_profiled(self):
+        @profiled()
+        def kernel(value):
+            return value * 2
+
+        self.assertEqual(kernel(2), 4)
+        self.assertEqual(kernel.__name__, 'kernel')
+        with Profiler() as profiler:
+            self.assertEqual(kernel(3), 6)
+            with self.assertRaises(RuntimeError):
+                Profiler().start()
+        self.assertEqual(profiler.events[0]['cat'], 'kernel')
+        self.assertTrue(profiler.events[0]['name'].startswith(
+            'profiling_test.'))
+        self.assertNotIn('peak', profiler.events[0]['args'])
+
+    def test_environment(self):
+        tmp_dir = tempfile.mkdtemp()
+        code = ('import numpy; from pypros.psychrometrics import td2hr; ' +
+                'td2hr(numpy.ones(3), numpy.zeros(3))')
+        for file_name in ('trace_{pid}.json', 'trace.folded'):
+            env = dict(os.environ,
+                       PYPROS_PROFILE=os.path.join(tmp_dir, file_name))
+            subprocess.check_call([sys.executable, '-c', code], env=env)
+
+        trace_file, = glob.glob(os.path.join(tmp_dir, 'trace_*.json'))
+        with open(trace_file) as f_p:
+            self.assertIn('psychrometrics.td2hr',
+                          [event['name'] for event in
+                           json.load(f_p)['traceEvents']])
+        with open(os.path.join(tmp_dir, 'trace.folded')) as f_p:
+            self.assertTrue(f_p.read().startswith('psychrometrics.td2hr '))
+
+
+if __name__ == '__main__':
+    unittest.main()
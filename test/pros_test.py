@@ -4,6 +4,20 @@ import numpy
 
 from osgeo import gdal, osr
 from pypros.pros import PyPros
+from pypros.categories import NODATA_CLASS
+from pypros.io_backends import GDALBackend
+from pypros.psychrometrics import td2hr
+
+try:
+    import dask.array
+except ImportError:
+    dask = None
+
+
+class DaskBackend(GDALBackend):
+    def read(self, file_name, time=None):
+        fields, info = super().read(file_name, time)
+        return dask.array.from_array(fields, chunks=(1, 2, 2)), info
 
 
 class TestCalculateRos(unittest.TestCase):
@@ -58,6 +72,123 @@ class TestCalculateRos(unittest.TestCase):
 
         inst.save_file(inst.result, "/tmp/out.tiff")
 
+    def test_init_resolution(self):
+        full = PyPros(self.variables_file, self.method, self.threshold,
+                      self.data_format)
+        inst = PyPros(self.variables_file, self.method, self.threshold,
+                      self.data_format, resolution=2)
+        self.assertEqual(inst.result.shape, (2, 2))
+        self.assertEqual(inst.size, (2, 2))
+        self.assertEqual(inst.geotransform, (0, 150, 0, 200, 0, -150))
+        self.assertTrue((inst.result[0] == full.result[0][0]).all())
+
+        inst.save_file(inst.result, '/tmp/out_preview.tiff')
+        self.assertEqual(gdal.Open('/tmp/out_preview.tiff').RasterXSize, 2)
+
+        with self.assertRaises(ValueError) as cm:
+            PyPros(self.variables_file, self.method, self.threshold,
+                   self.data_format, resolution=0)
+        self.assertEqual('The resolution factor must be a positive integer',
+                         str(cm.exception))
+
+    def test_init_bbox(self):
+        full = PyPros(self.variables_file, self.method, self.threshold,
+                      self.data_format)
+        inst = PyPros(self.variables_file, self.method, self.threshold,
+                      self.data_format, bbox=[50, -100, 300, 50])
+        self.assertEqual(inst.size, (2, 3))
+        self.assertEqual(inst.geotransform, (0, 100, 0, 100, 0, -100))
+        self.assertTrue((inst.result == full.result[1:]).all())
+
+        with self.assertRaises(ValueError):
+            PyPros(self.variables_file, self.method, self.threshold,
+                   self.data_format, bbox=[500, 500, 600, 600])
+
+    def test_init_threshold_fields(self):
+        fields = {'/tmp/th.tif': [numpy.array([[25.0] * 3, [0.0] * 3,
+                                               [0.0] * 3])],
+                  '/tmp/th_pair.tif': [numpy.full((3, 3), 0.0),
+                                       numpy.full((3, 3), 3.0)],
+                  '/tmp/regions.tif': [numpy.array([[1.0] * 3, [2.0] * 3,
+                                                    [7.0] * 3])]}
+        for file_name, bands in fields.items():
+            driver = gdal.GetDriverByName('GTiff')
+            d_s = driver.Create(file_name, 3, 3, len(bands),
+                                gdal.GDT_Float32)
+            for band, field in enumerate(bands):
+                d_s.GetRasterBand(band + 1).WriteArray(field)
+            d_s.SetGeoTransform((0, 100, 0, 200, 0, -100))
+            d_s = None
+
+        inst = PyPros(self.variables_file, 'single_ta',
+                      {'file': '/tmp/th.tif'}, self.data_format)
+        self.assertEqual(inst.result[:, 0].tolist(), [1, 0, 1])
+        self.assertIsNone(inst.mask)
+
+        inst = PyPros(self.variables_file, 'dual_ta',
+                      {'file': '/tmp/th_pair.tif'}, self.data_format)
+        reference = PyPros(self.variables_file, 'dual_ta', [0, 3],
+                           self.data_format)
+        self.assertTrue((inst.result == reference.result).all())
+
+        lookup = {'regions': '/tmp/regions.tif',
+                  'values': {'1': 25.0, '2': 0.0}}
+        inst = PyPros(self.variables_file, 'single_ta', lookup,
+                      self.data_format)
+        self.assertEqual(inst.result[:, 0].tolist(), [1, 0, PyPros.nodata])
+        self.assertEqual(inst.mask[:, 0].tolist(), [True, True, False])
+
+        inst = PyPros(self.variables_file, 'single_ta', lookup,
+                      self.data_format, bbox=[50, -100, 300, 50])
+        self.assertEqual(inst.result[:, 0].tolist(), [0, PyPros.nodata])
+
+        with self.assertRaises(ValueError) as cm:
+            PyPros(self.variables_file, 'single_ta',
+                   {'file': '/tmp/th_pair.tif'}, self.data_format)
+        self.assertEqual('The threshold file of the method single_ta ' +
+                         'must have 1 band(s)', str(cm.exception))
+
+        with self.assertRaises(IndexError):
+            PyPros(self.variables_file, 'single_ta', numpy.zeros((2, 2)),
+                   self.data_format)
+
+    def test_init_nodata(self):
+        tair = gdal.Open('/tmp/tair.tif').ReadAsArray()
+        tair[0][0] = -999
+        tair[1][1] = numpy.nan
+
+        nodata_file = '/tmp/tair_nodata.tif'
+        driver = gdal.GetDriverByName('GTiff')
+        d_s = driver.Create(nodata_file, 3, 3, 1, gdal.GDT_Float32)
+        d_s.GetRasterBand(1).SetNoDataValue(-999)
+        d_s.GetRasterBand(1).WriteArray(tair)
+        d_s.SetGeoTransform((0, 100, 0, 200, 0, -100))
+        d_s = None
+
+        variables_file = [nodata_file, '/tmp/tdew.tif', '/tmp/dem.tif']
+        reference = PyPros(self.variables_file, 'single_tw', 1.5,
+                           self.data_format)
+        inst = PyPros(variables_file, 'single_tw', 1.5, self.data_format)
+
+        valid = numpy.ones((3, 3), dtype=bool)
+        valid[0][0] = False
+        valid[1][1] = False
+        self.assertTrue((inst.mask == valid).all())
+        self.assertEqual(inst.result[0][0], PyPros.nodata)
+        self.assertEqual(inst.result[1][1], PyPros.nodata)
+        self.assertTrue((inst.result[valid] ==
+                         reference.result[valid]).all())
+
+        pros_masked = inst.refl_mask(numpy.ones((3, 3)) * 20)
+        self.assertEqual(pros_masked[0][0], NODATA_CLASS)
+        self.assertTrue((pros_masked[valid] ==
+                         reference.refl_mask(numpy.ones((3, 3)) * 20)[valid])
+                        .all())
+
+        inst.save_file(inst.result, '/tmp/out_nodata.tif')
+        self.assertEqual(gdal.Open('/tmp/out_nodata.tif').GetRasterBand(1)
+                         .GetNoDataValue(), PyPros.nodata)
+
     def test_init_wrong_size(self):
         size = [1, 1]
         wrong = numpy.ones(size)
@@ -109,6 +240,77 @@ class TestCalculateRos(unittest.TestCase):
                       self.data_format)
         self.assertEqual(inst.result.shape, (3, 3))
 
+    def test_init_relative_humidity(self):
+        tair = gdal.Open('/tmp/tair.tif').ReadAsArray()
+        tdew = gdal.Open('/tmp/tdew.tif').ReadAsArray()
+
+        driver = gdal.GetDriverByName('GTiff')
+        d_s = driver.Create('/tmp/rh.tif', 3, 3, 1, gdal.GDT_Float32)
+        d_s.GetRasterBand(1).WriteArray(td2hr(tair, tdew))
+        d_s.SetGeoTransform((0, 100, 0, 200, 0, -100))
+        d_s = None
+
+        variables_file = ['/tmp/tair.tif', '/tmp/rh.tif', '/tmp/dem.tif']
+        data_format = {'vars_files': ['tair', 'rh', 'dem']}
+
+        for method, threshold in (('ks', None), ('single_tw', 1.5),
+                                  ('dual_tw', [0, 3])):
+            reference = PyPros(self.variables_file, method, threshold,
+                               self.data_format)
+            inst = PyPros(variables_file, method, threshold, data_format)
+            self.assertTrue(numpy.allclose(inst.result, reference.result,
+                                           atol=1e-3))
+
+    def test_interpolate_times(self):
+        driver = gdal.GetDriverByName('GTiff')
+        next_files = ['/tmp/tair_next.tif', '/tmp/tdew_next.tif',
+                      '/tmp/dem.tif']
+        half_files = ['/tmp/tair_half.tif', '/tmp/tdew_half.tif',
+                      '/tmp/dem.tif']
+        for i in range(2):
+            field = gdal.Open(self.variables_file[i]).ReadAsArray()
+            for file_name, offset in ((next_files[i], -4),
+                                      (half_files[i], -2)):
+                d_s = driver.Create(file_name, 3, 3, 1, gdal.GDT_Float32)
+                d_s.GetRasterBand(1).WriteArray(field + offset)
+                d_s.SetGeoTransform((0, 100, 0, 200, 0, -100))
+                d_s = None
+
+        for method, threshold in (('ks', None), ('single_tw', 1.5)):
+            inst = PyPros(self.variables_file, method, threshold,
+                          self.data_format)
+            results = [result.copy() for _, result in
+                       inst.interpolate_times(next_files, (0, 60),
+                                              [0, 30, 60])]
+
+            expected = [PyPros(files, method, threshold,
+                               self.data_format).result
+                        for files in (self.variables_file, half_files,
+                                      next_files)]
+            for result, reference in zip(results, expected):
+                self.assertTrue(numpy.allclose(result, reference))
+
+        inst = PyPros(self.variables_file, 'ks', None, self.data_format)
+        with self.assertRaises(ValueError) as cm:
+            list(inst.interpolate_times(next_files, (0, 60), [90]))
+        self.assertEqual('The time 90 is not between the NWP times',
+                         str(cm.exception))
+
+        # The reflectivity given to PyPros is not reused at other times
+        refls = [numpy.full((3, 3), 12.0), numpy.zeros((3, 3))]
+        inst = PyPros(self.variables_file, 'ks', None, self.data_format,
+                      refl=refls[0])
+        with self.assertRaises(ValueError) as cm:
+            list(inst.interpolate_times(next_files, (0, 60), [30]))
+        self.assertEqual('The reflectivity at each time must be supplied, '
+                         'as PyPros was given one.', str(cm.exception))
+        results = [result.copy() for _, result in
+                   inst.interpolate_times(next_files, (0, 60), [0, 60],
+                                          refls=refls)]
+        self.assertTrue(numpy.allclose(results[0], PyPros(
+            self.variables_file, 'ks', None, self.data_format).result))
+        self.assertTrue((results[1] == PyPros.nodata).all())
+
     def test_init_twet_without_dem(self):
         variables_file = ['/tmp/tair.tif', '/tmp/tdew.tif']
         data_format = {'vars_files': ['tair', 'tdew']}
@@ -127,37 +329,66 @@ class TestCalculateRos(unittest.TestCase):
             PyPros(self.variables_file, 'single_tw', '1',
                    self.data_format)
         self.assertEqual(
-            'The threshold for the method {} must be a float',
+            'The threshold for the method single_tw must be a float',
             str(cm.exception))
 
         with self.assertRaises(ValueError) as cm:
             PyPros(self.variables_file, 'single_ta', '1.5',
                    self.data_format)
         self.assertEqual(
-            'The threshold for the method {} must be a float',
+            'The threshold for the method single_ta must be a float',
             str(cm.exception))
 
         with self.assertRaises(ValueError) as cm:
             PyPros(self.variables_file, 'linear_tr', [3],
                    self.data_format)
         self.assertEqual(
-            'The thresholds for the method {} must be a list/tuple' +
+            'The thresholds for the method linear_tr must be a list/tuple' +
             ' of length two', str(cm.exception))
 
         with self.assertRaises(ValueError) as cm:
             PyPros(self.variables_file, 'dual_tw', [3],
                    self.data_format)
         self.assertEqual(
-            'The thresholds for the method {} must be a list/tuple' +
+            'The thresholds for the method dual_tw must be a list/tuple' +
             ' of length two', str(cm.exception))
 
         with self.assertRaises(ValueError) as cm:
             PyPros(self.variables_file, 'dual_ta', [3],
                    self.data_format)
         self.assertEqual(
-            'The thresholds for the method {} must be a list/tuple' +
+            'The thresholds for the method dual_ta must be a list/tuple' +
             ' of length two', str(cm.exception))
 
+    def test_init_wrong_before_reading(self):
+        # The files don't exist, so the errors come before reading them
+        variables_file = ['/tmp/BadFile.tif', '/tmp/BadFile.tif']
+
+        with self.assertRaises(ValueError) as cm:
+            PyPros(variables_file, 'static_tw', None, self.data_format)
+        self.assertEqual('Non valid method. Valid values are ks, ' +
+                         'single_tw, single_ta, dual_tw, dual_ta, ' +
+                         'linear_tr', str(cm.exception))
+
+        with self.assertRaises(ValueError) as cm:
+            PyPros(variables_file, 'dual_ta', [3, 0], self.data_format)
+        self.assertEqual('Incorrect thresholds, th_s value must be ' +
+                         'smaller than th_r', str(cm.exception))
+
+        with self.assertRaises(ValueError) as cm:
+            PyPros(variables_file, 'ks', None,
+                   {'vars_files': ['tair', 'dem']})
+        self.assertEqual('The method ks needs the tdew or rh variables ' +
+                         'files', str(cm.exception))
+
+    def test_init_default_thresholds(self):
+        for method, threshold in (('single_tw', 1.5), ('single_ta', 0.0),
+                                  ('dual_tw', [0.7, 1.0]),
+                                  ('linear_tr', [0, 3])):
+            inst = PyPros(self.variables_file, method, None,
+                          self.data_format)
+            self.assertEqual(inst.threshold, threshold)
+
     def test_refl_mask(self):
 
         inst = PyPros(self.variables_file, 'ks', self.threshold,
@@ -172,6 +403,7 @@ class TestCalculateRos(unittest.TestCase):
             refl[2][i] = refl_values[i]
 
         pros_masked = inst.refl_mask(refl)
+        self.assertEqual(pros_masked.dtype, numpy.uint8)
 
         # rain
         for i in range(1, 3):
@@ -183,6 +415,12 @@ class TestCalculateRos(unittest.TestCase):
         for i in range(1, 3):
             self.assertEqual(pros_masked[2][i], 10 + i)
 
+        inst.save_file(pros_masked, '/tmp/out_masked.tif')
+        band = gdal.Open('/tmp/out_masked.tif').GetRasterBand(1)
+        self.assertEqual(band.DataType, gdal.GDT_Byte)
+        self.assertEqual(band.GetCategoryNames()[11], 'snow 1 dBZ')
+        self.assertEqual(band.GetNoDataValue(), NODATA_CLASS)
+
         inst = PyPros(self.variables_file, 'single_tw', 1.5,
                       self.data_format)
         pros_masked = inst.refl_mask(refl)
@@ -247,6 +485,79 @@ class TestCalculateRos(unittest.TestCase):
         for i in range(1, 3):
             self.assertEqual(pros_masked[2][i], 10 + i)
 
+    def test_refl_mask_precipitation_only(self):
+        refl = numpy.zeros((3, 3))
+        refl[:, 1] = 12
+        refl[2][2] = 30
+
+        for method, threshold in (('ks', None), ('single_tw', 1.5),
+                                  ('dual_ta', [0, 3])):
+            reference = PyPros(self.variables_file, method, threshold,
+                               self.data_format)
+            inst = PyPros(self.variables_file, method, threshold,
+                          self.data_format, refl=refl)
+
+            wet = refl >= 1
+            self.assertTrue((inst.computed == wet).all())
+            self.assertTrue((inst.result[~wet] == PyPros.nodata).all())
+            self.assertTrue((inst.result[wet] == reference.result[wet]).all())
+            self.assertTrue((inst.refl_mask() ==
+                             reference.refl_mask(refl)).all())
+            # The pressure is only computed on the precipitating pixels
+            self.assertIsNone(inst.pressure)
+
+        # The dry pixels are declared NoData, even with clean inputs
+        self.assertIsNone(inst.mask)
+        inst.save_file(inst.result, '/tmp/out_precip_only.tif')
+        self.assertEqual(gdal.Open('/tmp/out_precip_only.tif')
+                         .GetRasterBand(1).GetNoDataValue(), PyPros.nodata)
+
+    def test_refl_mask_nodata(self):
+        # Outside the radar range is not dry
+        refl = numpy.full((3, 3), 12.0)
+        refl[0][0] = numpy.nan
+        refl[1][0] = -9999.0
+        driver = gdal.GetDriverByName('GTiff')
+        d_s = driver.Create('/tmp/refl_nodata.tif', 3, 3, 1,
+                            gdal.GDT_Float32)
+        d_s.GetRasterBand(1).WriteArray(refl)
+        d_s.GetRasterBand(1).SetNoDataValue(-9999.0)
+        d_s.SetGeoTransform((0, 100, 0, 200, 0, -100))
+        d_s = None
+
+        inst = PyPros(self.variables_file, 'ks', None, self.data_format)
+        for pros_masked in (inst.refl_mask(refl),
+                            inst.refl_mask('/tmp/refl_nodata.tif')):
+            self.assertEqual(pros_masked[0][0], NODATA_CLASS)
+            self.assertEqual(pros_masked[1][1], 8)
+        self.assertEqual(pros_masked[1][0], NODATA_CLASS)
+
+        inst = PyPros(self.variables_file, 'ks', None, self.data_format,
+                      refl='/tmp/refl_nodata.tif')
+        self.assertEqual(inst.result[1][0], PyPros.nodata)
+        self.assertEqual(inst.refl_mask()[:, 0].tolist(),
+                         [NODATA_CLASS, NODATA_CLASS, 13])
+
+    def test_refl_mask_dry(self):
+        refl = numpy.zeros((3, 3))
+        inst = PyPros(self.variables_file, 'ks', None, self.data_format,
+                      refl=refl)
+
+        self.assertTrue((inst.result == PyPros.nodata).all())
+        self.assertTrue((inst.refl_mask() == 0).all())
+
+        # Nothing is computed, not even the pressure
+        inst = PyPros(self.variables_file, 'single_tw', 1.5,
+                      self.data_format, refl=refl)
+        self.assertTrue((inst.result == PyPros.nodata).all())
+        self.assertIsNone(inst.pressure)
+
+        inst = PyPros(self.variables_file, 'ks', None, self.data_format)
+        with self.assertRaises(ValueError) as cm:
+            inst.refl_mask()
+        self.assertEqual('No reflectivity field supplied.',
+                         str(cm.exception))
+
     def test_refl_mask_wrong(self):
         variables_file = ['/tmp/tair.tif', '/tmp/tdew.tif']
         data_format = {'vars_files': ['tair', 'tdew']}
@@ -260,6 +571,32 @@ class TestCalculateRos(unittest.TestCase):
         self.assertEqual('Variables fields must have the same shape.',
                          str(cm.exception))
 
+    @unittest.skipIf(dask is None, 'dask is not installed')
+    def test_init_dask(self):
+        refl = numpy.zeros((3, 3))
+        refl[:, 1] = 12
+        refl[2][2] = 30
+        refl[0][1] = numpy.nan
+
+        for method, threshold in (('ks', None), ('single_tw', 1.5),
+                                  ('dual_ta', [0, 3]),
+                                  ('linear_tr', [0, 3])):
+            reference = PyPros(self.variables_file, method, threshold,
+                               self.data_format, refl=refl)
+            inst = PyPros(self.variables_file, method, threshold,
+                          self.data_format, backend=DaskBackend(),
+                          refl=dask.array.from_array(refl, chunks=2))
+
+            self.assertIsInstance(inst.result, dask.array.Array)
+            numpy.testing.assert_allclose(inst.result.compute(),
+                                          reference.result)
+
+            pros_masked = inst.refl_mask()
+            self.assertIsInstance(pros_masked, dask.array.Array)
+            self.assertEqual(pros_masked.dtype, numpy.uint8)
+            self.assertTrue((pros_masked.compute() ==
+                             reference.refl_mask()).all())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -5,8 +5,14 @@ from pypros.psychrometrics import ttd2tw
 from pypros.psychrometrics import trhp2tw
 from pypros.psychrometrics import _get_p_from_z
 from pypros.psychrometrics import get_tw_sadeghi
+from pypros.psychrometrics import ttdp2tw
 import numpy
 
+try:
+    import dask.array
+except ImportError:
+    dask = None
+
 
 class TestDewpoint(unittest.TestCase):
     def test_td2hr(self):
@@ -32,6 +38,16 @@ class TestDewpoint(unittest.TestCase):
         self.assertEqual(round(result[1][0], 2), 52.57)
         self.assertEqual(round(result[2][0], 2), 12.26)
 
+    def test_td2hr_float32(self):
+        temp = numpy.array([20, 20, 20], dtype='float32')
+        tempd = numpy.array([20, 10, -10], dtype='float32')
+
+        result = td2hr(temp, tempd)
+
+        self.assertEqual(result.dtype, numpy.float32)
+        self.assertAlmostEqual(result[1], 52.57, 2)
+        self.assertAlmostEqual(td2hr(20.0, 10.0), 52.567, 3)
+
     def test_hr2td(self):
         '''
         http://www.wpc.ncep.noaa.gov/html/dewrh.shtml to calculate the values
@@ -59,6 +75,10 @@ class TestDewpoint(unittest.TestCase):
         self.assertTrue(abs(result[2][0] - 18) < 0.1)
         self.assertTrue(abs(result[3][0] - 0) < 0.1)
 
+        result = hr2td(temp.astype('float32'), r_h.astype('float32'))
+        self.assertEqual(result.dtype, numpy.float32)
+        self.assertTrue(abs(result[1][0] - 10) < 0.1)
+
     def test_ttd2tw(self):
         '''
         Values checked at https://www.kwangu.com/work/psychrometric.htm
@@ -167,6 +187,34 @@ class TestDewpoint(unittest.TestCase):
         self.assertAlmostEqual(result[2][0], 2.0, delta=0.1)
         self.assertAlmostEqual(result[3][0], 10.0, delta=0.2)
 
+    def test_ttdp2tw(self):
+        temp = numpy.array([20.0, 3.0])
+        tdew = numpy.array([10.0, 1.0])
+        z = numpy.array([630.0, 1500.0])
+
+        result = ttdp2tw(temp, tdew, _get_p_from_z(z))
+
+        self.assertTrue((result == get_tw_sadeghi(temp, tdew, z)).all())
+
+    @unittest.skipIf(dask is None, 'dask is not installed')
+    def test_dask(self):
+        temp = numpy.array([[20.0, 20.0], [3.0, -5.0]])
+        tdew = numpy.array([[10.0, 20.0], [1.0, -8.0]])
+        z = numpy.array([[630.0, 0.0], [1500.0, 3000.0]])
+        r_h = td2hr(temp, tdew)
+        lazy = [dask.array.from_array(field, chunks=1)
+                for field in (temp, tdew, z, r_h)]
+
+        for function, args, lazy_args in (
+                (td2hr, (temp, tdew), lazy[:2]),
+                (hr2td, (temp, r_h), (lazy[0], lazy[3])),
+                (ttd2tw, (temp, tdew), lazy[:2]),
+                (get_tw_sadeghi, (temp, tdew, z), lazy[:3]),
+                (trhp2tw, (temp, r_h, z), (lazy[0], lazy[3], lazy[2]))):
+            result = function(*lazy_args)
+            self.assertIsInstance(result, dask.array.Array)
+            numpy.testing.assert_allclose(result.compute(), function(*args))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,135 @@
+import multiprocessing
+import subprocess
+import sys
+import unittest
+import uuid
+
+import numpy
+
+from pypros.publish import ResultPublisher, ResultReader
+from pypros.pros import PyPros
+from pypros.categories import NODATA_CLASS
+from osgeo import gdal
+
+
+def _read_in_process(name, queue):
+    reader = ResultReader(name)
+    field, geotransform, _, _, version = reader.read()
+    queue.put((field.sum(), geotransform, version))
+    reader.close()
+
+
+class TestPublish(unittest.TestCase):
+    def setUp(self):
+        self.name = 'pypros_test_' + uuid.uuid4().hex[:8]
+        self.geotransform = (0.0, 100.0, 0.0, 300.0, 0.0, -100.0)
+
+    def test_publish_read(self):
+        publisher = ResultPublisher(self.name, (3, 4))
+        try:
+            self.assertEqual(publisher.version, 0)
+            field = numpy.arange(12, dtype=float).reshape((3, 4))
+            self.assertEqual(publisher.publish(field, self.geotransform,
+                                               'LOCAL_CS["test"]'), 1)
+
+            reader = ResultReader(self.name)
+            result, geotransform, projection, published, version = \
+                reader.read()
+            self.assertTrue((result == field).all())
+            self.assertEqual(geotransform, self.geotransform)
+            self.assertEqual(projection, 'LOCAL_CS["test"]')
+            self.assertGreater(published, 0)
+            self.assertEqual(version, 1)
+
+            view = reader.read(copy=False)[0]
+            self.assertFalse(view.flags.writeable)
+            self.assertFalse(reader.wait(1, timeout=0.01))
+
+            publisher.publish(field * 2, self.geotransform)
+            self.assertTrue(reader.wait(1, timeout=0.01))
+            self.assertEqual(view[2][3], 22)
+            del view
+            reader.close()
+        finally:
+            publisher.unlink()
+
+    def test_other_process(self):
+        publisher = ResultPublisher(self.name, (2, 2), numpy.uint8)
+        try:
+            publisher.publish(numpy.full((2, 2), 3, dtype=numpy.uint8),
+                              self.geotransform)
+            queue = multiprocessing.Queue()
+            process = multiprocessing.Process(target=_read_in_process,
+                                              args=(self.name, queue))
+            process.start()
+            total, geotransform, version = queue.get(timeout=10)
+            process.join()
+
+            self.assertEqual(total, 12)
+            self.assertEqual(geotransform, self.geotransform)
+            self.assertEqual(version, 1)
+        finally:
+            publisher.unlink()
+
+    def test_reopen(self):
+        publisher = ResultPublisher(self.name, (2, 2))
+        try:
+            publisher.publish(numpy.ones((2, 2)), self.geotransform)
+            publisher.close()
+
+            publisher = ResultPublisher(self.name, (2, 2))
+            self.assertEqual(publisher.publish(numpy.ones((2, 2)),
+                                               self.geotransform), 2)
+
+            with self.assertRaises(ValueError):
+                ResultPublisher(self.name, (3, 3))
+            with self.assertRaises(IndexError):
+                publisher.publish(numpy.ones((3, 3)), self.geotransform)
+        finally:
+            publisher.unlink()
+
+        with self.assertRaises(FileNotFoundError):
+            ResultReader(self.name)
+
+    def test_unlink_quiet(self):
+        # The resource tracker doesn't complain about the unlinked segment
+        code = ('import numpy; from pypros.publish import ResultPublisher; ' +
+                'publisher = ResultPublisher({!r}, (2, 2)); '.format(
+                    self.name) +
+                'publisher.publish(numpy.ones((2, 2)), (0, 1, 0, 0, 0, 1)); ' +
+                'publisher.unlink()')
+        process = subprocess.run([sys.executable, '-c', code],
+                                 stderr=subprocess.PIPE, check=True)
+        self.assertEqual(process.stderr, b'')
+        with self.assertRaises(FileNotFoundError):
+            ResultReader(self.name)
+
+    def test_pros_publish(self):
+        variables_file = ['/tmp/publish_tair.tif', '/tmp/publish_tdew.tif']
+        for name, value in (('tair', 2.0), ('tdew', 0.0)):
+            driver = gdal.GetDriverByName('GTiff')
+            d_s = driver.Create('/tmp/publish_' + name + '.tif', 3, 3, 1,
+                                gdal.GDT_Float32)
+            d_s.GetRasterBand(1).WriteArray(numpy.full((3, 3), value))
+            d_s.SetGeoTransform(self.geotransform)
+            d_s = None
+        inst = PyPros(variables_file, 'ks', None,
+                      {'vars_files': ['tair', 'tdew']})
+
+        publisher = ResultPublisher(self.name, (3, 3), numpy.uint8)
+        try:
+            classes = inst.refl_mask(numpy.full((3, 3), 12.0))
+            classes[0][0] = NODATA_CLASS
+            inst.publish(publisher, classes, '/tmp/publish_masked.tif')
+            publisher.flush()
+
+            reader = ResultReader(self.name)
+            self.assertTrue((reader.read()[0] == classes).all())
+            reader.close()
+            self.assertIsNotNone(gdal.Open('/tmp/publish_masked.tif'))
+        finally:
+            publisher.unlink()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,18 @@ from pypros.ros_methods import calculate_koistinen_saltikoff
 from pypros.ros_methods import calculate_single_threshold
 from pypros.ros_methods import calculate_dual_threshold
 from pypros.ros_methods import calculate_linear_transition
+from pypros.ros_methods import expit
+from pypros.psychrometrics import td2hr
 from numpy import ones
+from numpy import array
+from numpy import nan
+from numpy import isnan
+import warnings
+
+try:
+    import dask.array
+except ImportError:
+    dask = None
 
 
 class TestCalculateRosMethods(unittest.TestCase):
@@ -23,7 +34,32 @@ class TestCalculateRosMethods(unittest.TestCase):
         result = calculate_koistinen_saltikoff(temp, tempd)
 
         for i in range(temp.shape[0]):
-            self.assertEqual(result[i][0], ks_rh(temp[i][0], tempd[i][0]))
+            self.assertAlmostEqual(result[i][0],
+                                   ks_rh(temp[i][0], tempd[i][0]))
+
+        result_rh = calculate_koistinen_saltikoff(temp, None,
+                                                  r_h=td2hr(temp, tempd))
+        self.assertTrue((result_rh == result).all())
+
+    def test_calculate_koistinen_saltikoff_overflow(self):
+        temp = array([-60.0, -150.0, 45.0])
+        tempd = array([-70.0, -160.0, 40.0])
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            result = calculate_koistinen_saltikoff(temp, tempd)
+
+        self.assertEqual(result[0], 1)
+        self.assertEqual(result[1], 1)
+        self.assertTrue(0 <= result[2] < 1e-20)
+
+    def test_expit(self):
+        self.assertEqual(expit(0), 0.5)
+        self.assertAlmostEqual(expit(2.0) + expit(-2.0), 1)
+        self.assertEqual(expit(-1000.0), 0)
+        self.assertEqual(expit(array([1000.0]))[0], 1)
+        self.assertEqual(expit(array([1.0], dtype='float32')).dtype,
+                         'float32')
 
     def test_calculate_single_threshold(self):
         field = ones((3, 1))
@@ -80,6 +116,55 @@ class TestCalculateRosMethods(unittest.TestCase):
             "Incorrect thresholds, th_s value must be smaller than th_r",
             str(cm.exception))
 
+    def test_calculate_threshold_fields(self):
+        field = array([[0.5, 1.5], [0.5, 1.5]])
+        th_s = array([[1.0], [0.0]])
+
+        result = calculate_single_threshold(field, th_s)
+        self.assertEqual(result.tolist(), [[1, 0], [0, 0]])
+
+        result = calculate_dual_threshold(field, th_s, th_s + 1)
+        self.assertEqual(result.tolist(), [[1, 0.5], [0.5, 0]])
+
+        result = calculate_linear_transition(field, th_s, array([2.0, 2.0]))
+        self.assertEqual(result.tolist(), [[1, 0.5], [0.75, 0.25]])
+
+        with self.assertRaises(ValueError):
+            calculate_dual_threshold(field, th_s, array([[2.0], [-1.0]]))
+
+    def test_calculate_threshold_not_in_place(self):
+        field = array([-1.0, 0.5, 2.0, nan])
+
+        for function, args in ((calculate_single_threshold, (1.5,)),
+                               (calculate_dual_threshold, (0, 1)),
+                               (calculate_linear_transition, (0, 1))):
+            result = function(field, *args)
+            self.assertEqual(result[0], 1)
+            self.assertEqual(result[2], 0)
+            self.assertTrue(isnan(result[3]))
+            self.assertEqual(field[0], -1.0)
+
+    @unittest.skipIf(dask is None, 'dask is not installed')
+    def test_dask(self):
+        temp = array([[20.0, 2.0], [-1.0, 1.0]])
+        tempd = array([[20.0, 0.0], [-1.0, -40.0]])
+        lazy_temp = dask.array.from_array(temp, chunks=1)
+        lazy_tempd = dask.array.from_array(tempd, chunks=1)
+
+        for function, args in ((calculate_single_threshold, (1.5,)),
+                               (calculate_dual_threshold, (0, 3)),
+                               (calculate_linear_transition, (0, 3))):
+            result = function(lazy_temp, *args)
+            self.assertIsInstance(result, dask.array.Array)
+            self.assertTrue((result.compute() == function(temp, *args))
+                            .all())
+
+        result = calculate_koistinen_saltikoff(lazy_temp, lazy_tempd)
+        self.assertIsInstance(result, dask.array.Array)
+        self.assertTrue((abs(result.compute() -
+                             calculate_koistinen_saltikoff(temp, tempd))
+                         < 1e-12).all())
+
 
 def ks_rh(temp, tempd):
     """
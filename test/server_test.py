@@ -0,0 +1,113 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy
+
+from osgeo import gdal, osr
+from pypros.pros import PyPros
+from pypros.server import PyProsServer, UnixHTTPConnection, query
+
+
+class TestServer(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.mkdtemp()
+        size = (3, 3)
+        fields = {'tair': numpy.array([[20.0] * 3, [2.0] * 3, [-1.0] * 3]),
+                  'tdew': numpy.array([[20.0] * 3, [0.0] * 3, [-1.0] * 3]),
+                  'dem': numpy.array([[0.0] * 3, [1500.0] * 3,
+                                      [3000.0] * 3]),
+                  'refl': numpy.full(size, 12.0)}
+        cls.files = {}
+        for name, field in fields.items():
+            cls.files[name] = os.path.join(cls.tmp_dir, name + '.tif')
+            driver = gdal.GetDriverByName('GTiff')
+            d_s = driver.Create(cls.files[name], size[1], size[0], 1,
+                                gdal.GDT_Float32)
+            d_s.GetRasterBand(1).WriteArray(field)
+            d_s.SetGeoTransform((0, 100, 0, 300, 0, -100))
+            proj = osr.SpatialReference()
+            proj.ImportFromEPSG(25831)
+            d_s.SetProjection(proj.ExportToWkt())
+            d_s = None
+
+        cls.socket_path = os.path.join(cls.tmp_dir, 'pypros.sock')
+        cls.server = PyProsServer({'domains': {'catalonia': cls.files}},
+                                  cls.socket_path, workers=2,
+                                  queue_size=1)
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.thread.join()
+
+    def test_query(self):
+        variables_file = [self.files['tair'], self.files['tdew'],
+                          self.files['dem']]
+        for bbox in (None, [0, 0, 300, 200]):
+            field, geotransform, projection = query(
+                self.socket_path, domain='catalonia', method='single_tw',
+                threshold=1.5, bbox=bbox)
+            inst = PyPros(variables_file, 'single_tw', 1.5, bbox=bbox)
+            self.assertTrue((field == inst.result).all())
+            self.assertEqual(geotransform, inst.geotransform)
+            self.assertEqual(projection, inst.out_proj.ExportToWkt())
+
+        field, _, _ = query(self.socket_path, domain='catalonia',
+                            method='ks', product='masked')
+        self.assertEqual(field.dtype, numpy.uint8)
+        self.assertEqual(field.shape, (3, 3))
+
+    def test_query_wrong(self):
+        with self.assertRaises(ValueError) as cm:
+            query(self.socket_path, domain='pyrenees')
+        self.assertEqual('Non valid domain. Valid values are catalonia',
+                         str(cm.exception))
+
+        with self.assertRaises(ValueError) as cm:
+            query(self.socket_path, domain='catalonia', method='dual_ta',
+                  threshold=1)
+        self.assertEqual('The thresholds for the method dual_ta must be a ' +
+                         'list/tuple of length two', str(cm.exception))
+
+        # All the workers and the queue are busy
+        for _ in range(3):
+            self.server._slots.acquire()
+        try:
+            with self.assertRaises(RuntimeError):
+                query(self.socket_path, domain='catalonia')
+        finally:
+            for _ in range(3):
+                self.server._slots.release()
+
+    def test_endpoints(self):
+        connection = UnixHTTPConnection(self.socket_path)
+        connection.request('GET', '/domains')
+        response = connection.getresponse()
+        self.assertEqual(json.loads(response.read()),
+                         {'catalonia': ['tair', 'tdew', 'dem', 'refl']})
+
+        connection.request('POST', '/pros', json.dumps(
+            {'domain': 'catalonia', 'format': 'tiff'}))
+        response = connection.getresponse()
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.getheader('Content-Type'), 'image/tiff')
+        response.read()
+
+        connection.request('POST', '/reload',
+                           json.dumps({'domain': 'catalonia'}))
+        self.assertEqual(connection.getresponse().status, 200)
+        connection.close()
+        backend = self.server.domains['catalonia'].backend
+        self.assertEqual([key[0] for key in backend._cache],
+                         [self.files['dem']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+from pypros.statistics import PrecipTypeCounter
+from pypros.statistics import aggregate
+from pypros.categories import NODATA_CLASS
+import numpy
+
+
+def _load_step(item):
+    classes = numpy.full((2, 3), item % 16, dtype=numpy.uint8)
+    classes[0][0] = NODATA_CLASS
+    return classes
+
+
+class TestStatistics(unittest.TestCase):
+    def test_update(self):
+        counter = PrecipTypeCounter((2, 3))
+        counter.update(numpy.array([[0, 1, 6], [11, 15, NODATA_CLASS]],
+                                   dtype=numpy.uint8))
+        counter.update(numpy.array([[0, 0, 0], [11, 7, 3]],
+                                   dtype=numpy.uint8))
+
+        self.assertEqual(counter.steps, 2)
+        self.assertEqual(counter.counts.shape, (4, 2, 3))
+        self.assertEqual(counter.counts[0][0][0], 2)
+        self.assertEqual(counter.counts[2][0][2], 1)
+        self.assertEqual(counter.counts[3][1][0], 2)
+        self.assertEqual(counter.valid[1][2], 1)
+        self.assertEqual(counter.counts[:, 1, 2].sum(), 1)
+
+        freqs = counter.frequencies()
+        self.assertEqual(freqs.dtype, numpy.float32)
+        self.assertAlmostEqual(freqs[2][1][1], 0.5)
+
+        with self.assertRaises(IndexError):
+            counter.update(numpy.zeros((3, 3), dtype=numpy.uint8))
+
+    def test_classes(self):
+        counter = PrecipTypeCounter((2, 3), by_phase=False,
+                                    dtype=numpy.uint16)
+        counter.update(numpy.full((2, 3), 12, dtype=numpy.uint8))
+
+        self.assertEqual(counter.counts.shape, (16, 2, 3))
+        self.assertEqual(counter.counts.dtype, numpy.uint16)
+        self.assertTrue((counter.counts[12] == 1).all())
+        self.assertEqual(counter.counts.sum(), 6)
+
+    def test_merge(self):
+        first = aggregate(range(10), (2, 3), loader=_load_step)
+        second = aggregate(range(10, 16), (2, 3), loader=_load_step)
+        first.merge(second)
+        total = aggregate(range(16), (2, 3), loader=_load_step)
+
+        self.assertEqual(first.steps, 16)
+        self.assertTrue((first.counts == total.counts).all())
+        self.assertTrue((first.valid == total.valid).all())
+        self.assertEqual(total.valid[0][0], 0)
+        self.assertTrue(numpy.isnan(total.frequencies()[0][0][0]))
+
+        with self.assertRaises(ValueError):
+            first.merge(PrecipTypeCounter((2, 3), by_phase=False))
+
+        # The merged counters would wrap around
+        first = PrecipTypeCounter((2, 3), dtype=numpy.uint16)
+        second = PrecipTypeCounter((2, 3), dtype=numpy.uint16)
+        first.steps, second.steps = 40000, 30000
+        with self.assertRaises(OverflowError):
+            first.merge(second)
+        self.assertEqual(first.steps, 40000)
+
+    def test_parallel(self):
+        serial = aggregate(range(40), (2, 3), loader=_load_step,
+                           by_phase=False)
+        parallel = aggregate(range(40), (2, 3), loader=_load_step,
+                             by_phase=False, workers=2, chunk_size=7)
+
+        self.assertEqual(parallel.steps, 40)
+        self.assertTrue((serial.counts == parallel.counts).all())
+
+        # More chunks than in flight, read lazily from a generator
+        parallel = aggregate((step for step in range(40)), (2, 3),
+                             loader=_load_step, by_phase=False, workers=2,
+                             chunk_size=3)
+        self.assertEqual(parallel.steps, 40)
+        self.assertTrue((serial.counts == parallel.counts).all())
+
+    def test_save_load(self):
+        counter = aggregate(range(5), (2, 3), loader=_load_step)
+        file_name = os.path.join(tempfile.mkdtemp(), 'counts.npz')
+        counter.save(file_name)
+
+        loaded = PrecipTypeCounter.load(file_name)
+        self.assertTrue(loaded.by_phase)
+        self.assertEqual(loaded.steps, 5)
+        self.assertTrue((loaded.counts == counter.counts).all())
@@ -0,0 +1,121 @@
+import json
+import os
+import sqlite3
+import struct
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+
+import numpy
+
+from osgeo import osr
+from pypros.tiles import TileWriter, encode_png, get_tile_bounds
+from pypros.tiles import get_tile_range, CLASS_COLORS
+
+
+class TestTiles(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        proj = osr.SpatialReference()
+        proj.ImportFromEPSG(3857)
+        cls.projection = proj.ExportToWkt()
+        cls.geotransform = (200000, 1000, 0, 4700000, 0, -1000)
+
+        cls.classes = numpy.zeros((100, 120), dtype=int)
+        cls.classes[10:50, 20:80] = 7
+        cls.classes[60:90, :] = 13
+        cls.classes[0][0] = -9999
+
+    def test_encode_png(self):
+        tile = numpy.arange(16, dtype=numpy.uint8).reshape((4, 4))
+        image = encode_png(tile, CLASS_COLORS)
+
+        self.assertEqual(image[:8], b'\x89PNG\r\n\x1a\n')
+        width, height = struct.unpack('>II', image[16:24])
+        self.assertEqual((width, height), (4, 4))
+
+        idat = image.index(b'IDAT')
+        length = struct.unpack('>I', image[idat - 4:idat])[0]
+        rows = zlib.decompress(image[idat + 4:idat + 4 + length])
+        self.assertEqual(rows, b''.join(b'\x00' + row.tobytes()
+                                        for row in tile))
+
+    def test_tile_range(self):
+        self.assertEqual(get_tile_range(get_tile_bounds(3, 5, 4), 4),
+                         (3, 5, 3, 5))
+        self.assertEqual(get_tile_range((-1, -1, 1, 1), 1), (0, 0, 1, 1))
+
+    def test_write_xyz(self):
+        out_path = tempfile.mkdtemp()
+        writer = TileWriter(out_path, [5, 8])
+
+        written = writer.write(self.classes, self.geotransform,
+                               self.projection)
+        self.assertTrue(written > 0)
+        with open(os.path.join(out_path, 'hashes.json')) as f_p:
+            hashes = json.load(f_p)
+        self.assertEqual(len(hashes), written)
+        for key in hashes:
+            self.assertTrue(os.path.exists(os.path.join(out_path,
+                                                        key + '.png')))
+
+        # Nothing changed, nothing is written
+        self.assertEqual(writer.write(self.classes, self.geotransform,
+                                      self.projection), 0)
+
+        # Tiles becoming dry are removed
+        writer.write(numpy.zeros((100, 120)), self.geotransform,
+                     self.projection)
+        for key in hashes:
+            self.assertFalse(os.path.exists(os.path.join(out_path,
+                                                         key + '.png')))
+
+    def test_write_mbtiles(self):
+        out_file = os.path.join(tempfile.mkdtemp(), 'pros.mbtiles')
+        writer = TileWriter(out_file, [5, 8], tile_format='mbtiles')
+
+        written = writer.write(self.classes, self.geotransform,
+                               self.projection)
+        with sqlite3.connect(out_file) as conn:
+            tiles = conn.execute('SELECT zoom_level, tile_column, ' +
+                                 'tile_row FROM tiles').fetchall()
+            metadata = dict(conn.execute('SELECT * FROM metadata'))
+        self.assertEqual(len(tiles), written)
+        self.assertEqual(metadata['minzoom'], '5')
+        self.assertEqual(metadata['maxzoom'], '8')
+
+        self.assertEqual(writer.write(self.classes, self.geotransform,
+                                      self.projection), 0)
+
+    def test_write_blocks(self):
+        # The tiles are the same whatever the blocks warped together
+        hashes = []
+        for block_tiles in (8, 2):
+            out_path = tempfile.mkdtemp()
+            with mock.patch('pypros.tiles.BLOCK_TILES', block_tiles):
+                TileWriter(out_path, [8, 11]).write(
+                    self.classes, self.geotransform, self.projection)
+            with open(os.path.join(out_path, 'hashes.json')) as f_p:
+                hashes.append(json.load(f_p))
+        self.assertGreater(len(hashes[0]), 8)
+        self.assertEqual(hashes[0], hashes[1])
+
+    def test_existing_mbtiles(self):
+        # MBTiles files written by other tools have no hashes table
+        out_file = os.path.join(tempfile.mkdtemp(), 'other.mbtiles')
+        with sqlite3.connect(out_file) as conn:
+            conn.execute('CREATE TABLE metadata (name TEXT, value TEXT)')
+        writer = TileWriter(out_file, [5], tile_format='mbtiles')
+        self.assertGreater(writer.write(self.classes, self.geotransform,
+                                        self.projection), 0)
+
+    def test_wrong_format(self):
+        with self.assertRaises(ValueError) as cm:
+            TileWriter('/tmp/tiles', [5], tile_format='png')
+        self.assertEqual('Non valid tile format. Valid values are xyz ' +
+                         'and mbtiles', str(cm.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()